@@ -0,0 +1,7 @@
+'''
+Benchmarks reprodutíveis do Twins com corpus sintéticos. Para executá-los a partir da raiz do repositório:
+
+    python -m benchmarks --escalas pequena media --saida resultado.json [--comparar referencia.json]
+'''
+from benchmarks.gerador import gerar_corpus_csv
+from benchmarks.executar import ESCALAS, comparar_resultados, executar_benchmarks, executar_escala
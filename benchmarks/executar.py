@@ -0,0 +1,207 @@
+# Imports Python
+import io
+import os
+import sys
+import json
+import shutil
+import platform
+import argparse
+import datetime as dt
+from time import perf_counter
+from contextlib import contextmanager, redirect_stdout
+import numpy as np
+import pandas as pd
+import gensim
+# Imports Twins
+from twins.control import Twins
+from twins.metricas import configurar_metricas, obter_metricas
+from benchmarks.gerador import gerar_corpus_csv
+
+# Parâmetros do gerador de corpus de cada escala. Os parâmetros não informados usam os defaults de gerar_corpus_csv
+ESCALAS = {'pequena': dict(num_fichas=1000, tam_vocabulario=2000, cardinalidade=200)
+          ,'media': dict(num_fichas=10000, tam_vocabulario=10000, cardinalidade=1000)
+          ,'grande': dict(num_fichas=100000, tam_vocabulario=50000, cardinalidade=5000)}
+
+@contextmanager
+def _diretorio(caminho):
+    '''
+    Muda o diretório de trabalho durante o bloco with, pois os projetos são criados em "./projetos".
+    '''
+    anterior = os.getcwd()
+    os.makedirs(caminho, exist_ok=True)
+    os.chdir(caminho)
+    try:
+        yield caminho
+    finally:
+        os.chdir(anterior)
+
+def _cronometrar(funcao, *args, silencioso=True, **kwargs):
+    '''
+    Executa a função, descartando as mensagens impressas se silencioso for True.
+    Retorno: tupla com o tempo gasto em segundos (float) e o retorno da função
+    '''
+    saida = io.StringIO() if silencioso else sys.stdout
+    with redirect_stdout(saida):
+        inicio = perf_counter()
+        retorno = funcao(*args, **kwargs)
+        return perf_counter() - inicio, retorno
+
+def _latencias(tempos):
+    '''
+    Resume uma lista de latências, em segundos.
+    Retorno: dicionário com a quantidade, a média e os percentis 50 e 99
+    '''
+    tempos = np.array(tempos)
+    if not len(tempos): return dict(consultas=0, media=None, p50=None, p99=None)
+    return dict(consultas=len(tempos), media=float(tempos.mean()), p50=float(np.percentile(tempos, 50))
+               ,p99=float(np.percentile(tempos, 99)))
+
+def executar_escala(escala, parametros=None, num_consultas=200, num_testes=100, num_processos=1, modelos=None, semente=0
+                   ,silencioso=True):
+    '''
+    Executa os benchmarks de uma escala no diretório de trabalho atual: gera o corpus sintético, inclui os documentos,
+    monta o dicionário, vetoriza os modelos, mede a latência de "semelhantes" e a vazão de "testar_buscador" com os pares
+    de fichas gêmeas do gerador. O projeto da escala é recriado a cada execução.
+    Parâmetros:
+        escala (str) --> Nome da escala, usado no nome do projeto e, se parametros for None, para obter os parâmetros em
+            ESCALAS
+        parametros (dict) --> Parâmetros do gerador de corpus (ver gerar_corpus_csv). Se None, usa os de ESCALAS
+            (default: None)
+        num_consultas (int) --> Quantidade de fichas pesquisadas na medição da latência de "semelhantes" (default: 200)
+        num_testes (int) --> Quantidade máxima de pares de fichas usados em "testar_buscador" (default: 100)
+        num_processos (int) --> Quantidade de CPUs usadas em "vetorizar" (default: 1)
+        modelos (list de string) --> Modelos vetorizados. Se None, vetoriza todos os modelos (default: None)
+        semente (int) --> Semente do gerador do corpus e do sorteio das consultas (default: 0)
+        silencioso (boolean) --> Indica se as mensagens impressas pelo Twins são descartadas (default: True)
+    Retorno: dicionário com os resultados da escala
+    '''
+    parametros = dict(ESCALAS[escala] if parametros is None else parametros, semente=semente)
+    projeto = f'benchmark_{escala}'
+    shutil.rmtree(os.path.join('projetos', projeto), ignore_errors=True)
+    os.makedirs('dados', exist_ok=True)
+    resultado = {}
+    # Corpus sintético
+    arq_csv = os.path.join('dados', f'{projeto}.csv')
+    tempo, corpus = _cronometrar(gerar_corpus_csv, arq_csv, **parametros)
+    resultado['corpus'] = dict(linhas=corpus['num_linhas'], fichas=corpus['num_fichas'], pares=len(corpus['pares'])
+                              ,bytes=os.path.getsize(arq_csv), segundos_geracao=tempo, parametros=corpus['parametros'])
+    twins = Twins(projeto)
+    twins.ajustar_cache(max_itens=0)
+    # Inclusão dos documentos, sem a construção dos modelos
+    tempo, _ = _cronometrar(twins.corpus.incluir_documentos_csv, arq_csv, ind_tokens=False, construir=False
+                            ,total_docs=corpus['num_linhas'], silencioso=silencioso)
+    resultado['incluir_documentos_csv'] = dict(segundos=tempo, linhas_por_segundo=corpus['num_linhas'] / tempo)
+    # Dicionário
+    tempo, _ = _cronometrar(twins.corpus.montar_dicionario, silencioso=silencioso)
+    resultado['montar_dicionario'] = dict(segundos=tempo, tokens=twins.corpus.num_tokens)
+    # Modelos, com os tempos de treinamento e de indexação de cada modelo obtidos dos spans das métricas
+    metricas = obter_metricas()
+    ativo = metricas.ativo
+    configurar_metricas()
+    metricas.limpar()
+    try:
+        tempo, _ = _cronometrar(twins.corpus.vetorizar, modelos=modelos, num_processos=num_processos, forcar=True
+                                ,silencioso=silencioso)
+        spans = list(metricas.spans)
+    finally:
+        metricas.limpar()
+        configurar_metricas(ativo=ativo)
+    resultado['vetorizar'] = dict(segundos=tempo, modelos={})
+    etapas = {'treinar_modelo': 'treinamento', 'indexar_modelo': 'indexacao'}
+    for span in spans:
+        if span['nome'] not in etapas: continue
+        tempos = resultado['vetorizar']['modelos'].setdefault(span['rotulos']['modelo'], {})
+        tempos[etapas[span['nome']]] = tempos.get(etapas[span['nome']], 0) + span['duracao']
+    # Latência de "semelhantes", com o cache desativado e os modelos já carregados
+    rng = np.random.RandomState(semente)
+    fichas = twins.corpus._dao.obter_fichas()
+    consultas = rng.choice(len(fichas), size=min(num_consultas, len(fichas)), replace=False)
+    _cronometrar(twins.carregar, silencioso=silencioso)
+    _cronometrar(twins.semelhantes, ficha=fichas[0], silencioso=silencioso)
+    tempos = [_cronometrar(twins.semelhantes, ficha=fichas[i], silencioso=silencioso)[0] for i in consultas]
+    resultado['semelhantes'] = _latencias(tempos)
+    # Vazão de "testar_buscador" com os pares de fichas gêmeas
+    pares = corpus['pares'][:num_testes]
+    tempo, testes = _cronometrar(twins.testar_buscador, vetor_testes=pares, silencioso=silencioso)
+    resultado['testar_buscador'] = dict(pares=len(pares), segundos=tempo
+                                       ,pares_por_segundo=len(pares) / tempo if pares else None
+                                       ,sucessos=int(testes['sucesso'].fillna(False).astype(bool).sum()))
+    return resultado
+
+def executar_benchmarks(escalas=('pequena', ), arq_resultado=None, diretorio='./benchmarks_dados', num_consultas=200
+                       ,num_testes=100, num_processos=1, modelos=None, semente=0, silencioso=True):
+    '''
+    Executa os benchmarks nas escalas informadas e grava os resultados em JSON, com a descrição do ambiente, para que
+    execuções diferentes possam ser comparadas por "comparar_resultados".
+    Parâmetros:
+        escalas (iterável de string) --> Nomes das escalas, conforme ESCALAS (default: ('pequena', ))
+        arq_resultado (str) --> Arquivo JSON onde os resultados são gravados. Se None, não grava (default: None)
+        diretorio (str) --> Diretório de trabalho onde são criados os CSVs e os projetos (default: './benchmarks_dados')
+        num_consultas, num_testes, num_processos, modelos, semente, silencioso --> Ver executar_escala
+    Retorno: dicionário com os resultados
+    '''
+    resultados = dict(data=dt.datetime.now().isoformat(timespec='seconds')
+                     ,ambiente=dict(python=platform.python_version(), plataforma=platform.platform()
+                                   ,cpus=os.cpu_count(), numpy=np.__version__, pandas=pd.__version__
+                                   ,gensim=gensim.__version__)
+                     ,configuracao=dict(num_consultas=num_consultas, num_testes=num_testes, num_processos=num_processos
+                                       ,modelos=modelos, semente=semente)
+                     ,escalas={})
+    arq_resultado = os.path.abspath(arq_resultado) if arq_resultado else None
+    with _diretorio(diretorio):
+        for escala in escalas:
+            if escala not in ESCALAS:
+                print(f'A escala "{escala}" não foi definida. As escalas disponíveis são: {", ".join(ESCALAS)}.')
+                continue
+            print(f'Executando os benchmarks da escala "{escala}"')
+            resultados['escalas'][escala] = executar_escala(escala, num_consultas=num_consultas, num_testes=num_testes
+                                                           ,num_processos=num_processos, modelos=modelos
+                                                           ,semente=semente, silencioso=silencioso)
+    if arq_resultado:
+        with open(arq_resultado, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+        print(f'Resultados gravados em "{arq_resultado}"')
+    return resultados
+
+def comparar_resultados(arq_base, arq_novo):
+    '''
+    Compara os resultados numéricos de duas execuções dos benchmarks.
+    Parâmetros:
+        arq_base (str) --> Arquivo JSON da execução de referência
+        arq_novo (str) --> Arquivo JSON da execução a ser comparada
+    Retorno: Pandas DataFrame indexado pela métrica ("escala.etapa.medida"), com os valores das duas execuções e a razão
+        entre o novo valor e o de referência
+    '''
+    def achatar(dados, prefixo=''):
+        valores = {}
+        for chave, valor in dados.items():
+            if chave == 'parametros': continue
+            if isinstance(valor, dict): valores.update(achatar(valor, f'{prefixo}{chave}.'))
+            elif isinstance(valor, (int, float)) and not isinstance(valor, bool): valores[f'{prefixo}{chave}'] = valor
+        return valores
+    with open(arq_base, encoding='utf-8') as f:
+        base = achatar(json.load(f)['escalas'])
+    with open(arq_novo, encoding='utf-8') as f:
+        novo = achatar(json.load(f)['escalas'])
+    df = pd.DataFrame({'base': pd.Series(base, dtype=float), 'novo': pd.Series(novo, dtype=float)})
+    df['razao'] = df['novo'] / df['base']
+    return df
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description='Benchmarks do Twins com corpus sintéticos')
+    parser.add_argument('--escalas', nargs='+', default=['pequena'], choices=list(ESCALAS))
+    parser.add_argument('--saida', default='benchmark.json', help='Arquivo JSON dos resultados')
+    parser.add_argument('--diretorio', default='./benchmarks_dados', help='Diretório de trabalho dos benchmarks')
+    parser.add_argument('--consultas', type=int, default=200, help='Consultas da medição de latência')
+    parser.add_argument('--testes', type=int, default=100, help='Pares de fichas de testar_buscador')
+    parser.add_argument('--processos', type=int, default=1, help='CPUs usadas em vetorizar')
+    parser.add_argument('--modelos', nargs='+', default=None, help='Modelos vetorizados')
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--comparar', metavar='ARQ_BASE', help='Compara a saída com os resultados de referência')
+    args = parser.parse_args(argumentos)
+    executar_benchmarks(args.escalas, arq_resultado=args.saida, diretorio=args.diretorio, num_consultas=args.consultas
+                       ,num_testes=args.testes, num_processos=args.processos, modelos=args.modelos
+                       ,semente=args.semente)
+    if args.comparar:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(comparar_resultados(args.comparar, args.saida))
@@ -0,0 +1,122 @@
+# Imports Python
+import csv
+import itertools
+import numpy as np
+
+SILABAS = ['ba', 'be', 'bi', 'bo', 'bu', 'ca', 'ce', 'co', 'da', 'de', 'di', 'do', 'fa', 'fe', 'fi', 'ga', 'go', 'la', 'le'
+          ,'li', 'lo', 'lu', 'ma', 'me', 'mi', 'mo', 'mu', 'na', 'ne', 'no', 'pa', 'pe', 'pi', 'po', 'ra', 're', 'ri', 'ro'
+          ,'sa', 'se', 'si', 'so', 'ta', 'te', 'ti', 'to', 'va', 've', 'vi', 'vo']
+
+def gerar_vocabulario(tamanho, rng):
+    '''
+    Gera palavras sintéticas formadas por duas a cinco sílabas, todas com pelo menos quatro letras, para que não sejam
+    descartadas no pré-processamento dos atributos "word".
+    Parâmetros:
+        tamanho (int) --> Quantidade de palavras distintas
+        rng (numpy.random.RandomState) --> Gerador de números aleatórios
+    Retorno: lista com as palavras (list de string)
+    '''
+    palavras, vistas = [], set()
+    for num_silabas in itertools.cycle(range(2, 6)):
+        if len(palavras) >= tamanho: break
+        palavra = ''.join(rng.choice(SILABAS, size=num_silabas))
+        if palavra in vistas: continue
+        vistas.add(palavra)
+        palavras.append(palavra)
+    return palavras
+
+def probabilidades_zipf(tamanho, expoente):
+    '''
+    Calcula as probabilidades de uma distribuição de Zipf truncada, na qual a frequência do item de posição i é proporcional
+    a 1/i^expoente. Com expoente 0 a distribuição é uniforme.
+    Parâmetros:
+        tamanho (int) --> Quantidade de itens
+        expoente (float) --> Expoente da distribuição
+    Retorno: vetor com as probabilidades (numpy.array)
+    '''
+    pesos = 1 / np.arange(1, tamanho + 1) ** expoente
+    return pesos / pesos.sum()
+
+def gerar_corpus_csv(arq_csv, num_fichas=1000, num_atributos=3, num_words=1, tam_vocabulario=5000, palavras_por_word=12
+                    ,cardinalidade=500, zipf=1.1, num_pessoas=None, recorrencia=0.2, proporcao_gemeos=0.05, semente=0):
+    '''
+    Gera um arquivo CSV sintético no formato lido por Corpus.incluir_documentos_csv com ind_tokens=False. A primeira coluna
+    traz o nome da ficha e as demais são atributos categóricos, atributos "word" de texto livre e os atributos de
+    relacionamento "cpf_socios" e "cnpj_vinculos". As palavras e os valores dos atributos seguem uma distribuição de Zipf,
+    o que reproduz a assimetria do vocabulário dos dados reais. Uma parte das linhas repete uma ficha já gerada, como
+    nas cargas em que uma ficha recebe vários documentos, e uma parte das fichas é gerada como gêmea de outra, com parte
+    dos valores trocados, o que forma os pares usados nos testes do buscador. A mesma semente gera sempre o mesmo arquivo.
+    Parâmetros:
+        arq_csv (str) --> Endereço do arquivo CSV a ser gerado
+        num_fichas (int) --> Quantidade de fichas distintas (default: 1000)
+        num_atributos (int) --> Quantidade de atributos categóricos (default: 3)
+        num_words (int) --> Quantidade de atributos "word" (default: 1)
+        tam_vocabulario (int) --> Quantidade de palavras distintas dos atributos "word" (default: 5000)
+        palavras_por_word (int) --> Quantidade média de palavras de um atributo "word" em cada linha (default: 12)
+        cardinalidade (int) --> Quantidade de valores distintos de cada atributo categórico (default: 500)
+        zipf (float) --> Expoente da distribuição de Zipf das palavras e dos valores (default: 1.1)
+        num_pessoas (int) --> Quantidade de CPFs e de CNPJs distintos. Se None, usa metade de num_fichas (default: None)
+        recorrencia (float) --> Proporção das linhas que repetem uma ficha já gerada (default: 0.2)
+        proporcao_gemeos (float) --> Proporção das fichas geradas como gêmeas de outra (default: 0.05)
+        semente (int) --> Semente do gerador de números aleatórios (default: 0)
+    Retorno: dicionário com o endereço do arquivo, a quantidade de linhas e de fichas, os pares de fichas gêmeas
+        (list de tuple (str, str)) e os parâmetros usados
+    '''
+    parametros = dict(num_fichas=num_fichas, num_atributos=num_atributos, num_words=num_words
+                     ,tam_vocabulario=tam_vocabulario, palavras_por_word=palavras_por_word, cardinalidade=cardinalidade
+                     ,zipf=zipf, num_pessoas=num_pessoas, recorrencia=recorrencia, proporcao_gemeos=proporcao_gemeos
+                     ,semente=semente)
+    rng = np.random.RandomState(semente)
+    num_pessoas = num_pessoas or max(num_fichas // 2, 1)
+    vocabulario = np.array(gerar_vocabulario(tam_vocabulario, rng))
+    p_palavras = probabilidades_zipf(tam_vocabulario, zipf)
+    p_valores = probabilidades_zipf(cardinalidade, zipf)
+    p_pessoas = probabilidades_zipf(num_pessoas, zipf)
+    # Os CPFs e CNPJs são sorteados uma vez, para que as mesmas pessoas apareçam em várias fichas
+    cpfs = [f'{numero:011d}' for numero in rng.randint(10**10, 10**11 - 1, size=num_pessoas, dtype=np.int64)]
+    cnpjs = [f'{numero:014d}' for numero in rng.randint(10**13, 10**14 - 1, size=num_pessoas, dtype=np.int64)]
+    colunas = (['ficha'] + [f'atributo_{i:02d}' for i in range(1, num_atributos + 1)]
+              + [f'descricao_{i:02d}_word' for i in range(1, num_words + 1)] + ['cpf_socios', 'cnpj_vinculos'])
+
+    def sortear_linha():
+        linha = [' '.join(f'v{valor}' for valor in rng.choice(cardinalidade, size=rng.randint(1, 4), p=p_valores))
+                 for _ in range(num_atributos)]
+        linha += [' '.join(vocabulario[rng.choice(tam_vocabulario, size=max(rng.poisson(palavras_por_word), 1)
+                                                  ,p=p_palavras)]) for _ in range(num_words)]
+        linha.append(' '.join(cpfs[i] for i in rng.choice(num_pessoas, size=rng.randint(0, 4), p=p_pessoas)))
+        linha.append(' '.join(cnpjs[i] for i in rng.choice(num_pessoas, size=rng.randint(0, 3), p=p_pessoas)))
+        return linha
+
+    def perturbar(linha):
+        # Troca cerca de um terço dos valores de cada célula da ficha original por valores sorteados
+        nova = []
+        for celula, sorteada in zip(linha, sortear_linha()):
+            trocas = sorteada.split()
+            nova.append(' '.join(trocas[rng.randint(len(trocas))] if trocas and rng.rand() < 1/3 else valor
+                                 for valor in celula.split()))
+        return nova
+
+    num_linhas = int(round(num_fichas / (1 - recorrencia))) if recorrencia < 1 else num_fichas
+    fichas, linhas, pares = [], {}, []
+    with open(arq_csv, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.writer(f, lineterminator='\n')
+        escritor.writerow(colunas)
+        for i in range(num_linhas):
+            # Depois de geradas todas as fichas, as linhas só repetem fichas. Antes disso, as fichas que faltam gerar
+            # ocupam obrigatoriamente as últimas linhas
+            faltam = num_fichas - len(fichas)
+            if fichas and (not faltam or (faltam < num_linhas - i and rng.rand() < recorrencia)):
+                # Repete uma ficha já gerada com um novo documento
+                ficha = fichas[rng.randint(len(fichas))]
+                linha = sortear_linha()
+            else:
+                ficha = f'ficha_{len(fichas):08d}'
+                if len(fichas) > 1 and rng.rand() < proporcao_gemeos:
+                    original = fichas[rng.randint(len(fichas))]
+                    linha = perturbar(linhas[original])
+                    pares.append((ficha, original))
+                else: linha = sortear_linha()
+                fichas.append(ficha)
+                linhas[ficha] = linha
+            escritor.writerow([ficha] + linha)
+    return dict(arq_csv=arq_csv, num_linhas=num_linhas, num_fichas=len(fichas), pares=pares, parametros=parametros)
@@ -0,0 +1,112 @@
+'''
+Testes do ServidorTwins contra um socket local, com um corpus sintético pequeno. Para executá-los a partir da raiz do
+repositório:
+
+    python -m unittest tests.test_servidor
+'''
+# Imports Python
+import os
+import io
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+# Imports Twins
+from twins.control import Twins
+from twins.servidor import ServidorTwins, consultar
+from benchmarks.gerador import gerar_corpus_csv
+
+class TestServidorTwins(unittest.TestCase):
+    '''
+    Inicia o servidor em uma porta livre, em um loop de eventos executado em outra thread, e envia as requisições por
+    conexões simultâneas com o cliente "consultar".
+    '''
+    TOP_K = 5
+
+    @classmethod
+    def setUpClass(cls):
+        cls._anterior = os.getcwd()
+        cls._pasta = tempfile.mkdtemp(prefix='twins_servidor_')
+        os.chdir(cls._pasta)
+        arq_csv = os.path.join(cls._pasta, 'corpus.csv')
+        corpus = gerar_corpus_csv(arq_csv, num_fichas=300, tam_vocabulario=500, cardinalidade=50)
+        with redirect_stdout(io.StringIO()):
+            cls.twins = Twins('servidor')
+            cls.twins.ajustar_cache(max_itens=0)
+            cls.twins.corpus.incluir_documentos_csv(arq_csv, ind_tokens=False, construir=False
+                                                    ,total_docs=corpus['num_linhas'])
+            cls.twins.corpus.montar_dicionario()
+            cls.twins.corpus.vetorizar(num_processos=1, forcar=True)
+            cls.twins.carregar()
+        cls.fichas = cls.twins.corpus._dao.obter_fichas()[:24]
+        # Resultados esperados, obtidos diretamente do Twins antes de o servidor ser iniciado
+        cls.esperados = {}
+        for ficha in cls.fichas:
+            cls.twins.semelhantes(ficha, top_k=cls.TOP_K)
+            final = cls.twins.resultados['Final']
+            cls.esperados[ficha] = list(zip(final[('Ficha', '')].tolist(), final[('geral', 'per_sim')].astype(float).tolist()))
+        # A janela longa garante que as requisições simultâneas componham lotes
+        cls.servidor = ServidorTwins(cls.twins, porta=0, janela=0.2, max_lote=64, top_k=cls.TOP_K)
+        cls.loop = asyncio.new_event_loop()
+        cls._thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls._thread.start()
+        with redirect_stdout(io.StringIO()):
+            asyncio.run_coroutine_threadsafe(cls.servidor.iniciar(), cls.loop).result()
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run_coroutine_threadsafe(cls.servidor.encerrar(), cls.loop).result()
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls._thread.join()
+        cls.loop.close()
+        os.chdir(cls._anterior)
+        shutil.rmtree(cls._pasta, ignore_errors=True)
+
+    def _consultar_simultaneamente(self, lotes):
+        '''
+        Envia cada lista de requisições por uma conexão própria, todas ao mesmo tempo, e retorna as respostas de cada uma.
+        '''
+        with ThreadPoolExecutor(max_workers=len(lotes)) as executor:
+            return list(executor.map(lambda requisicoes: consultar(requisicoes, porta=self.servidor.porta), lotes))
+
+    def _verificar_resultado(self, ficha, resposta):
+        self.assertTrue(resposta['ok'], resposta)
+        obtido = [(item['ficha'], item['per_sim']) for item in resposta['resultado']]
+        self.assertEqual(len(obtido), self.TOP_K)
+        self.assertEqual([ficha for ficha, _ in obtido], [ficha for ficha, _ in self.esperados[ficha]])
+        for (_, per_sim), (_, esperado) in zip(obtido, self.esperados[ficha]):
+            self.assertAlmostEqual(per_sim, esperado, places=6)
+
+    def test_resultados_iguais_aos_de_semelhantes(self):
+        lotes = [[{'ficha': ficha} for ficha in self.fichas[inicio::4]] for inicio in range(4)]
+        for requisicoes, respostas in zip(lotes, self._consultar_simultaneamente(lotes)):
+            for requisicao, resposta in zip(requisicoes, respostas):
+                self._verificar_resultado(requisicao['ficha'], resposta)
+
+    def test_requisicoes_agrupadas_em_lotes(self):
+        anteriores = dict(self.servidor.estatisticas)
+        lotes = [[{'ficha': ficha}] for ficha in self.fichas[:12]]
+        self._consultar_simultaneamente(lotes)
+        requisicoes = self.servidor.estatisticas['requisicoes'] - anteriores['requisicoes']
+        num_lotes = self.servidor.estatisticas['lotes'] - anteriores['lotes']
+        self.assertEqual(requisicoes, 12)
+        self.assertLess(num_lotes, requisicoes)
+
+    def test_requisicao_invalida_nao_afeta_o_lote(self):
+        invalidas = [{'ficha': ['x']}, {'ficha': {'a': 'b'}}, {'documento': 'abc'}, {'documento': {'a': 1}}
+                    ,{'ficha': self.fichas[0], 'documento': {}}, {'top_k': 3}, {'ficha': self.fichas[0], 'top_k': -1}]
+        validas = [{'ficha': ficha} for ficha in self.fichas[:6]]
+        # Cada conexão mistura requisições válidas e inválidas, que chegam ao servidor na mesma janela
+        lotes = [validas[:3] + invalidas[:4], invalidas[4:] + validas[3:]]
+        for requisicoes, respostas in zip(lotes, self._consultar_simultaneamente(lotes)):
+            for requisicao, resposta in zip(requisicoes, respostas):
+                if requisicao in validas: self._verificar_resultado(requisicao['ficha'], resposta)
+                else:
+                    self.assertFalse(resposta['ok'], resposta)
+                    self.assertIn('erro', resposta)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# Imports Python
+import multiprocessing as mp
+import threading
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tqdm.notebook import tqdm
+# Imports Twins
+from twins.utils import FormataDeltatime
+from twins.metricas import configurar_metricas, medir, obter_metricas
+
+# Nomes internos simplificados para cronometrar o tempo de execução
+AGORA = dt.datetime.now
+TEMPO = FormataDeltatime()
+
+def _executar_tarefa(funcao, args, descricao, ativo):
+    '''
+    Executa a função de uma tarefa em um processo do pool. Quando as métricas estão ativas no processo principal, a tarefa
+    é executada dentro de um span e os spans registrados no processo são retornados para serem incorporados pelo processo
+    principal, que também chama os hooks. Ao final, o registro das métricas do processo é desativado, para que as tarefas
+    seguintes executadas no mesmo processo não continuem medindo os comandos SQL.
+    Parâmetros:
+        funcao (function) --> Função de módulo executada pela tarefa
+        args (tuple) --> Argumentos da função
+        descricao (str) --> Descrição da tarefa
+        ativo (boolean) --> Indica se as métricas estavam ativas no processo principal ao iniciar a execução das tarefas
+    Retorno: tupla com o retorno da função e a lista dos spans registrados (tuple (object, list de dict))
+    '''
+    # Descarta os hooks, os spans e a pilha de spans abertos herdados do processo principal na criação do processo
+    metricas = configurar_metricas(ativo=ativo)
+    metricas._hooks = []
+    metricas._local = threading.local()
+    metricas.limpar()
+    try:
+        with medir('tarefa', descricao=descricao):
+            resultado = funcao(*args)
+        return resultado, list(metricas.spans)
+    finally:
+        configurar_metricas(ativo=False)
+        metricas.limpar()
+
+class Agendador:
+    '''
+    Executa um grafo acíclico de tarefas em um pool de processos, iniciando cada tarefa assim que as tarefas das quais ela
+    depende forem concluídas. As tarefas prontas são iniciadas pela maior cadeia de tarefas dependentes e, em seguida, pelo
+    maior consumo estimado de memória, desde que caibam nas CPUs e na memória disponíveis. Uma tarefa que sozinha exceda a
+    memória máxima é executada quando nenhuma outra estiver em execução. As funções das tarefas e os seus argumentos devem
+    poder ser enviados para outro processo (funções de módulo e argumentos serializáveis).
+    Parâmetros:
+        num_processos (int) --> Quantidade de CPUs disponíveis para as tarefas. Se 1, as tarefas são executadas em sequência
+                no próprio processo. Se None, usa a quantidade de CPUs da máquina (default: None)
+        memoria_max (int) --> Memória máxima, em bytes, somada das tarefas em execução. Se None, não há limite (default: None)
+    Atributos:
+        num_processos (int) --> Quantidade de CPUs disponíveis para as tarefas
+        memoria_max (int) --> Memória máxima, em bytes, somada das tarefas em execução
+        tarefas (dict str:dict) --> Tarefas incluídas, tendo o nome como chave
+    '''
+    def __init__(self, num_processos=None, memoria_max=None):
+        self.num_processos = max(1, num_processos or mp.cpu_count())
+        self.memoria_max = memoria_max
+        self.tarefas = {}
+
+    def incluir(self, nome, funcao, args=(), dependencias=(), memoria=0, cpus=1, descricao=None):
+        '''
+        Inclui uma tarefa no grafo.
+        Parâmetros:
+            nome (str) --> Nome único da tarefa, usado nas dependências
+            funcao (function) --> Função de módulo executada pela tarefa
+            args (tuple) --> Argumentos da função (default: tupla vazia)
+            dependencias (list de str) --> Nomes das tarefas que devem ser concluídas antes. As dependências que não forem
+                    incluídas no agendador são consideradas concluídas (default: tupla vazia)
+            memoria (int) --> Memória estimada, em bytes, usada pela tarefa (default: 0)
+            cpus (int) --> Quantidade de CPUs ocupadas pela tarefa, limitada a num_processos (default: 1)
+            descricao (str) --> Descrição da tarefa para as mensagens. Se None, usa o nome (default: None)
+        Retorno: None
+        '''
+        if nome in self.tarefas:
+            print(f'A tarefa "{nome}" já foi incluída.')
+            return
+        self.tarefas[nome] = dict(funcao=funcao, args=tuple(args), dependencias=list(dependencias), memoria=memoria
+                                 ,cpus=max(1, min(cpus, self.num_processos)), descricao=descricao or nome)
+
+    def executar(self, ao_concluir=None):
+        '''
+        Executa as tarefas incluídas respeitando as dependências e os limites de CPUs e de memória. Se uma tarefa falhar, as
+        tarefas que dependem dela não são executadas.
+        Parâmetros:
+            ao_concluir (function) --> Função chamada no processo principal a cada tarefa concluída com sucesso, recebendo o
+                    nome da tarefa e o seu retorno (default: None)
+        Retorno: dicionário com o retorno de cada tarefa concluída com sucesso, tendo o nome da tarefa como chave
+        '''
+        pendentes = {nome: [dep for dep in tarefa['dependencias'] if dep in self.tarefas]
+                     for nome, tarefa in self.tarefas.items()}
+        ciclo = self._verificar_ciclos(pendentes)
+        if ciclo:
+            print(f'As tarefas {ciclo} têm dependências circulares e não serão executadas.')
+            return {}
+        prioridades = self._prioridades(pendentes)
+        resultados, falhas, inicios = {}, set(), {}
+        barra = tqdm(total=len(pendentes))
+        def concluir(nome, resultado=None, erro=None):
+            tarefa = self.tarefas[nome]
+            if erro is not None:
+                print(f'A tarefa falhou: {tarefa["descricao"]} ({erro!r})')
+                falhas.add(nome)
+            else:
+                TEMPO.formatar(AGORA() - inicios[nome])
+                print(f'Tarefa concluída em {TEMPO}: {tarefa["descricao"]}')
+                resultados[nome] = resultado
+                if ao_concluir: ao_concluir(nome, resultado)
+            barra.update(1)
+        def prontas():
+            # Descarta as tarefas que dependem de tarefas que falharam e retorna as demais tarefas sem dependências pendentes
+            for nome in [nome for nome, deps in pendentes.items() if falhas.intersection(deps)]:
+                print(f'Tarefa não executada por falha em uma dependência: {self.tarefas[nome]["descricao"]}')
+                del pendentes[nome]
+                falhas.add(nome)
+                barra.update(1)
+            nomes = [nome for nome, deps in pendentes.items() if all(dep in resultados for dep in deps)]
+            return sorted(nomes, key=lambda nome: prioridades[nome], reverse=True)
+        if self.num_processos == 1:
+            while True:
+                nomes = prontas()
+                if not nomes: break
+                nome = nomes[0]
+                del pendentes[nome]
+                tarefa = self.tarefas[nome]
+                print(f'Iniciando a tarefa: {tarefa["descricao"]}')
+                inicios[nome] = AGORA()
+                try:
+                    with medir('tarefa', descricao=tarefa['descricao']):
+                        resultado = tarefa['funcao'](*tarefa['args'])
+                except Exception as erro: concluir(nome, erro=erro)
+                else: concluir(nome, resultado)
+        else:
+            # O estado das métricas é obtido uma única vez, valendo para todas as tarefas desta execução
+            metricas = obter_metricas()
+            ativo = metricas.ativo
+            with ProcessPoolExecutor(max_workers=self.num_processos) as pool:
+                futuros, cpus, memoria = {}, 0, 0
+                while True:
+                    # Inicia as tarefas prontas que cabem nas CPUs e na memória disponíveis
+                    for nome in prontas():
+                        tarefa = self.tarefas[nome]
+                        if futuros and cpus + tarefa['cpus'] > self.num_processos: continue
+                        if futuros and self.memoria_max and memoria + tarefa['memoria'] > self.memoria_max: continue
+                        del pendentes[nome]
+                        print(f'Iniciando a tarefa: {tarefa["descricao"]}')
+                        inicios[nome] = AGORA()
+                        futuro = pool.submit(_executar_tarefa, tarefa['funcao'], tarefa['args'], tarefa['descricao'], ativo)
+                        futuros[futuro] = nome
+                        cpus += tarefa['cpus']
+                        memoria += tarefa['memoria']
+                    if not futuros: break
+                    concluidos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                    for futuro in concluidos:
+                        nome = futuros.pop(futuro)
+                        cpus -= self.tarefas[nome]['cpus']
+                        memoria -= self.tarefas[nome]['memoria']
+                        try:
+                            resultado, spans = futuro.result()
+                            if spans: metricas.incorporar(spans)
+                        except Exception as erro: concluir(nome, erro=erro)
+                        else: concluir(nome, resultado)
+        barra.close()
+        return resultados
+
+    def _prioridades(self, pendentes):
+        '''
+        Calcula a prioridade de cada tarefa: a quantidade de tarefas da maior cadeia que começa nela e a memória estimada.
+        Parâmetros:
+            pendentes (dict str:list de str) --> Dependências de cada tarefa
+        Retorno: dicionário com a prioridade de cada tarefa (dict str:tuple (int, int))
+        '''
+        dependentes = {nome: [] for nome in pendentes}
+        for nome, deps in pendentes.items():
+            for dep in deps:
+                dependentes[dep].append(nome)
+        cadeias = {}
+        def cadeia(nome):
+            if nome not in cadeias: cadeias[nome] = 1 + max([cadeia(dep) for dep in dependentes[nome]], default=0)
+            return cadeias[nome]
+        return {nome: (cadeia(nome), self.tarefas[nome]['memoria']) for nome in pendentes}
+
+    def _verificar_ciclos(self, pendentes):
+        '''
+        Verifica se há dependências circulares entre as tarefas.
+        Parâmetros:
+            pendentes (dict str:list de str) --> Dependências de cada tarefa
+        Retorno: lista com as tarefas que não podem ser ordenadas por dependerem de um ciclo ou lista vazia
+        '''
+        restantes = {nome: set(deps) for nome, deps in pendentes.items()}
+        while True:
+            livres = [nome for nome, deps in restantes.items() if not deps]
+            if not livres: break
+            for nome in livres:
+                del restantes[nome]
+            for deps in restantes.values():
+                deps.difference_update(livres)
+        return sorted(restantes)
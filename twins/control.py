@@ -1,12 +1,49 @@
 # Imports Python
 import pandas as pd
-import shelve
+import json
 import os
+import time
+import datetime as dt
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from tqdm.notebook import tqdm
 # Imports Twins
 from twins.dimensoes import Dimensoes
-from twins.corpus import Corpus
-from twins.utils import obter_link_name
+from twins.corpus import Corpus, CorpusDimensao, _montar_agendador
+from twins.indices import TabelaVizinhos
+from twins.metricas import contar, medir
+from twins.pesos import OtimizadorPesos
+from twins.utils import CacheLRU, FormataDeltatime, TabelaFichas, abrir_shelve, obter_link_name
+
+# Nomes internos simplificados para cronometrar o tempo de execução
+AGORA = dt.datetime.now
+TEMPO = FormataDeltatime()
+
+# Corpus das dimensões abertos somente para leitura em cada processo de consulta, com a versão em que foram abertos
+_CORPUS_PROCESSO = {}
+
+def _pesquisar_dimensao(projeto, dimensao, metodo, kwargs, versao_publicada=None, versao=None):
+    '''
+    Realiza a pesquisa de fichas semelhantes em uma dimensão dentro de um processo do pool de consultas. O corpus da
+    dimensão é aberto somente para leitura na primeira consulta e mantido no processo para as consultas seguintes,
+    enquanto a versão informada pelo processo principal não mudar.
+    Parâmetros:
+        projeto (string) --> Nome do projeto
+        dimensao (string) --> Nome da dimensão
+        metodo (string) --> Método de pesquisa do corpus: "semelhantes" ou "semelhantes_documento"
+        kwargs (dict) --> Argumentos do método de pesquisa do corpus
+        versao_publicada (int) --> Versão publicada da dimensão consultada pelo processo principal. Se None, o corpus é
+                aberto a partir dos seus arquivos atuais (default: None)
+        versao (tuple) --> Versão dos parâmetros dos modelos e dos arquivos dos modelos e índices da dimensão no processo
+                principal (ver Twins._versao_processo). Se mudar, o corpus é aberto novamente (default: None)
+    Retorno: a mesma tupla retornada pelo método de pesquisa de CorpusDimensao
+    '''
+    chave = (projeto, dimensao)
+    versao = (versao_publicada, versao)
+    if chave not in _CORPUS_PROCESSO or _CORPUS_PROCESSO[chave][0] != versao:
+        _CORPUS_PROCESSO[chave] = (versao, CorpusDimensao(projeto=projeto, nome=dimensao, somente_leitura=True
+                                                          ,publicado=versao_publicada is not None))
+    return getattr(_CORPUS_PROCESSO[chave][1], metodo)(**kwargs)
 
 class Twins:
     '''
@@ -15,6 +52,9 @@ class Twins:
     Parâmteros:
         projeto (string) --> Nome do projeto no qual estarão os dados, corpus e modelos. Não é case sensitive e ignora acentos.
         corpus_unico (boolean) --> Indica se o corpus será dividido em dimensões (False) ou não (True) (default: True)
+        somente_leitura (boolean) --> Indica se o projeto é aberto apenas para consultas, a partir das últimas versões
+                publicadas dos corpus (ver Corpus.publicar), sem persistir as configurações. Permite consultar o projeto
+                enquanto outro processo inclui documentos e reconstrói os modelos (default: False)
     Atributos:
         projeto (string) --> Nome do projeto no qual estarão os dados, corpus e modelos. Não é case sensitive e ignora acentos.
         corpus (Corpus ou Dimensoes) --> O corpus a ser gerenciado. Se corpus_unico for True, recebe um objeto Dimensoes que
@@ -24,17 +64,82 @@ class Twins:
         resultados (dict str:DataFrame) --> Resultados de uma consulta por fichas semelhantes
         max_resultados (int) --> Número máximo de resultados finais a serem apresentados para uma consulta por fichas
                                  semelhantes. Se for igual a 0, não limita o resultado (default: 0)
+        paralelismo (string) --> Forma de execução concorrente das pesquisas nas dimensões: "thread", "processo" ou None
+                                 para execução sequencial (default: "thread")
+        num_workers (int) --> Número máximo de threads ou processos usados nas pesquisas nas dimensões. Se None, usa um
+                              por dimensão (default: None)
+        cache_max_itens (int) --> Quantidade máxima de resultados de pesquisas mantidos em cache. Se for 0, não usa o cache
+                                  (default: 1000)
+        cache_max_bytes (int) --> Tamanho máximo estimado, em bytes, dos resultados mantidos em cache (default: 256 MB)
+        somente_leitura (boolean) --> Indica se o projeto foi aberto apenas para consultas
+        intervalo_publicacao (float) --> Intervalo mínimo, em segundos, entre as verificações de novas versões publicadas
+                feitas nas pesquisas quando o projeto é aberto somente para leitura (default: 10)
     '''
-    def __init__(self, projeto, corpus_unico=True):
+    def __init__(self, projeto, corpus_unico=True, somente_leitura=False):
         self.projeto = projeto
         self.corpus = None
         self.corpus_unico = corpus_unico
+        self.somente_leitura = somente_leitura
+        self.intervalo_publicacao = 10
         self.resultados = {}
         self.max_resultados = 0
+        self.paralelismo = 'thread'
+        self.num_workers = None
+        self.cache_max_itens = 1000
+        self.cache_max_bytes = 256*2**20
         self._arq_shelve = None
+        self._arq_construcao = None
+        self._pool = None
+        self._cache = CacheLRU(self.cache_max_itens, self.cache_max_bytes)
+        self._cache_parciais = CacheLRU(self.cache_max_itens, self.cache_max_bytes)
+        self._vizinhos = None
+        self._fichas_vizinhos = (None, None)
+        self._verificacao_publicacao = time.monotonic()
+        self._pool_publicacao = None
+        self._carga_publicacao = None
         # Inicia o objeto
         self._iniciar_twins()
 
+    def ajustar_cache(self, max_itens=None, max_bytes=None):
+        '''
+        Define os limites do cache de resultados das pesquisas. O cache guarda os resultados de "semelhantes" e
+        "semelhantes_documento" e a sua chave inclui os parâmetros da pesquisa, os pesos das dimensões, os parâmetros dos
+        modelos e a versão dos arquivos dos modelos e índices, de modo que uma nova vetorização ou um ajuste de modelo faz
+        com que os resultados anteriores deixem de ser usados. Os mesmos limites valem para o cache dos resultados de cada
+        dimensão, que não depende dos pesos das dimensões e permite recombiná-las sem refazer as pesquisas.
+        Parâmetros:
+            max_itens (int) --> Quantidade máxima de resultados. Se for 0, desativa o cache. Se None, mantém o valor atual
+                    (default: None)
+            max_bytes (int) --> Tamanho máximo estimado em bytes. Se None, mantém o valor atual (default: None)
+        Retorno: None
+        '''
+        if max_itens is not None: self.cache_max_itens = max_itens
+        if max_bytes is not None: self.cache_max_bytes = max_bytes
+        for cache in [self._cache, self._cache_parciais]:
+            cache.ajustar(self.cache_max_itens, self.cache_max_bytes)
+            if not self.cache_max_itens: cache.limpar()
+        self._salvar_twins()
+
+    def ajustar_paralelismo(self, paralelismo='thread', num_workers=None):
+        '''
+        Define como são executadas as pesquisas nas dimensões.
+        Parâmetros:
+            paralelismo (string) --> "thread" para pesquisar as dimensões em threads, "processo" para pesquisá-las em
+                    processos ou None para pesquisá-las sequencialmente (default: "thread")
+            num_workers (int) --> Número máximo de threads ou processos. Se None, usa um por dimensão (default: None)
+        Retorno: None
+        '''
+        if paralelismo not in ['thread', 'processo', None]:
+            print(f'O paralelismo "{paralelismo}" não foi implementado.')
+            return
+        self.paralelismo = paralelismo
+        self.num_workers = num_workers
+        # Descarta o pool anterior para que o próximo seja criado com a nova configuração
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._salvar_twins()
+
     def ajustar_pesos_dimensoes(self, **kwargs):
         '''
         Ajusta os pesos das dimensões conforme passado no dicionário.
@@ -46,6 +151,137 @@ class Twins:
             print('Você está trabalhando com um corpus único.')
             return
         self.corpus.ajustar_pesos(**kwargs)
+        # Os resultados finais em cache foram combinados com os pesos anteriores. Os resultados de cada dimensão continuam
+        # válidos e são apenas recombinados com os novos pesos
+        self._cache.limpar()
+
+    def ajustar_publicacao(self, publicar_versoes=None, versoes_mantidas=None):
+        '''
+        Define se as versões dos modelos e índices de todos os corpus do projeto são publicadas automaticamente, para que
+        possam ser consultadas por instâncias abertas com somente_leitura=True (ver Corpus.ajustar_publicacao).
+        Parâmetros:
+            publicar_versoes (boolean) --> Indica se uma nova versão de cada corpus é publicada a cada treinamento ou
+                    atualização dos seus índices e a cada montagem da sua tabela de vizinhos. Se None, mantém o valor atual
+                    (default: None)
+            versoes_mantidas (int) --> Quantidade de versões publicadas mantidas em disco. Se None, mantém o valor atual
+                    (default: None)
+        Retorno: None
+        '''
+        for corpus in self._corpus_projeto().values():
+            corpus.ajustar_publicacao(publicar_versoes=publicar_versoes, versoes_mantidas=versoes_mantidas)
+
+    def atualizar_publicacao(self, forcar=False):
+        '''
+        Passa a consultar as novas versões publicadas dos corpus, se houver. Só se aplica ao projeto aberto com
+        somente_leitura=True, no qual é chamado automaticamente pelas pesquisas, no máximo uma vez a cada
+        "intervalo_publicacao" segundos. Os corpus da nova versão são carregados em uma thread em segundo plano e só
+        substituem os anteriores na primeira chamada após o fim da carga, de modo que as pesquisas continuam sendo
+        respondidas pela versão anterior e não aguardam a carga. Se forcar for True, aguarda a carga e substitui os corpus
+        na mesma chamada.
+        Parâmetros:
+            forcar (boolean) --> Indica se as versões publicadas são verificadas mesmo antes do intervalo, aguardando a
+                    carga das novas versões (default: False)
+        Retorno: lista com os nomes dos corpus que passaram a ser consultados em uma nova versão
+        '''
+        if not self.somente_leitura or self.corpus is None: return []
+        # Inicia a carga das novas versões, se não houver outra em andamento
+        if self._carga_publicacao is None and (forcar or time.monotonic() - self._verificacao_publicacao
+                                               >= self.intervalo_publicacao):
+            self._verificacao_publicacao = time.monotonic()
+            corpus = [corpus for corpus in ([self.corpus] if self.corpus_unico else list(self.corpus))
+                      if (corpus._publicacoes.atual() or {}).get('versao', corpus._versao_publicada)
+                      != corpus._versao_publicada]
+            if corpus:
+                if self._pool_publicacao is None: self._pool_publicacao = ThreadPoolExecutor(max_workers=1)
+                self._carga_publicacao = self._pool_publicacao.submit(self._carregar_publicacao, corpus)
+        if self._carga_publicacao is None or not (forcar or self._carga_publicacao.done()): return []
+        # Substitui os corpus cuja carga terminou
+        novos = self._carga_publicacao.result()
+        self._carga_publicacao = None
+        for novo in novos:
+            if self.corpus_unico: self.corpus = novo
+            else: self.corpus._substituir(novo)
+            print(f'O corpus "{novo.nome}" passou a ser consultado na versão {novo._versao_publicada}')
+        # Os resultados em cache foram obtidos nas versões anteriores
+        if novos:
+            self._cache.limpar()
+            self._cache_parciais.limpar()
+        return [novo.nome for novo in novos]
+
+    def carregar(self):
+        '''
+        Carrega em memória as tabelas de fichas, os modelos e os índices de todos os corpus do controle, deixando-os prontos
+        para as consultas.
+        Retorno: None
+        '''
+        if self.corpus_unico: self.corpus.carregar()
+        else:
+            for corpus in self.corpus: corpus.carregar()
+
+    def construir(self, forcar=False, num_processos=None, memoria_max=None, retomar=True):
+        '''
+        Constrói todos os corpus do projeto: monta o dicionário e gera os modelos e os índices de cada corpus ou, se a deriva
+        em relação ao último treinamento permitir, apenas inclui as fichas novas nos índices (ver Corpus.atualizar_modelos).
+        As tarefas de todos os corpus formam um único plano, executado por um agendador em um pool de processos. A dimensão
+        "Relacionamentos" é construída uma única vez, depois das demais dimensões terem iniciado a sua construção. O plano e
+        as tarefas concluídas são gravados em arquivo a cada tarefa, de modo que uma construção interrompida é retomada de
+        onde parou. Use com incluir_documentos_csv(construir=False) para ler vários arquivos antes de construir.
+        Parâmetros:
+            forcar (boolean) --> Indica se todos os corpus devem ser treinados novamente, mesmo os modelos cujas entradas não
+                    mudaram (default: False)
+            num_processos (int) --> Quantidade de CPUs usadas pelas tarefas. Se None, usa a quantidade de CPUs da máquina
+                    (default: None)
+            memoria_max (int) --> Memória máxima, em bytes, estimada para as tarefas em execução simultânea. Se None, não há
+                    limite (default: None)
+            retomar (boolean) --> Indica se uma construção interrompida deve ser retomada (True) ou descartada para que um
+                    novo plano seja montado (False) (default: True)
+        Retorno: None
+        '''
+        if self.somente_leitura:
+            print(f'O projeto "{self.projeto}" foi aberto somente para leitura.')
+            return
+        corpus = self._corpus_projeto()
+        construcao = None
+        if retomar and os.path.isfile(self._arq_construcao):
+            with open(self._arq_construcao, encoding='utf-8') as f:
+                construcao = json.load(f)
+            print(f'Retomando a construção interrompida do projeto "{self.projeto}": {len(construcao["concluidas"])} de '
+                  f'{len(construcao["plano"])} tarefas já concluídas.')
+        if construcao is None: construcao = {'plano': self._planejar_construcao(corpus, forcar), 'concluidas': []}
+        plano, concluidas = construcao['plano'], construcao['concluidas']
+        if not plano:
+            print(f'Os corpus do projeto "{self.projeto}" estão atualizados.')
+            return
+        self._gravar_construcao(construcao)
+        def ao_concluir(nome, resultado):
+            tarefa = plano[nome]
+            corpus_tarefa = corpus[tarefa['corpus']]
+            # Grava no processo principal as configurações alteradas pela tarefa
+            if tarefa['etapa'] == 'dicionario':
+                corpus_tarefa._treino = None
+                corpus_tarefa._has_dict = True
+                corpus_tarefa._povoar_atributos(resultado, zero=True)
+            elif tarefa['etapa'] == 'atualizar':
+                corpus_tarefa._somar_assinatura_bow(corpus_tarefa._treino['num_fichas'])
+                corpus_tarefa._registrar_treino(incremental=True)
+            concluidas.append(nome)
+            # Registra o treinamento do corpus quando todos os seus índices tiverem sido montados
+            indices = [outra for outra, dados in plano.items() if dados['corpus'] == tarefa['corpus'] and dados['etapa'] == 'indexar']
+            if tarefa['etapa'] == 'indexar' and all(outra in concluidas for outra in indices):
+                corpus_tarefa._registrar_treino()
+            self._gravar_construcao(construcao)
+        t0 = AGORA()
+        with medir('construir', projeto=self.projeto):
+            _montar_agendador(self.projeto, plano, num_processos, memoria_max, concluidas).executar(ao_concluir)
+        for corpus_projeto in corpus.values():
+            corpus_projeto.modelos._versao += 1
+        TEMPO.formatar(AGORA() - t0)
+        if len(concluidas) < len(plano):
+            print(f'{len(plano) - len(concluidas)} tarefas da construção não foram concluídas.')
+            print('Execute novamente este método para retomá-las.')
+            return
+        os.remove(self._arq_construcao)
+        print(f'A construção do projeto "{self.projeto}" foi concluída em {TEMPO}')
 
     def dimensoes(self):
         '''
@@ -74,6 +310,104 @@ class Twins:
         if not 'Relacionamentos' in self.corpus: 
             self.corpus.incluir('Relacionamentos')
 
+    def montar_vizinhos(self, k=100, dimensoes=None, tamanho_bloco=4096, num_processos=None):
+        '''
+        Monta a tabela das k fichas mais semelhantes a cada ficha. No corpus único, monta a tabela do corpus. Com dimensões,
+        monta (ou retoma) a tabela de cada dimensão e, em seguida, a tabela das similaridades gerais, combinando as tabelas
+        das dimensões com os seus pesos. A similaridade geral é aproximada: uma ficha que não está entre os k vizinhos de
+        uma dimensão contribui com zero nessa dimensão. Por isso, a tabela combinada só é usada por "semelhantes" com
+        aproximado=True, quando o top_k (ou max_resultados) não é maior que k, a pesquisa é nas mesmas dimensões da tabela e
+        nenhuma delas foi alterada desde a montagem.
+        Parâmetros:
+            k (int) --> Quantidade de vizinhos de cada ficha (default: 100)
+            dimensoes (list de string) --> Dimensões a serem combinadas. Se None, usa todas as dimensões (default: None)
+            tamanho_bloco (int) --> Quantidade de fichas de cada bloco da tabela das similaridades gerais (default: 4096)
+            num_processos (int) --> Número de processos usados na montagem da tabela de cada corpus (default: None)
+        Retorno: None
+        '''
+        if self.somente_leitura:
+            print(f'O projeto "{self.projeto}" foi aberto somente para leitura.')
+            return
+        if self.corpus_unico:
+            self.corpus.montar_vizinhos(k=k, num_processos=num_processos)
+            return
+        dimensoes = dimensoes or self.dimensoes()
+        for dimensao in dimensoes:
+            self.corpus[dimensao].montar_vizinhos(k=k, num_processos=num_processos)
+        assinatura = self._assinatura_vizinhos(dimensoes)
+        if assinatura is None:
+            print('Não foi possível montar a tabela de vizinhos de todas as dimensões.')
+            return
+        # Monta a relação de todas as fichas das dimensões e o mapeamento dos ids de cada dimensão para os ids gerais
+        fichas = TabelaFichas()
+        mapas = {}
+        for dimensao in dimensoes:
+            nomes = self.corpus[dimensao].fichas()
+            for ficha in nomes:
+                if ficha not in fichas: fichas.incluir(ficha)
+            mapas[dimensao] = np.array([fichas.id(ficha) for ficha in nomes], dtype=np.int64)
+        num_fichas = len(fichas)
+        locais = {}
+        for dimensao, mapa in mapas.items():
+            locais[dimensao] = np.full(num_fichas, -1, dtype=np.int64)
+            locais[dimensao][mapa] = np.arange(len(mapa))
+        os.makedirs(os.path.dirname(self._vizinhos.prefixo), exist_ok=True)
+        with open(f'{self._vizinhos.prefixo}.fichas.json', 'w', encoding='utf-8') as f:
+            json.dump(fichas.todas(), f, ensure_ascii=False)
+        self._vizinhos.criar(num_fichas, k, dimensoes + ['geral'], tamanho_bloco, assinatura)
+        pendentes = self._vizinhos.blocos_pendentes()
+        print(f'Combinando as tabelas de vizinhos das dimensões em {len(pendentes)} blocos')
+        pesos = np.array([self.corpus.peso(dimensao) for dimensao in dimensoes], dtype=np.float32)
+        for ini, fim in tqdm(pendentes, desc='Vizinhos:'):
+            self._vizinhos.gravar_bloco(ini, *self._combinar_vizinhos(ini, fim, k, dimensoes, pesos, mapas, locais))
+
+    def otimizar_pesos(self, vetor_testes=[], metodo='coordenadas', metrica='mrr', sucesso=100, dimensoes=None, niveis=None
+                      ,valores=(0, 0.5, 1, 2, 4), num_amostras=200, max_iteracoes=10, max_candidatos=500, semente=None
+                      ,aplicar=True):
+        '''
+        Otimiza os pesos dos modelos e das dimensões para os pares de teste. As similaridades brutas das fichas candidatas
+        de cada par são calculadas uma única vez e cada combinação de pesos é avaliada sobre elas em memória, sem refazer
+        as pesquisas como em testar_buscador. Os melhores pesos são gravados por ajustar_modelo e ajustar_pesos_dimensoes.
+        Parâmetros:
+            vetor_testes (list de tuple (str, str)) --> Lista de pares de fichas, sendo a primeira o argumento de pesquisa
+                e a segunda a ficha cuja semelhança se espera encontrar
+            metodo (str) --> "coordenadas", "grade" ou "aleatoria" (default: "coordenadas")
+            metrica (str) --> "mrr", "mediana" ou "sucesso" (default: "mrr")
+            sucesso (int) --> Posição máxima da ficha esperada para a métrica "sucesso" (default: 100)
+            dimensoes (list de str) --> Dimensões consideradas. Se None, usa todas (default: None)
+            niveis (list de str) --> Pesos a serem otimizados: "modelos" e/ou "dimensoes". Se None, otimiza todos (default: None)
+            valores (tuple de float) --> Valores de peso testados (default: (0, 0.5, 1, 2, 4))
+            num_amostras (int) --> Quantidade de combinações das buscas aleatória e em grade (default: 200)
+            max_iteracoes (int) --> Quantidade máxima de passagens da descida por coordenadas (default: 10)
+            max_candidatos (int) --> Quantidade de fichas mais semelhantes de cada modelo avaliadas em cada par (default: 500)
+            semente (int) --> Semente dos sorteios (default: None)
+            aplicar (boolean) --> Indica se os melhores pesos devem ser gravados nos modelos e dimensões (default: True)
+        Retorno: um DataFrame Pandas com as melhores combinações de pesos avaliadas e o valor da métrica de cada uma
+        '''
+        if not vetor_testes:
+            print('Você tem que indicar um vetor de testes para otimizar os pesos.')
+            return
+        if self.corpus_unico:
+            corpus, pesos_dimensoes = {self.corpus.nome: self.corpus}, None
+        else:
+            dimensoes = [dimensao for dimensao in dimensoes or self.dimensoes() if dimensao in self.corpus]
+            corpus = {dimensao: self.corpus[dimensao] for dimensao in dimensoes}
+            pesos_dimensoes = {dimensao: self.corpus.peso(dimensao) for dimensao in dimensoes}
+        print('Calculando as similaridades dos pares de teste')
+        otimizador = OtimizadorPesos(corpus, vetor_testes, pesos_dimensoes=pesos_dimensoes, max_candidatos=max_candidatos)
+        inicial = otimizador.avaliar(metrica=metrica, sucesso=sucesso)
+        melhores, melhor = otimizador.otimizar(metodo=metodo, metrica=metrica, sucesso=sucesso, niveis=niveis, valores=valores
+                                              ,num_amostras=num_amostras, max_iteracoes=max_iteracoes, semente=semente)
+        if melhores is None: return
+        print(f'Métrica "{metrica}" com os pesos atuais: {inicial}. Com os melhores pesos: {melhor} '
+              f'({len(otimizador.historico)} combinações avaliadas).')
+        if aplicar and (inicial is None or melhor > inicial):
+            for (nome, modelo), peso in melhores.items():
+                if peso == otimizador.pesos[(nome, modelo)]: continue
+                if modelo: corpus[nome].modelos.ajustar_modelo(modelo, peso=peso)
+                else: self.ajustar_pesos_dimensoes(**{nome: peso})
+        return otimizador.resumo()
+
     def pesos_dimensoes(self):
         '''
         Mostra os pesos das dimensões.
@@ -86,7 +420,7 @@ class Twins:
         for dimensao in self.dimensoes():
             print(f'--> {dimensao}: {self.corpus.peso(dimensao)}')
 
-    def semelhantes(self, ficha=None, dimensoes=None, teste=False):
+    def semelhantes(self, ficha=None, dimensoes=None, teste=False, top_k=None, aproximado=False):
         '''
         Obtém as fichas mais semelhantes à ficha informada. Se corpus_unico for False, realiza a pesquisa nas dimensões
         informadas em dimensoes, sendo que, se dimensoes for None, realiza a pesquisa em todas as dimensoes. O resultado fica
@@ -96,79 +430,66 @@ class Twins:
             ficha (string) --> Nome da ficha que se deseja comparar
             dimensoes (list de string) --> Lista dos nomes das dimensões nas quais se deseja pesquisar. Se for None, pesquisa
                     em todas as dimensões
+            top_k (int) --> Se informado, o resultado final traz apenas as top_k fichas mais semelhantes. Com dimensões, elas
+                    são obtidas pelo algoritmo do limiar, que lê apenas as melhores fichas de cada dimensão (default: None)
+            aproximado (boolean) --> Indica se, com dimensões, o resultado final pode ser obtido da tabela de vizinhos
+                    combinada (ver montar_vizinhos), cuja similaridade geral é aproximada. Nesse caso, só a chave "Final" é
+                    preenchida (default: False)
         Retorno: None
         '''
         self.resultados = {}
         if not ficha:
             print('Você tem que indicar uma ficha para analisar a semelhança.')
             return
-        geral = ('geral', 'per_sim')
-        # Em se tratando de um corpus único, apenas apresenta o resultado final da query
-        if self.corpus_unico:
-            ok, resultado = self.corpus.semelhantes(ficha=ficha, teste=teste)
-            if not ok:
-                print('Não foi possível obter o resultado da pesquisa')
-                return
-            # Inclui a informação da ordem das fichas
-            resultado.reset_index(inplace=True)
-            resultado.rename(columns={'index': 'Ficha'}, inplace=True)
-            resultado.index = [i for i in range(1, resultado.shape[0]+1)]
-            self.resultados['Detalhado'] = resultado
-            self.resultados['Final'] = resultado[[('Ficha', ''), geral]]
-            if self.max_resultados:
-                 self.resultados['Detalhado'] = self.resultados['Detalhado'].head(self.max_resultados)
-                 self.resultados['Final'] = self.resultados['Final'].head(self.max_resultados)
+        kwargs = dict(ficha=ficha, teste=teste)
+        # No corpus único, o limite de fichas do resultado permite usar a tabela de vizinhos do corpus
+        if self.corpus_unico: kwargs['top_k'] = self._limite(top_k)
+        self.resultados = self._pesquisar('semelhantes', kwargs, dimensoes, teste, top_k, aproximado=aproximado)
+
+    def semelhantes_documento(self, atributos=None, dimensoes=None, ind_tokens=True, teste=False, top_k=None):
+        '''
+        Obtém as fichas mais semelhantes a um documento que não faz parte do corpus, sem incluí-lo no corpus. O documento é
+        tokenizado com as mesmas regras de incluir_documentos_csv e o resultado fica no atributo "resultados", da mesma
+        forma que em "semelhantes".
+        Parâmetros:
+            atributos (dict str:str) --> Valores dos atributos do documento, tendo o nome do atributo como chave
+            dimensoes (list de string) --> Lista dos nomes das dimensões nas quais se deseja pesquisar. Se for None, pesquisa
+                    em todas as dimensões
+            ind_tokens (boolean) --> Indica se os valores já são tokens montados (True) ou se é preciso compor os tokens
+                    agrupando os valores com os nomes dos atributos (False) (default: True)
+            top_k (int) --> Se informado, o resultado final traz apenas as top_k fichas mais semelhantes (default: None)
+        Retorno: None
+        '''
+        self.resultados = {}
+        if not atributos:
+            print('Você tem que indicar os atributos do documento para analisar a semelhança.')
             return
+        self.resultados = self._pesquisar('semelhantes_documento', dict(atributos=atributos, ind_tokens=ind_tokens, teste=teste)
+                                         ,dimensoes, teste, top_k)
+
+    def semelhantes_lote(self, consultas, dimensoes=None, ind_tokens=True, teste=False, top_k=None):
+        '''
+        Obtém as fichas mais semelhantes para um lote de consultas. Em cada dimensão e em cada modelo, as similaridades de
+        todas as consultas do lote são calculadas de uma só vez. Não altera o atributo "resultados".
+        Parâmetros:
+            consultas (list) --> Consultas do lote. Cada consulta é o nome de uma ficha (string) ou os valores dos atributos de
+                    um documento que não faz parte do corpus (dict str:str)
+            dimensoes (list de string) --> Lista dos nomes das dimensões nas quais se deseja pesquisar. Se for None, pesquisa
+                    em todas as dimensões
+            ind_tokens (boolean) --> Indica se os valores dos documentos já são tokens montados (True) ou se é preciso compor
+                    os tokens agrupando os valores com os nomes dos atributos (False) (default: True)
+            top_k (int) --> Se informado, o resultado final traz apenas as top_k fichas mais semelhantes (default: None)
+        Retorno: lista com os resultados de cada consulta, na ordem das consultas, no mesmo formato do atributo "resultados"
+        '''
+        self.atualizar_publicacao()
+        kwargs = dict(consultas=consultas, ind_tokens=ind_tokens, teste=teste)
+        if self.corpus_unico:
+            return [self._resultados_corpus(ok, resultado, top_k) for ok, resultado in self.corpus.semelhantes_lote(**kwargs)]
         # Obtém a relação das dimensões se dimensoes for None
         if not dimensoes: dimensoes = self.dimensoes()
-        # Monta o DataFrame com o resultado da query de cada dimensão
-        # Se não for a primeira dimensão, junta com o resultado anterior
-        primeira = True
-        for dimensao in dimensoes:
-            peso = self.corpus.peso(dimensao)
-            ok, parcial = self.corpus[dimensao].semelhantes(ficha=ficha, teste=teste)
-            if not ok:
-                print(f'Não foi possível obter o resultado da pesquisa para a dimensão "{dimensao}"')
-                self.resultados[dimensao] = None
-                continue
-            # Informa a ordem do resultado na dimensão, sem alterar o DataFrame original
-            self.resultados[dimensao] = parcial.reset_index()
-            self.resultados[dimensao].rename(columns={'index': 'Ficha'}, inplace=True)
-            self.resultados[dimensao].index = [i for i in range(1, parcial.shape[0]+1)]
-            if not teste and self.max_resultados:
-                self.resultados[dimensao] = self.resultados[dimensao].head(self.max_resultados)
-            if primeira:
-                resultado = parcial.loc[:,[geral]]
-                resultado[('geral', 'peso')] = peso
-                resultado.columns = pd.MultiIndex.from_product([[dimensao], ['per_sim', 'peso']])
-                primeira = False
-            else:
-                parcial = parcial.loc[:,[geral]]
-                parcial[('geral', 'peso')] = peso
-                parcial.columns = pd.MultiIndex.from_product([[dimensao], ['per_sim', 'peso']])
-                resultado = resultado.join(parcial, how='outer')
-        if primeira:
-            print('Não foi possível obter o resultado da pesquisa para nenhuma dimensão')
-            self.resultados['Final'] = None
-            return
-        # Preenches com zeros os valores não encontrados em cada dimensão
-        resultado.fillna(0, inplace=True)
-        # Calcula a probabilidade geral com base no peso de cada dimensão e ordena por esse valor em ordem decrescente
-        resultado[geral] = [0 for i in range(resultado.shape[0])]
-        peso_total = 0
-        for dimensao in dimensoes:
-            peso = self.corpus.peso(dimensao)
-            resultado[geral] = resultado[geral] + (resultado[(dimensao, 'per_sim')] * resultado[(dimensao, 'peso')])
-            peso_total += peso
-        resultado[geral] = round(resultado[geral] / peso_total, 2)
-        resultado.sort_values(by=geral, ascending=False, inplace=True)
-        # Inclui a informação da ordem das fichas
-        resultado.reset_index(inplace=True)
-        resultado.rename(columns={'index': 'Ficha'}, inplace=True)
-        resultado.index = [i for i in range(1, resultado.shape[0]+1)]
-        self.resultados['Final'] = resultado
-        if not teste and self.max_resultados:
-            self.resultados['Final'] = self.resultados['Final'].head(self.max_resultados)
+        lotes = dict(self._pesquisar_dimensoes('semelhantes_lote', kwargs, dimensoes))
+        return [self._resultados_dimensoes(((dimensao, *lotes[dimensao][i]) for dimensao in dimensoes), dimensoes, teste, top_k)
+                for i in range(len(consultas))]
 
     def testar_dimensoes(self, dimensoes=None, vetor_testes=[], sucesso=100):
         '''
@@ -223,7 +544,8 @@ class Twins:
         for query, target in tqdm(vetor_testes):
             resultados['query'].append(query)
             resultados['target'].append(target)
-            self.semelhantes(ficha=query, teste=True)
+            with medir('testar_buscador', projeto=self.projeto):
+                self.semelhantes(ficha=query, teste=True)
             df = self.resultados['Final']
             if df is None: df = pd.DataFrame(data={'Ficha': [], ('geral', 'per_sim'): []})
             resultado = df[df['Ficha']==target][('geral', 'per_sim')]
@@ -252,21 +574,29 @@ class Twins:
             if not os.path.isdir(base): os.mkdir(base)
         # Verifica se já há o corpus definido
         self._arq_shelve = os.path.join(base, 'objetos.db')
+        self._arq_construcao = os.path.join(base, 'construcao.json')
+        self._vizinhos = TabelaVizinhos(os.path.join(base, 'indices', 'twins_vizinhos'))
         if os.path.isfile(f'{self._arq_shelve}.dat'):
-            with shelve.open(self._arq_shelve) as db:
+            with abrir_shelve(self._arq_shelve, flag='r' if self.somente_leitura else 'c') as db:
                 twins = db['twins']
             # Recupera os valores anteriores dos parâmetros
             self.projeto = twins['projeto']
             self.max_resultados = twins['max_resultados']
+            self.paralelismo = twins.get('paralelismo', self.paralelismo)
+            self.num_workers = twins.get('num_workers', self.num_workers)
+            self.cache_max_itens = twins.get('cache_max_itens', self.cache_max_itens)
+            self.cache_max_bytes = twins.get('cache_max_bytes', self.cache_max_bytes)
+            self._cache.ajustar(self.cache_max_itens, self.cache_max_bytes)
+            self._cache_parciais.ajustar(self.cache_max_itens, self.cache_max_bytes)
             # Ajusta o atributo corpus_unico, se necessário
             if not twins['corpus_unico']:
-                self.corpus = Dimensoes(self.projeto)
+                self.corpus = Dimensoes(self.projeto, publicado=self.somente_leitura)
                 if self.corpus_unico:
                     print(f'O projeto "{self.projeto}" já existe e é do tipo com dimensões.')
                     print('Foram carregadas as configurações do projeto já existente. ')
                     self.corpus_unico = False
             else:
-                self.corpus = Corpus(nome=self.projeto, projeto=self.projeto)
+                self.corpus = Corpus(nome=self.projeto, projeto=self.projeto, publicado=self.somente_leitura)
                 if not self.corpus_unico:
                     print(f'O projeto "{self.projeto}" já existe e é do tipo com um corpus único.')
                     print('Foram carregadas as configurações do projeto já existente. ')
@@ -274,18 +604,511 @@ class Twins:
             # Atualiza o arquivo com a nova versão da classe
             self._salvar_twins()
             return
+        # Um projeto novo não pode ser aberto somente para leitura
+        elif self.somente_leitura:
+            print(f'O projeto "{self.projeto}" ainda não foi criado e não pode ser aberto somente para leitura.')
+            return
         # Se o controle é novo, inicia todos os valores e salva a configuração
         elif self.corpus_unico: self.corpus = Corpus(nome=self.projeto, projeto=self.projeto)
         else: self.corpus = Dimensoes(projeto=self.projeto)
         self._salvar_twins()
 
+    def _assinatura_vizinhos(self, dimensoes):
+        '''
+        Monta a assinatura da tabela de vizinhos combinada, formada pelas dimensões, pelos seus pesos e pelas assinaturas
+        das tabelas de vizinhos das dimensões.
+        Retorno: dicionário com a assinatura ou None se a tabela de alguma dimensão não estiver atualizada
+        '''
+        assinaturas = []
+        for dimensao in dimensoes:
+            if dimensao not in self.corpus: return None
+            modelos = self.corpus[dimensao].modelos
+            if not modelos._vizinhos.atual(modelos.assinatura_vizinhos()): return None
+            assinaturas.append([modelos._vizinhos.meta['k'], modelos._vizinhos.meta['assinatura']])
+        return dict(dimensoes=list(dimensoes), pesos=[self.corpus.peso(dimensao) for dimensao in dimensoes]
+                   ,tabelas=assinaturas)
+
+    def _carregar_publicacao(self, corpus):
+        '''
+        Abre e carrega em memória a última versão publicada de cada corpus. É executado em segundo plano por
+        "atualizar_publicacao". Os corpus cuja carga falhar continuam sendo consultados na versão anterior.
+        Parâmetros:
+            corpus (list de Corpus) --> Corpus com uma nova versão publicada
+        Retorno: lista com os corpus carregados nas novas versões (list de Corpus)
+        '''
+        novos = []
+        for anterior in corpus:
+            try:
+                novo = type(anterior)(projeto=self.projeto, nome=anterior.nome, publicado=True)
+                novo.carregar()
+                novos.append(novo)
+            except Exception as erro:
+                print(f'Erro ao carregar a nova versão publicada do corpus "{anterior.nome}": {erro!r}')
+        return novos
+
+    def _chave_cache(self, metodo, kwargs, dimensoes, teste, top_k, aproximado=False):
+        '''
+        Monta a chave do cache de resultados para uma pesquisa. A chave inclui a versão dos modelos de cada corpus
+        pesquisado, que muda com o ajuste dos parâmetros dos modelos e com a alteração dos arquivos dos modelos e índices.
+        Retorno: tupla que identifica a pesquisa
+        '''
+        if self.corpus_unico: versoes, pesos = (self.corpus.modelos.versao(), ), ()
+        else:
+            corpus = [self.corpus[dimensao] if dimensao in self.corpus else None for dimensao in dimensoes]
+            versoes = tuple(dimensao.modelos.versao() if dimensao else None for dimensao in corpus)
+            pesos = tuple(self.corpus.peso(dimensao) if dimensao in self.corpus else None for dimensao in dimensoes)
+            # A tabela de vizinhos combinada também faz parte da versão
+            arq_vizinhos = f'{self._vizinhos.prefixo}.json'
+            versoes += (os.path.getmtime(arq_vizinhos) if os.path.isfile(arq_vizinhos) else None, )
+        return (metodo, json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str), tuple(dimensoes or ()), pesos
+               ,teste, top_k, aproximado, self.max_resultados, versoes)
+
+    def _combinar_vizinhos(self, ini, fim, k, dimensoes, pesos, mapas, locais):
+        '''
+        Combina os vizinhos de um bloco de fichas nas tabelas das dimensões, calculando a média das similaridades ponderada
+        pelos pesos das dimensões e mantendo os k vizinhos de maior similaridade geral.
+        Parâmetros:
+            ini (int) --> Id geral da primeira ficha do bloco
+            fim (int) --> Id geral final do bloco (exclusivo)
+            k (int) --> Quantidade de vizinhos de cada ficha
+            dimensoes (list de string) --> Dimensões combinadas
+            pesos (ndarray de float) --> Pesos das dimensões
+            mapas (dict str:ndarray) --> Id geral de cada ficha de cada dimensão
+            locais (dict str:ndarray) --> Id de cada ficha geral em cada dimensão ou -1 se a ficha não está na dimensão
+        Retorno: uma tupla com os ids gerais dos vizinhos (fichas x k) e as suas similaridades (fichas x k x (dimensões + 1))
+        '''
+        num_fichas = len(next(iter(locais.values())))
+        linhas, candidatos, valores, colunas = [], [], [], []
+        for coluna, dimensao in enumerate(dimensoes):
+            ids_locais = locais[dimensao][ini:fim]
+            presentes = np.flatnonzero(ids_locais >= 0)
+            if not len(presentes): continue
+            ids, sims = self.corpus[dimensao].modelos._vizinhos.linhas(ids_locais[presentes])
+            validos = ids >= 0
+            linhas.append(np.repeat(presentes, ids.shape[1]).reshape(ids.shape)[validos])
+            candidatos.append(mapas[dimensao][ids[validos]])
+            valores.append(sims[:, :, -1][validos])
+            colunas.append(np.full(validos.sum(), coluna))
+        ids_bloco = np.full((fim - ini, k), -1, dtype=np.int32)
+        sims_bloco = np.zeros((fim - ini, k, len(dimensoes) + 1), dtype=np.float32)
+        if not linhas: return ids_bloco, sims_bloco
+        linhas, candidatos = np.concatenate(linhas), np.concatenate(candidatos)
+        valores, colunas = np.concatenate(valores), np.concatenate(colunas)
+        # Agrupa as ocorrências de cada par (ficha, vizinho) nas dimensões
+        pares, posicoes = np.unique(linhas * num_fichas + candidatos, return_inverse=True)
+        por_dimensao = np.zeros((len(pares), len(dimensoes)), dtype=np.float32)
+        por_dimensao[posicoes, colunas] = valores
+        geral = por_dimensao @ pesos / pesos.sum()
+        linhas, candidatos = pares // num_fichas, pares % num_fichas
+        # Ordena os pares por ficha e, dentro da ficha, pela similaridade geral decrescente
+        ordem = np.lexsort((-geral, linhas))
+        linhas, candidatos, geral, por_dimensao = linhas[ordem], candidatos[ordem], geral[ordem], por_dimensao[ordem]
+        posicao = np.arange(len(linhas)) - np.searchsorted(linhas, linhas)
+        manter = posicao < k
+        ids_bloco[linhas[manter], posicao[manter]] = candidatos[manter]
+        sims_bloco[linhas[manter], posicao[manter], :-1] = por_dimensao[manter]
+        sims_bloco[linhas[manter], posicao[manter], -1] = geral[manter]
+        return ids_bloco, sims_bloco
+
+    def _copiar_resultados(self, resultados):
+        '''
+        Copia os resultados de uma pesquisa, inclusive os DataFrames, para que as alterações feitas pelo chamador não
+        atinjam os resultados guardados no cache.
+        Parâmetros:
+            resultados (dict str:DataFrame) --> Resultados no mesmo formato do atributo "resultados"
+        Retorno: a cópia dos resultados (dict str:DataFrame)
+        '''
+        return {chave: resultado.copy() if resultado is not None else None for chave, resultado in resultados.items()}
+
+    def _corpus_projeto(self):
+        '''
+        Relaciona os corpus do projeto, com a dimensão "Relacionamentos" por último, e recupera as configurações gravadas de
+        cada um deles, que podem ter sido alteradas por outras instâncias dos mesmos corpus.
+        Retorno: dicionário com os corpus, tendo o nome do corpus como chave (dict str:Corpus)
+        '''
+        if self.corpus_unico: lista = [self.corpus]
+        else: lista = sorted(self.corpus, key=lambda corpus: corpus._link_nome == 'relacionamentos')
+        for corpus in lista:
+            corpus._ler_configuracoes()
+        return {corpus.nome: corpus for corpus in lista}
+
+    def _fundir_completa(self, parciais, dimensoes):
+        '''
+        Junta os resultados de todas as dimensões e calcula a similaridade geral ponderada pelos pesos das dimensões.
+        Parâmetros:
+            parciais (dict str:DataFrame) --> Resultado de cada dimensão com as colunas (dimensão, "per_sim") e (dimensão, "peso")
+            dimensoes (list de string) --> Nomes das dimensões pesquisadas
+        Retorno: DataFrame com o resultado combinado em ordem decrescente de similaridade geral ou None se não houver resultado
+        '''
+        geral = ('geral', 'per_sim')
+        # Monta o DataFrame com o resultado da query de cada dimensão na ordem das dimensões
+        # Se não for a primeira dimensão, junta com o resultado anterior
+        primeira = True
+        for dimensao in dimensoes:
+            if dimensao not in parciais: continue
+            if primeira:
+                resultado = parciais[dimensao]
+                primeira = False
+            else:
+                resultado = resultado.join(parciais[dimensao], how='outer')
+        if primeira: return None
+        # Preenches com zeros os valores não encontrados em cada dimensão
+        resultado.fillna(0, inplace=True)
+        # Calcula a probabilidade geral com base no peso de cada dimensão e ordena por esse valor em ordem decrescente
+        # As dimensões sem resultado contribuem com similaridade zero
+        resultado[geral] = [0 for i in range(resultado.shape[0])]
+        peso_total = 0
+        for dimensao in dimensoes:
+            peso = self.corpus.peso(dimensao)
+            if dimensao in parciais:
+                resultado[geral] = resultado[geral] + (resultado[(dimensao, 'per_sim')] * resultado[(dimensao, 'peso')])
+            peso_total += peso
+        resultado[geral] = round(resultado[geral] / peso_total, 2)
+        resultado.sort_values(by=geral, ascending=False, inplace=True)
+        return resultado
+
+    def _gravar_construcao(self, construcao):
+        '''
+        Grava o plano da construção do projeto e as tarefas já concluídas, substituindo o arquivo anterior de uma só vez.
+        Parâmetros:
+            construcao (dict) --> Plano ("plano") e tarefas concluídas ("concluidas") da construção
+        Retorno: None
+        '''
+        arq_temp = f'{self._arq_construcao}.tmp'
+        with open(arq_temp, 'w', encoding='utf-8') as f:
+            json.dump(construcao, f, ensure_ascii=False)
+        os.replace(arq_temp, self._arq_construcao)
+
+    def _limite(self, top_k):
+        '''
+        Obtém a quantidade máxima de fichas do resultado final, considerando o top_k e o atributo max_resultados.
+        Retorno: a quantidade máxima de fichas (int) ou None se o resultado não tiver limite
+        '''
+        limites = [limite for limite in [top_k, self.max_resultados] if limite]
+        return min(limites) if limites else None
+
+    def _parciais_dimensoes(self, metodo, kwargs, dimensoes):
+        '''
+        Obtém o resultado da pesquisa em cada dimensão, reaproveitando os resultados em cache e pesquisando apenas as
+        dimensões restantes. A chave do cache inclui a versão dos modelos da dimensão, mas não o seu peso, de modo que um
+        ajuste dos pesos das dimensões só refaz a combinação dos resultados.
+        Parâmetros:
+            metodo (string) --> Método de pesquisa do corpus: "semelhantes" ou "semelhantes_documento"
+            kwargs (dict) --> Argumentos do método de pesquisa do corpus
+            dimensoes (list de string) --> Nomes das dimensões a serem pesquisadas
+        Retorno: um gerador de tuplas (dimensão, indicador de resultado, resultado da pesquisa na dimensão)
+        '''
+        argumentos = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        chaves, pendentes = {}, []
+        for dimensao in dimensoes:
+            if dimensao in self.corpus:
+                chaves[dimensao] = (dimensao, metodo, argumentos, self.corpus[dimensao].modelos.versao())
+                parcial = self._cache_parciais.obter(chaves[dimensao])
+                if parcial is not None:
+                    yield dimensao, True, parcial
+                    continue
+            pendentes.append(dimensao)
+        if not pendentes: return
+        for dimensao, (ok, parcial) in self._pesquisar_dimensoes(metodo, kwargs, pendentes):
+            if ok and dimensao in chaves: self._cache_parciais.guardar(chaves[dimensao], parcial)
+            yield dimensao, ok, parcial
+
+    def _pesquisar(self, metodo, kwargs, dimensoes, teste, top_k, aproximado=False):
+        '''
+        Realiza a pesquisa de fichas semelhantes no corpus único ou nas dimensões e combina os resultados.
+        Parâmetros:
+            metodo (string) --> Método de pesquisa do corpus: "semelhantes" ou "semelhantes_documento"
+            kwargs (dict) --> Argumentos do método de pesquisa do corpus
+            dimensoes (list de string) --> Nomes das dimensões a serem pesquisadas. Se None, pesquisa todas
+            teste (boolean) --> Indica se a pesquisa é para fins de teste
+            top_k (int) --> Quantidade máxima de fichas do resultado final ou None. Na pesquisa de uma ficha nas dimensões,
+                    as fichas são obtidas pelo algoritmo do limiar
+            aproximado (boolean) --> Indica se o resultado final pode ser obtido da tabela de vizinhos combinada das
+                    dimensões (default: False)
+        Retorno: dicionário com os resultados no mesmo formato do atributo "resultados"
+        '''
+        self.atualizar_publicacao()
+        with medir('pesquisa', projeto=self.projeto, metodo=metodo):
+            # Obtém a relação das dimensões se dimensoes for None
+            if not self.corpus_unico and not dimensoes: dimensoes = self.dimensoes()
+            # Verifica se o resultado da mesma pesquisa, com a mesma versão dos modelos e pesos, está no cache
+            chave = self._chave_cache(metodo, kwargs, dimensoes, teste, top_k, aproximado)
+            resultados = self._cache.obter(chave)
+            if resultados is not None:
+                contar('cache')
+                return self._copiar_resultados(resultados)
+            if self.corpus_unico: resultados = self._resultados_corpus(*getattr(self.corpus, metodo)(**kwargs), top_k)
+            elif (aproximado and metodo == 'semelhantes' and not teste
+                  and self._vizinhos_atual(dimensoes, self._limite(top_k))):
+                resultados = self._resultados_vizinhos(kwargs['ficha'], self._limite(top_k))
+            elif (top_k and metodo == 'semelhantes' and not teste
+                  and all(self.corpus.peso(dimensao) >= 0 for dimensao in dimensoes)):
+                with medir('pesquisar_dimensoes', projeto=self.projeto):
+                    resultados = self._resultados_limiar(kwargs['ficha'], dimensoes, top_k)
+            else:
+                # Trata o resultado da query de cada dimensão à medida que as pesquisas concorrentes são concluídas,
+                # pesquisando apenas as dimensões cujo resultado não está no cache
+                parciais = self._parciais_dimensoes(metodo, kwargs, dimensoes)
+                with medir('pesquisar_dimensoes', projeto=self.projeto):
+                    resultados = self._resultados_dimensoes(parciais, dimensoes, teste, top_k)
+            if resultados.get('Final') is not None: self._cache.guardar(chave, resultados)
+            return self._copiar_resultados(resultados)
+
+    def _pesquisar_dimensoes(self, metodo, kwargs, dimensoes):
+        '''
+        Realiza a pesquisa de fichas semelhantes em cada dimensão, concorrentemente conforme o atributo "paralelismo".
+        Parâmetros:
+            metodo (string) --> Método de pesquisa do corpus: "semelhantes" ou "semelhantes_documento"
+            kwargs (dict) --> Argumentos do método de pesquisa do corpus
+            dimensoes (list de string) --> Nomes das dimensões a serem pesquisadas
+        Retorno: um gerador de tuplas (dimensão, retorno do método de pesquisa) na ordem em que as pesquisas são concluídas
+        '''
+        if not self.paralelismo or len(dimensoes) < 2:
+            for dimensao in dimensoes:
+                yield dimensao, getattr(self.corpus[dimensao], metodo)(**kwargs)
+            return
+        # Cria o pool na primeira pesquisa e o mantém para as seguintes
+        if not self._pool:
+            num_workers = self.num_workers or len(self.dimensoes())
+            if self.paralelismo == 'processo': self._pool = ProcessPoolExecutor(max_workers=num_workers)
+            else: self._pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='twins_dimensoes')
+        if self.paralelismo == 'processo':
+            futuros = {self._pool.submit(_pesquisar_dimensao, self.projeto, dimensao, metodo, kwargs
+                                         ,self.corpus[dimensao]._versao_publicada, self._versao_processo(dimensao))
+                       : dimensao for dimensao in dimensoes}
+        else:
+            futuros = {self._pool.submit(getattr(self.corpus[dimensao], metodo), **kwargs): dimensao for dimensao in dimensoes}
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
+
+    def _planejar_construcao(self, corpus, forcar):
+        '''
+        Monta o plano de construção dos corpus do projeto. Os corpus que precisam ser treinados novamente recebem as tarefas
+        de montagem do dicionário e de treinamento e indexação dos modelos. Os que admitem a atualização incremental recebem
+        uma tarefa de inclusão das fichas novas. A primeira tarefa da dimensão "Relacionamentos" depende da primeira tarefa
+        das demais dimensões.
+        Parâmetros:
+            corpus (dict str:Corpus) --> Corpus do projeto, na ordem de _corpus_projeto
+            forcar (boolean) --> Indica se todos os corpus devem ser treinados novamente
+        Retorno: dicionário com as tarefas, tendo o nome da tarefa como chave
+        '''
+        plano, iniciais = {}, []
+        for nome, corpus_nome in corpus.items():
+            if not corpus_nome.num_fichas: continue
+            motivo, metricas = corpus_nome._motivo_treino(forcar)
+            prefixo = f'{corpus_nome._link_nome}:'
+            dependencias = iniciais if corpus_nome._link_nome == 'relacionamentos' else []
+            tarefa = dict(classe=type(corpus_nome).__name__, corpus=nome, modelo=None, dependencias=list(dependencias)
+                         ,memoria=0, threads=1)
+            if motivo:
+                print(f'O corpus "{nome}" será construído: {motivo}.')
+                plano[f'{prefixo}dicionario'] = dict(tarefa, etapa='dicionario', descricao=f'montagem do dicionário do corpus "{nome}"')
+                plano.update(corpus_nome._plano_modelos(corpus_nome.modelos.tipos_modelos(), prefixo, [f'{prefixo}dicionario']
+                                                       ,forcar=forcar))
+                iniciais.append(f'{prefixo}dicionario')
+            elif metricas['fichas_novas']:
+                print(f'O corpus "{nome}" receberá {metricas["fichas_novas"]} fichas novas nos índices.')
+                plano[f'{prefixo}atualizar'] = dict(tarefa, etapa='atualizar', descricao=f'inclusão das fichas novas no corpus "{nome}"')
+                iniciais.append(f'{prefixo}atualizar')
+        return plano
+
+    def _resultados_corpus(self, ok, resultado, top_k):
+        '''
+        Monta os resultados de uma pesquisa no corpus único.
+        Parâmetros:
+            ok (boolean) --> Indica se a pesquisa no corpus obteve resultado
+            resultado (DataFrame) --> Resultado da pesquisa no corpus
+            top_k (int) --> Quantidade máxima de fichas do resultado final ou None
+        Retorno: dicionário com os resultados no mesmo formato do atributo "resultados"
+        '''
+        resultados = {}
+        geral = ('geral', 'per_sim')
+        # Em se tratando de um corpus único, apenas apresenta o resultado final da query
+        if not ok:
+            print('Não foi possível obter o resultado da pesquisa')
+            return resultados
+        # Inclui a informação da ordem das fichas
+        resultado.reset_index(inplace=True)
+        resultado.rename(columns={'index': 'Ficha'}, inplace=True)
+        resultado.index = [i for i in range(1, resultado.shape[0]+1)]
+        resultados['Detalhado'] = resultado
+        resultados['Final'] = resultado[[('Ficha', ''), geral]]
+        if self.max_resultados:
+             resultados['Detalhado'] = resultados['Detalhado'].head(self.max_resultados)
+             resultados['Final'] = resultados['Final'].head(self.max_resultados)
+        if top_k:
+             resultados['Detalhado'] = resultados['Detalhado'].head(top_k)
+             resultados['Final'] = resultados['Final'].head(top_k)
+        return resultados
+
+    def _resultados_dimensoes(self, parciais_dimensoes, dimensoes, teste, top_k):
+        '''
+        Monta os resultados de uma pesquisa nas dimensões, combinando o resultado de cada dimensão no resultado final.
+        Parâmetros:
+            parciais_dimensoes (iterável de tuple (str, boolean, DataFrame)) --> Nome da dimensão, indicador de resultado e
+                    resultado da pesquisa em cada dimensão
+            dimensoes (list de string) --> Nomes das dimensões pesquisadas
+            teste (boolean) --> Indica se a pesquisa é para fins de teste
+            top_k (int) --> Quantidade máxima de fichas do resultado final ou None
+        Retorno: dicionário com os resultados no mesmo formato do atributo "resultados"
+        '''
+        resultados = {}
+        geral = ('geral', 'per_sim')
+        parciais = {}
+        for dimensao, ok, parcial in parciais_dimensoes:
+            if not ok:
+                print(f'Não foi possível obter o resultado da pesquisa para a dimensão "{dimensao}"')
+                resultados[dimensao] = None
+                continue
+            # Informa a ordem do resultado na dimensão, sem alterar o DataFrame original
+            resultados[dimensao] = parcial.reset_index()
+            resultados[dimensao].rename(columns={'index': 'Ficha'}, inplace=True)
+            resultados[dimensao].index = [i for i in range(1, parcial.shape[0]+1)]
+            if not teste and self.max_resultados:
+                resultados[dimensao] = resultados[dimensao].head(self.max_resultados)
+            parcial = parcial.loc[:,[geral]]
+            parcial[('geral', 'peso')] = self.corpus.peso(dimensao)
+            parcial.columns = pd.MultiIndex.from_product([[dimensao], ['per_sim', 'peso']])
+            parciais[dimensao] = parcial
+        # Combina os resultados das dimensões
+        resultado = self._fundir_completa(parciais, dimensoes)
+        if top_k and resultado is not None: resultado = resultado.head(top_k)
+        if resultado is None:
+            print('Não foi possível obter o resultado da pesquisa para nenhuma dimensão')
+            resultados['Final'] = None
+            return resultados
+        # Inclui a informação da ordem das fichas
+        resultado.reset_index(inplace=True)
+        resultado.rename(columns={'index': 'Ficha'}, inplace=True)
+        resultado.index = [i for i in range(1, resultado.shape[0]+1)]
+        resultados['Final'] = resultado
+        if not teste and self.max_resultados:
+            resultados['Final'] = resultados['Final'].head(self.max_resultados)
+        return resultados
+
+    def _resultados_limiar(self, ficha, dimensoes, k):
+        '''
+        Obtém as k fichas de maior similaridade geral com a ficha pelo algoritmo do limiar (threshold algorithm de Fagin),
+        lendo apenas o início da lista ordenada de cada dimensão. Em cada rodada, cada dimensão fornece as suas n fichas mais
+        semelhantes (ver Corpus.melhores) e as fichas candidatas assim encontradas têm a similaridade obtida por acesso
+        direto nas demais dimensões (ver Corpus.semelhantes_fichas). Uma dimensão cujos índices não permitem a busca das
+        melhores fichas fornece de uma só vez a lista completa e não precisa do acesso direto. A busca termina quando a
+        k-ésima maior similaridade geral das candidatas alcança o limiar, a soma ponderada das últimas similaridades lidas
+        nas dimensões, que nenhuma outra ficha pode superar; caso contrário, é repetida com 4n fichas por dimensão. A
+        primeira rodada já lê 16k fichas por dimensão, pois cada rodada custa ao menos uma varredura dos índices densos.
+        As similaridades gerais e o limiar são arredondados como na junção completa, de modo que o resultado é o mesmo da
+        junção completa das dimensões, limitado às k primeiras fichas.
+        Parâmetros:
+            ficha (string) --> Nome da ficha que se deseja comparar
+            dimensoes (list de string) --> Nomes das dimensões pesquisadas
+            k (int) --> Quantidade de fichas do resultado final
+        Retorno: dicionário com os resultados no mesmo formato do atributo "resultados". O resultado de cada dimensão traz
+            as fichas lidas na dimensão: as suas melhores fichas e as candidatas encontradas nas demais dimensões
+        '''
+        geral = ('geral', 'per_sim')
+        pesos = {dimensao: self.corpus.peso(dimensao) for dimensao in dimensoes}
+        peso_total = sum(pesos.values())
+        prefixos, abertas, n = {}, list(dimensoes), 16 * k
+        while True:
+            # Acesso ordenado: as n fichas mais semelhantes de cada dimensão ainda não lida por completo
+            for dimensao, ok, parcial in self._parciais_dimensoes('melhores', dict(ficha=ficha, k=n), abertas):
+                prefixos[dimensao] = (ok, parcial)
+            # Uma dimensão sem resultado ou que retornou um número de fichas diferente de n, ou seja, menos fichas ou a
+            # lista completa, não precisa ser lida novamente
+            lidas = [dimensao for dimensao in dimensoes if prefixos[dimensao][0]]
+            abertas = [dimensao for dimensao in lidas if prefixos[dimensao][1].shape[0] == n]
+            candidatas = sorted({candidata for dimensao in lidas for candidata in prefixos[dimensao][1].index})
+            # Acesso direto: a similaridade das fichas candidatas nas dimensões ainda não lidas por completo, nas quais
+            # elas podem estar além das n primeiras fichas
+            diretos = {}
+            if candidatas and abertas:
+                diretos = {dimensao: parcial for dimensao, (ok, parcial)
+                           in self._pesquisar_dimensoes('semelhantes_fichas', dict(ficha=ficha, fichas=candidatas), abertas)
+                           if ok}
+            parciais = {}
+            for dimensao in lidas:
+                parcial = prefixos[dimensao][1]
+                if dimensao in diretos:
+                    direto = diretos[dimensao]
+                    parcial = pd.concat([parcial, direto[~direto.index.isin(parcial.index)]])
+                    parcial = parcial.sort_values(by=geral, ascending=False, kind='stable')
+                    parcial[('geral', 'ordem')] = [i for i in range(1, parcial.shape[0]+1)]
+                parciais[dimensao] = parcial
+            # O limiar é o maior percentual geral possível de uma ficha fora das candidatas
+            limiar = sum(pesos[dimensao] * prefixos[dimensao][1][geral].iloc[-1] for dimensao in abertas)
+            if not limiar: break
+            similaridades = 0
+            for dimensao in lidas:
+                similaridades = similaridades + parciais[dimensao][geral].reindex(candidatas).fillna(0) * pesos[dimensao]
+            similaridades = round(similaridades / peso_total, 2)
+            if len(candidatas) >= k and similaridades.nlargest(k).iloc[-1] >= round(limiar / peso_total, 2): break
+            n *= 4
+        contar('candidatas_limiar', len(candidatas))
+        parciais_dimensoes = [(dimensao, dimensao in parciais, parciais.get(dimensao)) for dimensao in dimensoes]
+        return self._resultados_dimensoes(parciais_dimensoes, dimensoes, False, k)
+
+    def _resultados_vizinhos(self, ficha, limite):
+        '''
+        Monta o resultado final de uma pesquisa a partir da tabela de vizinhos combinada. Só a chave "Final" é preenchida.
+        Parâmetros:
+            ficha (string) --> Nome da ficha pesquisada
+            limite (int) --> Quantidade máxima de fichas do resultado
+        Retorno: dicionário com os resultados no mesmo formato do atributo "resultados"
+        '''
+        arq_fichas = f'{self._vizinhos.prefixo}.fichas.json'
+        versao = os.path.getmtime(arq_fichas)
+        if self._fichas_vizinhos[0] != versao:
+            with open(arq_fichas, encoding='utf-8') as f:
+                self._fichas_vizinhos = (versao, TabelaFichas(json.load(f)))
+        fichas = self._fichas_vizinhos[1]
+        if ficha not in fichas:
+            print(f'A ficha "{ficha}" não faz parte de nenhuma das dimensões.')
+            return {'Final': None}
+        ids, sims = self._vizinhos.vizinhos(fichas.id(ficha))
+        ids, sims = ids[:limite], np.round(sims[:limite].astype(np.float64) * 100, 2)
+        resultado = pd.DataFrame({('Ficha', ''): fichas.nomes(ids)})
+        for coluna, dimensao in enumerate(self._vizinhos.meta['colunas'][:-1]):
+            resultado[(dimensao, 'per_sim')] = sims[:, coluna]
+            resultado[(dimensao, 'peso')] = self.corpus.peso(dimensao)
+        resultado[('geral', 'per_sim')] = sims[:, -1]
+        resultado.columns = pd.MultiIndex.from_tuples(resultado.columns)
+        resultado.index = [i for i in range(1, resultado.shape[0]+1)]
+        return {'Final': resultado}
+
     def _salvar_twins(self):
         '''
-        Persiste a situação atual do objeto do atributo corpus.
+        Persiste a situação atual do objeto do atributo corpus. Não faz nada se o projeto foi aberto somente para leitura.
         Retorno: None
         '''
+        if self.somente_leitura: return
         twins = dict(corpus_unico = self.corpus_unico
                     ,projeto = self.projeto
-                    ,max_resultados = self.max_resultados)
-        with shelve.open(self._arq_shelve) as db:
+                    ,max_resultados = self.max_resultados
+                    ,paralelismo = self.paralelismo
+                    ,num_workers = self.num_workers
+                    ,cache_max_itens = self.cache_max_itens
+                    ,cache_max_bytes = self.cache_max_bytes)
+        with abrir_shelve(self._arq_shelve) as db:
             db['twins'] = twins
+
+    def _versao_processo(self, dimensao):
+        '''
+        Monta a versão de uma dimensão enviada aos processos de consulta, que abrem o corpus novamente quando ela muda. Ao
+        contrário de Models.versao, não depende de contadores internos do processo principal: compõe-se dos parâmetros dos
+        modelos e das datas de alteração dos arquivos dos modelos e índices.
+        Parâmetros:
+            dimensao (string) --> Nome da dimensão
+        Retorno: tupla que identifica a versão da dimensão
+        '''
+        modelos = self.corpus[dimensao].modelos
+        return (json.dumps(modelos.parametros(), sort_keys=True, default=str), *modelos.versao()[1:])
+
+    def _vizinhos_atual(self, dimensoes, limite):
+        '''
+        Verifica se a tabela de vizinhos combinada pode responder a uma pesquisa nas dimensões informadas com o limite de
+        fichas informado.
+        Retorno: True se a tabela pode ser usada e False caso contrário
+        '''
+        if not limite or not self._vizinhos or not self._vizinhos.abrir(): return False
+        if limite > self._vizinhos.meta['k'] or list(dimensoes) != self._vizinhos.meta['colunas'][:-1]: return False
+        return self._vizinhos.atual(self._assinatura_vizinhos(dimensoes))
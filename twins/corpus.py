@@ -5,14 +5,19 @@ from tqdm.notebook import tqdm
 import pandas as pd
 import locale
 import datetime as dt
-import shelve
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 # Imports Gensim
 #from gensim.corpora import MmCorpus
 from gensim import utils as g_utils
 # Imports Twins
-from twins.utils import StreamCSV, TaggedCorpus, BOWCorpus, FormataDeltatime, obter_link_name
+from twins.utils import StreamCSV, TaggedCorpus, BOWCorpus, ConexaoDB, FormataDeltatime, abrir_shelve, obter_link_name
 from twins.dao import DAOCorpus
 from twins.models import Models
+from twins.publicacao import Publicacoes
+from twins.indices import configurar_executor
+from twins.agendador import Agendador
+from twins.metricas import contar, medir
 
 # Nomes internos simplificados para cronometrar o tempo de execução
 AGORA = dt.datetime.now
@@ -21,6 +26,96 @@ TEMPO = FormataDeltatime()
 # Seta localização
 locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
 
+# Corpus abertos somente para leitura em cada processo de cálculo da tabela de vizinhos
+_CORPUS_VIZINHOS = {}
+
+# Nomes dos spans de métricas de cada etapa da construção
+_SPANS_ETAPAS = {'dicionario': 'montar_dicionario', 'atualizar': 'atualizar_indices', 'treinar': 'treinar_modelo'
+                ,'indexar': 'indexar_modelo'}
+
+def _calcular_vizinhos(classe, projeto, nome, ini, fim, k):
+    '''
+    Calcula os vizinhos de um bloco de fichas dentro de um processo do pool de montagem da tabela de vizinhos. O corpus é
+    aberto somente para leitura na primeira chamada e mantido no processo para os blocos seguintes. Cada processo usa uma
+    única thread nas consultas, pois o paralelismo fica a cargo do pool de processos.
+    Parâmetros:
+        classe (type) --> Classe do corpus: Corpus ou CorpusDimensao
+        projeto (string) --> Nome do projeto
+        nome (string) --> Nome do corpus
+        ini (int) --> Posição da primeira ficha do bloco
+        fim (int) --> Posição final do bloco (exclusiva)
+        k (int) --> Quantidade de vizinhos de cada ficha
+    Retorno: uma tupla com a posição inicial do bloco, os ids e as similaridades dos vizinhos
+    '''
+    chave = (classe.__name__, projeto, nome)
+    if chave not in _CORPUS_VIZINHOS:
+        configurar_executor(1)
+        _CORPUS_VIZINHOS[chave] = classe(projeto=projeto, nome=nome, somente_leitura=True)
+    return (ini, *_CORPUS_VIZINHOS[chave].modelos.vizinhos(range(ini, fim), k))
+
+def _executar_etapa(classe, projeto, nome, etapa, modelo, ajustes, forcar=False):
+    '''
+    Executa uma etapa da construção de um corpus dentro de uma tarefa do agendador, abrindo o corpus somente para leitura,
+    de modo que as configurações do corpus só são gravadas pelo processo principal. Os ajustes dos parâmetros dos modelos
+    valem apenas para essa execução.
+    Parâmetros:
+        classe (str) --> Nome da classe do corpus: "Corpus" ou "CorpusDimensao"
+        projeto (str) --> Nome do projeto do corpus
+        nome (str) --> Nome do corpus
+        etapa (str) --> "dicionario" (monta o dicionário), "treinar" ou "indexar" (treina ou indexa um modelo) ou
+                "atualizar" (inclui as fichas novas nos índices dos modelos)
+        modelo (str) --> Nome do modelo nas etapas "treinar" e "indexar" ou None
+        ajustes (dict str:dict) --> Parâmetros dos modelos a serem alterados, tendo o nome do modelo como chave
+        forcar (boolean) --> Indica se o modelo é treinado ou indexado mesmo que as suas entradas não tenham mudado
+                (default: False)
+    Retorno: as estatísticas do dicionário na etapa "dicionario", a lista dos modelos atualizados na etapa "atualizar" ou
+        True nas demais
+    '''
+    corpus = {'Corpus': Corpus, 'CorpusDimensao': CorpusDimensao}[classe](projeto=projeto, nome=nome, somente_leitura=True)
+    with medir(_SPANS_ETAPAS[etapa], corpus=nome, modelo=modelo):
+        if etapa == 'dicionario':
+            return corpus._dao.montar_dicionario(no_below=corpus.no_below, no_above=corpus.no_above, keep_n=corpus.keep_n)
+        if etapa == 'atualizar':
+            contar('fichas', corpus.num_fichas - corpus._treino['num_fichas'])
+            corpus._dao.incluir_bow_fichas(corpus._treino['num_fichas'], corpus._treino['id_corpus'])
+            return corpus.modelos.atualizar(range(corpus._treino['num_fichas'], corpus.num_fichas))
+        for nome_modelo, parametros in ajustes.items():
+            corpus.modelos._modelos[nome_modelo].update(parametros)
+        contar('fichas', corpus.num_fichas)
+        if etapa == 'treinar': ok = corpus.modelos.treinar_modelo(modelo, forcar=forcar)
+        else: ok = corpus.modelos.indexar_modelo(modelo, forcar=forcar)
+        if not ok: raise RuntimeError(f'Não foi possível {etapa} o modelo "{modelo}" do corpus "{nome}".')
+        return ok
+
+def _montar_agendador(projeto, plano, num_processos=None, memoria_max=None, concluidas=()):
+    '''
+    Monta o agendador com as tarefas de um plano de construção, deixando de fora as tarefas já concluídas. Nos processos
+    paralelos, os treinamentos do Doc2Vec e do LdaMulticore ocupam as CPUs das suas threads ou processos de treinamento,
+    limitadas à quantidade de CPUs do agendador.
+    Parâmetros:
+        projeto (str) --> Nome do projeto
+        plano (dict str:dict) --> Tarefas do plano, tendo o nome da tarefa como chave e, como valor, a classe e o nome do
+                corpus, a etapa, o modelo, as dependências, a memória estimada, as threads usadas, a descrição da tarefa e se
+                o modelo deve ser gerado mesmo que as suas entradas não tenham mudado
+        num_processos (int) --> Quantidade de CPUs usadas pelas tarefas. Se None, usa a quantidade de CPUs da máquina
+        memoria_max (int) --> Memória máxima, em bytes, estimada para as tarefas em execução simultânea
+        concluidas (list de str) --> Tarefas do plano já concluídas (default: tupla vazia)
+    Retorno: o agendador (Agendador)
+    '''
+    agendador = Agendador(num_processos=num_processos, memoria_max=memoria_max)
+    for nome, tarefa in plano.items():
+        if nome in concluidas: continue
+        ajustes, cpus = {}, 1
+        if agendador.num_processos > 1 and tarefa['etapa'] == 'treinar' and tarefa['threads'] > 1:
+            cpus = min(tarefa['threads'], agendador.num_processos)
+            ajustes = {tarefa['modelo']: {'workers': cpus}}
+        agendador.incluir(nome, _executar_etapa
+                         ,args=(tarefa['classe'], projeto, tarefa['corpus'], tarefa['etapa'], tarefa['modelo'], ajustes
+                               ,tarefa.get('forcar', False))
+                         ,dependencias=tarefa['dependencias'], memoria=tarefa['memoria'], cpus=cpus
+                         ,descricao=tarefa['descricao'])
+    return agendador
+
 # TODO
 #   Análise de atributos:
 #       * Montar gráficos para mostrar a distribuição dos tokens de um atributo pelas fichas
@@ -45,8 +140,16 @@ class Corpus:
                 espaços entre as palavras
         nome (string) --> Nome do corpus. Não é sensitive case, ignora acentos e quantidade de espaços entre as palavras
                 (default: "Geral")
+        somente_leitura (boolean) --> Indica se o corpus é aberto apenas para consultas, sem persistir as configurações.
+                Permite que outros processos abram o corpus enquanto ele é usado (default: False)
+        publicado (boolean) --> Indica se o corpus é aberto somente para leitura a partir da última versão publicada dos
+                modelos e índices (ver "publicar"), com o DB aberto apenas para leitura. Permite consultar o corpus enquanto
+                outro processo inclui documentos e reconstrói os modelos. Se nenhuma versão foi publicada, usa os arquivos
+                atuais do corpus (default: False)
     Atributos:
         nome (string) --> Nome do corpus (é sempre "Geral")
+        somente_leitura (boolean) --> Indica se o corpus foi aberto apenas para consultas
+        publicado (boolean) --> Indica se o corpus foi aberto a partir da última versão publicada
         projeto (string) --> Nome do projeto ao qual pertence o corpus
         acentos (list de string) --> Lista dos atributos, além dos "word", de cujos valores devem ser excluídos os acentos (default: lista vazia)
         tags_relac (list de string) --> Lista de palavras chaves que identificam relacionamentos em atributos (default: ['cpf', 'cnpj'])
@@ -75,8 +178,19 @@ class Corpus:
         min_tokens_ficha (int) --> Mínimo de tokens em uma única ficha após a filtragem
         avg_tokens_ficha (float) --> Média de tokens por ficha após a filtragem
         sdv_tokens_ficha (float) --> Desvio padrão de tokens por ficha após a filtragem
+        atualizacao_incremental (boolean) --> Indica se as fichas novas são incluídas nos índices dos modelos já treinados,
+                sem treiná-los novamente, enquanto não houver deriva em relação ao último treinamento (default: True)
+        max_fichas_incrementais (float) --> Percentual máximo de fichas incluídas desde o último treinamento para que a
+                atualização seja incremental (default: 0.1)
+        max_oov (float) --> Percentual máximo das ocorrências de tokens das fichas novas que estão fora do dicionário para
+                que a atualização seja incremental (default: 0.2)
+        max_dias_treino (int) --> Quantidade de dias após o último treinamento a partir da qual os modelos são treinados
+                novamente. Se None, não há limite (default: None)
+        publicar_versoes (boolean) --> Indica se uma nova versão dos modelos e índices é publicada a cada treinamento ou
+                atualização dos índices e a cada montagem da tabela de vizinhos (default: False)
+        versoes_mantidas (int) --> Quantidade de versões publicadas mantidas em disco (default: 3)
     '''
-    def __init__(self, projeto, nome='Geral'):
+    def __init__(self, projeto, nome='Geral', somente_leitura=False, publicado=False):
         # Atributos expostos do objeto que são persistidos
         self.nome = nome
         self.projeto = projeto
@@ -107,8 +221,16 @@ class Corpus:
         self.min_tokens_ficha = 0
         self.avg_tokens_ficha = 0
         self.sdv_tokens_ficha = 0
+        self.atualizacao_incremental = True
+        self.max_fichas_incrementais = 0.1
+        self.max_oov = 0.2
+        self.max_dias_treino = None
+        self.publicar_versoes = False
+        self.versoes_mantidas = 3
         # Atributos expostos do objeto que NÃO são persistidos
         self.modelos = None
+        self.somente_leitura = somente_leitura or publicado
+        self.publicado = publicado
         # Atributos internos que são persistidos
         self._atributo_ficha = ''
         self._lendo_csv = False
@@ -120,6 +242,9 @@ class Corpus:
         self._id_origem = None
         self._atributos = {}
         self._has_dict = False
+        self._treino = None
+        self._assinatura_dicionario = None
+        self._assinatura_bow = None
         # Atributos internos que não são persistidos
         self._pastas = {}
         self._regex = {}
@@ -128,6 +253,8 @@ class Corpus:
         self._arqs = {}
         self._dao = None
         self._tokens = {}
+        self._publicacoes = None
+        self._versao_publicada = None
         self._update_relac = False  # Atributo de controle para a subclasse CorpusDimensao
         # Obtém as configurações anteriores do corpus ou inicia os arquivos e nomes de arquivos
         self._iniciar_corpus()
@@ -156,6 +283,27 @@ class Corpus:
         # Persiste a nova relação de atributos cujos acentos devem ser removidos
         self._salvar_configuracoes()
         
+    def ajustar_atualizacao(self, atualizacao_incremental=None, max_fichas_incrementais=None, max_oov=None
+                           ,max_dias_treino=-1):
+        '''
+        Altera os parâmetros que decidem se as fichas novas são incluídas de forma incremental nos índices dos modelos ou
+        se os modelos são treinados novamente. Os parâmetros não informados no método manterão os valores definidos
+        anteriormente.
+        Parâmetros:
+            atualizacao_incremental (boolean) --> Indica se a atualização incremental é permitida
+            max_fichas_incrementais (float) --> Percentual máximo de fichas incluídas desde o último treinamento
+            max_oov (float) --> Percentual máximo das ocorrências de tokens das fichas novas fora do dicionário
+            max_dias_treino (int) --> Quantidade de dias após o último treinamento a partir da qual os modelos são treinados
+                    novamente. None retira o limite
+        Retorno: None
+        '''
+        if atualizacao_incremental is not None: self.atualizacao_incremental = atualizacao_incremental
+        if max_fichas_incrementais is not None: self.max_fichas_incrementais = max_fichas_incrementais
+        if max_oov is not None: self.max_oov = max_oov
+        if max_dias_treino != -1: self.max_dias_treino = max_dias_treino
+        # Persiste os novos parâmetros
+        self._salvar_configuracoes()
+
     def ajustar_dicionario(self, no_below=None, no_above=None, keep_n=None):
         '''
         Altera os hiperparâmetros do corpus referentes ao dicionário. Os hiperparâmetros não informados no método manterão os
@@ -170,9 +318,40 @@ class Corpus:
         if no_below: self.no_below = no_below
         if no_above: self.no_above = no_above
         if keep_n: self.keep_n = keep_n
+        # Os próximos documentos incluídos levam ao treinamento completo, com o dicionário montado pelos novos parâmetros
+        self._treino = None
         # Persiste os novos parâmetros
         self._salvar_configuracoes()
 
+    def ajustar_perfil_sql(self, ativo=True, lento=0.1):
+        '''
+        Ativa ou desativa o perfil dos comandos SQL executados no DB do corpus. O perfil não é persistido e vale apenas para
+        este objeto.
+        Parâmetros:
+            ativo (boolean) --> Indica se os comandos SQL passam a ser registrados (default: True)
+            lento (float) --> Tempo, em segundos, a partir do qual o plano de execução do comando é capturado (default: 0.1)
+        Retorno: o perfil ativado (PerfilSQL) ou None se ele foi desativado
+        '''
+        return self._dao.ajustar_perfil_sql(ativo=ativo, lento=lento)
+
+    def ajustar_publicacao(self, publicar_versoes=None, versoes_mantidas=None):
+        '''
+        Define se as versões dos modelos e índices do corpus são publicadas automaticamente (ver "publicar").
+        Parâmetros:
+            publicar_versoes (boolean) --> Indica se uma nova versão é publicada a cada treinamento ou atualização dos
+                    índices e a cada montagem da tabela de vizinhos. Se None, mantém o valor atual (default: None)
+            versoes_mantidas (int) --> Quantidade de versões publicadas mantidas em disco. Se None, mantém o valor atual
+                    (default: None)
+        Retorno: None
+        '''
+        if publicar_versoes is not None: self.publicar_versoes = publicar_versoes
+        if versoes_mantidas is not None:
+            if versoes_mantidas < 1:
+                print('É preciso manter ao menos uma versão publicada.')
+                return
+            self.versoes_mantidas = versoes_mantidas
+        self._salvar_configuracoes()
+
     def ajustar_tags_relacionamentos(self, tags, incluir=True):
         '''
         Exclui ou inclui tags para identificação de relacionamentos.
@@ -220,6 +399,51 @@ class Corpus:
         '''
         return self._dao.obter_atributos()
 
+    def atualizar_modelos(self, forcar=False, num_processos=None, memoria_max=None):
+        '''
+        Atualiza os modelos após a inclusão de documentos. Enquanto não houver deriva em relação ao último treinamento, as
+        fichas novas são apenas incluídas nos índices dos modelos já treinados, com o dicionário mantido. Os modelos são
+        treinados novamente, com a montagem de um novo dicionário, se não houver treinamento anterior, se fichas já
+        existentes receberam novos tokens ou se algum dos limites de "ajustar_atualizacao" for ultrapassado.
+        Parâmetros:
+            forcar (boolean) --> Indica se os modelos devem ser treinados novamente em qualquer caso (default: False)
+            num_processos (int) --> Quantidade de CPUs usadas no treinamento, como em "vetorizar" (default: None)
+            memoria_max (int) --> Memória máxima, em bytes, usada no treinamento, como em "vetorizar" (default: None)
+        Retorno: None
+        '''
+        motivo, metricas = self._motivo_treino(forcar)
+        if motivo:
+            print(f'Os modelos do corpus "{self.nome}" serão treinados novamente: {motivo}.')
+            # Monta o dicionário
+            self.montar_dicionario()
+            # Cria as versões vetorizadas do corpus
+            self.vetorizar(num_processos=num_processos, memoria_max=memoria_max, forcar=forcar)
+            return
+        if not metricas['fichas_novas']:
+            print(f'Não há fichas novas para incluir nos modelos do corpus "{self.nome}".')
+            return
+        print(f'Incluindo {metricas["fichas_novas"]} fichas novas nos índices dos modelos do corpus "{self.nome}"')
+        t0 = AGORA()
+        id_ficha_ini = self._treino['num_fichas']
+        with medir('atualizar_indices', corpus=self.nome):
+            contar('fichas', metricas['fichas_novas'])
+            self._dao.incluir_bow_fichas(id_ficha_ini, self._treino['id_corpus'])
+            self.modelos.atualizar(range(id_ficha_ini, self.num_fichas))
+        self._somar_assinatura_bow(id_ficha_ini)
+        self._registrar_treino(incremental=True)
+        TEMPO.formatar(AGORA() - t0)
+        print(f'Fichas novas incluídas em {TEMPO}')
+
+    def carregar(self):
+        '''
+        Carrega em memória a tabela de fichas, o dicionário, os modelos e os índices do corpus, o que evita a leitura do
+        disco nas primeiras consultas de um processo de longa duração.
+        Retorno: None
+        '''
+        self._dao.obter_fichas()
+        if self._has_dict: self._dao.obter_bow_tokens([])
+        self.modelos.carregar()
+
     def corpus(self, tipo='bow', ficha=None):
         '''
         Retorna o streamming do corpus no tipo indicado ou um documento no tipo indicado referente à ficha passada.
@@ -316,7 +540,7 @@ class Corpus:
             return None
         return ficha
 
-    def incluir_documentos_csv(self, arq_csv=None, sep=',', nrows=None, total_docs=None, ind_tokens=True):
+    def incluir_documentos_csv(self, arq_csv=None, sep=',', nrows=None, total_docs=None, ind_tokens=True, construir=True):
         '''
         Povoa um corpus a partir de um arquivo CSV. Nesse arquivo, a primeira coluna é o nome da ficha no corpus
         enquanto as demais são os valores dos atributos do documento. O nome da ficha é um string e o nome do atributo é o nome
@@ -334,6 +558,8 @@ class Corpus:
                                  progresso. Se None, a barra apenas conta o número de documentos lidos (default: None)
             ind_tokens (boolean) --> Indica se os valores já são tokens montados (True) ou se é preciso compor os tokens agrupando
                                      os valores das linhas com os nomes das colunas (False) (default: True)
+            construir (boolean) --> Indica se o dicionário e os modelos são atualizados ao final da leitura (True) ou se
+                                    ficam para uma construção posterior, como a de Twins.construir (False) (default: True)
         Retorno: None
         '''
         # Verifica se a dimensão é a relacionamentos não é derivada de outra
@@ -358,24 +584,27 @@ class Corpus:
             elif not total_docs and nrows: self._total_docs = nrows
             else: self._total_docs = total_docs
             self._docs_lidos = 0
-        # Cria o streamming dos dados do documento
-        reader = StreamCSV(self._arquivo_csv, sep=self._sep, nrows=self._nrows, start=self._docs_lidos)
-        if self._docs_lidos == 0:
-            # Faz os registros iniciais, já que não começou a leitura do CSV
-            self._id_origem = self._dao.registrar_origem(self._arquivo_csv, self._nrows)
-            self._atributo_ficha = reader.atributos[0]
-            self._atributos = self._dao.registrar_lista_atributos(reader.atributos[1:])
+        with medir('incluir_documentos_csv', corpus=self.nome):
+            # Cria o streamming dos dados do documento
+            reader = StreamCSV(self._arquivo_csv, sep=self._sep, nrows=self._nrows, start=self._docs_lidos)
+            if self._docs_lidos == 0:
+                # Faz os registros iniciais, já que não começou a leitura do CSV
+                self._id_origem = self._dao.registrar_origem(self._arquivo_csv, self._nrows)
+                self._atributo_ficha = reader.atributos[0]
+                self._atributos = self._dao.registrar_lista_atributos(reader.atributos[1:])
+                self._salvar_configuracoes()
+            # Inclui no corpus os dados do CSV
+            if self._total_docs: total = self._total_docs - self._docs_lidos
+            # A leitura faz commits a cada documento, que não precisam esperar a gravação em disco
+            with medir('leitura_csv', corpus=self.nome), ConexaoDB.carga():
+                for chunk in tqdm(reader, desc='Reading CSV:', total=total):
+                    self._montar_corpus(chunk, ind_tokens)
+            # Anota o final da leitura e a quantidade atual de documentos lidos
+            self.num_docs += self._docs_lidos
+            self._lendo_csv = False
             self._salvar_configuracoes()
-        # Inclui no corpus os dados do CSV
-        if self._total_docs: total = self._total_docs - self._docs_lidos
-        for chunk in tqdm(reader, desc='Reading CSV:', total=total):
-            self._montar_corpus(chunk, ind_tokens)
-        # Anota o final da leitura e a quantidade atual de documentos lidos
-        self.num_docs += self._docs_lidos
-        self._lendo_csv = False
-        self._salvar_configuracoes()
-        # Realizar o encerramento do método
-        self._encerrar_incluir_documentos()
+            # Realizar o encerramento do método
+            self._encerrar_incluir_documentos(construir)
 
     def infos(self):
         '''
@@ -450,15 +679,65 @@ class Corpus:
         print(f'Média de tokens para cada ficha: {avg_tokens_ficha}')
         print(f'Desvio padrão de tokens para cada ficha: {sdv_tokens_ficha}')
 
+    def melhores(self, ficha, k):
+        '''
+        Obtém as k fichas mais semelhantes à ficha indicada pela busca das melhores fichas de cada modelo, sem usar a tabela
+        de vizinhos, de modo que as similaridades são as mesmas da pesquisa completa e de "semelhantes_fichas". Se os índices
+        ou os parâmetros dos modelos não permitirem a busca, retorna o resultado da pesquisa completa.
+        Parâmetros:
+            ficha (string) --> Ficha que servirá de comparação para buscar as semelhantes
+            k (int) --> Quantidade de fichas a serem retornadas
+        Retorno: uma tupla onde o primeiro elemento é um indicador de que há um resultado e o segundo é um Pandas DataFrame
+            na ordem decrescente de semelhança com as k fichas mais semelhantes ou, se a busca não puder ser limitada, com
+            todas as fichas
+        '''
+        id_ficha = self.ficha2id(ficha)
+        if id_ficha is None: return False, None
+        resultado = self.modelos.melhores(id_ficha, k)
+        if resultado is None: resultado = self.modelos.semelhantes(id_ficha)
+        # Substitui os id's pelos valores das fichas
+        with medir('nomes_fichas', corpus=self.nome):
+            resultado.index = self._dao.obter_fichas_ids(resultado.index)
+        return True, resultado
+
+    def metricas_atualizacao(self):
+        '''
+        Calcula as métricas de deriva do corpus, usadas para decidir entre a atualização incremental e um novo treinamento.
+        As fichas a incluir e as fichas alteradas são contadas a partir da última atualização dos índices, enquanto o
+        percentual de fichas novas, o de tokens fora do dicionário e os dias são medidos em relação ao último treinamento
+        completo, de modo que as atualizações incrementais sucessivas se acumulam até atingir os limites.
+        Retorno: dicionário com a quantidade de fichas novas e de fichas já existentes que receberam novos tokens desde a
+            última atualização, o percentual de fichas novas, o percentual das ocorrências de tokens das fichas novas fora
+            do dicionário e os dias desde o último treinamento, ou None se não houver registro de treinamento
+        '''
+        if not self._treino: return None
+        fichas_novas = self.num_fichas - self._treino['num_fichas']
+        alteradas, ocorrencias, fora = self._dao.obter_metricas_novos(self._treino['num_fichas'], self._treino['id_detalhe'])
+        # Os registros anteriores às marcas do último treinamento completo tinham só as marcas da última atualização
+        fichas_treino = self._treino.get('fichas_treino', self._treino['num_fichas'])
+        id_detalhe_treino = self._treino.get('id_detalhe_treino', self._treino['id_detalhe'])
+        if (fichas_treino, id_detalhe_treino) != (self._treino['num_fichas'], self._treino['id_detalhe']):
+            _, ocorrencias, fora = self._dao.obter_metricas_novos(fichas_treino, id_detalhe_treino)
+        data = dt.datetime.strptime(self._treino['data'], '%Y-%m-%d %H:%M:%S')
+        return dict(fichas_novas=fichas_novas
+                   ,fichas_alteradas=alteradas
+                   ,perc_fichas_novas=(self.num_fichas - fichas_treino) / fichas_treino if fichas_treino else 1.0
+                   ,perc_oov=fora / ocorrencias if ocorrencias else 0.0
+                   ,dias=(AGORA() - data).days)
+
     def montar_dicionario(self):
         '''
         Monta o dicionário a partir do corpus, obtém as estatísticas e vetoriza o corpus nos tipos implementados.
         Retorno: None
         '''
+        # Os índices deixam de corresponder ao último treinamento até que os modelos sejam gerados novamente
+        self._treino = None
         # Monta o dicionário filtrado e recebe as estatísticas
         print(f'Montando o dicionário do corpus "{self.nome}"')
         t0 = AGORA()
-        est = self._dao.montar_dicionario(no_below=self.no_below, no_above=self.no_above, keep_n=self.keep_n)
+        with medir('montar_dicionario', corpus=self.nome):
+            est = self._dao.montar_dicionario(no_below=self.no_below, no_above=self.no_above, keep_n=self.keep_n)
+            contar('tokens', est['num_tokens'] or 0)
         TEMPO.formatar(AGORA() - t0)
         print(f'O dicionário foi montado em {TEMPO}')
         # Informa que há um dicionário
@@ -468,6 +747,49 @@ class Corpus:
         # Salva as estatísticas
         self._povoar_atributos(est, zero=True)
 
+    def montar_vizinhos(self, k=100, tamanho_bloco=None, num_processos=None, memoria_bloco=256*2**20):
+        '''
+        Monta a tabela das k fichas mais semelhantes a cada ficha do corpus (grafo kNN), usada por "semelhantes" quando é
+        informado um top_k não maior que k. As fichas são divididas em blocos cujas similaridades são calculadas na forma
+        de matrizes em um pool de processos. Cada bloco concluído é gravado em disco, de modo que, se a montagem for
+        interrompida, uma nova chamada com os mesmos parâmetros continua dos blocos pendentes. A tabela deixa de ser usada
+        quando os modelos são gerados novamente ou quando os pesos ou percentuais mínimos dos modelos são ajustados.
+        Parâmetros:
+            k (int) --> Quantidade de vizinhos de cada ficha (default: 100)
+            tamanho_bloco (int) --> Quantidade de fichas de cada bloco. Se None, é calculada a partir de memoria_bloco
+                    (default: None)
+            num_processos (int) --> Número de processos do pool. Se for 1, calcula no próprio processo. Se None, usa o
+                    número de CPUs da máquina (default: None)
+            memoria_bloco (int) --> Memória aproximada, em bytes, usada no cálculo de um bloco (default: 256 MB)
+        Retorno: None
+        '''
+        if not self._has_dict or not self.num_fichas:
+            print(f'O corpus "{self.nome}" ainda não foi vetorizado.')
+            return
+        modelos = self.modelos.tipos_modelos()
+        if not tamanho_bloco:
+            tamanho_bloco = int(max(1, min(1024, memoria_bloco // (self.num_fichas * (16 + 2 * len(modelos))))))
+        tabela = self.modelos._vizinhos
+        retomada = tabela.criar(self.num_fichas, k, modelos + ['geral'], tamanho_bloco, self.modelos.assinatura_vizinhos())
+        pendentes = tabela.blocos_pendentes()
+        if retomada: print(f'Retomando a tabela de vizinhos do corpus "{self.nome}": {len(pendentes)} blocos pendentes')
+        else: print(f'Montando a tabela de vizinhos do corpus "{self.nome}" em {len(pendentes)} blocos de {tamanho_bloco} fichas')
+        t0 = AGORA()
+        with medir('montar_vizinhos', corpus=self.nome, k=k):
+            contar('blocos', len(pendentes))
+            if num_processos == 1:
+                for ini, fim in tqdm(pendentes, desc='Vizinhos:'):
+                    tabela.gravar_bloco(ini, *self.modelos.vizinhos(range(ini, fim), k))
+            else:
+                with ProcessPoolExecutor(max_workers=num_processos or os.cpu_count()) as pool:
+                    futuros = [pool.submit(_calcular_vizinhos, type(self), self.projeto, self.nome, ini, fim, k)
+                               for ini, fim in pendentes]
+                    for futuro in tqdm(as_completed(futuros), desc='Vizinhos:', total=len(futuros)):
+                        tabela.gravar_bloco(*futuro.result())
+        TEMPO.formatar(AGORA() - t0)
+        print(f'A tabela de vizinhos foi montada em {TEMPO}')
+        if self.publicar_versoes: self.publicar()
+
     def parametros_modelos(self):
         '''
         Mostra os parâmetros usados nos modelos do corpus
@@ -480,23 +802,145 @@ class Corpus:
             for parametro, valor in parametros.items():
                 print(f'    --> {parametro} = {valor}')
 
-    def semelhantes(self, ficha, teste=False):
+    def publicar(self):
+        '''
+        Publica uma nova versão dos modelos, dos índices e da tabela de vizinhos do corpus, com uma cópia das tabelas do DB
+        e das configurações usadas nas consultas. As instâncias do corpus abertas com publicado=True consultam a última
+        versão publicada enquanto este corpus continua recebendo documentos e sendo reconstruído, e passam a consultar a
+        nova versão ao serem abertas novamente (ver Twins.atualizar_publicacao). Somente as últimas "versoes_mantidas"
+        versões são mantidas em disco.
+        Retorno: o número da versão publicada (int) ou None se ela não pôde ser publicada
+        '''
+        if self.somente_leitura:
+            print(f'O corpus "{self.nome}" foi aberto somente para leitura.')
+            return None
+        if not self._treino:
+            print(f'Os índices dos modelos do corpus "{self.nome}" ainda não foram montados.')
+            return None
+        with medir('publicar', corpus=self.nome):
+            publicacao = self._publicacoes.publicar(self, manter=self.versoes_mantidas)
+        print(f'Publicada a versão {publicacao["versao"]} do corpus "{self.nome}" com {publicacao["num_fichas"]} fichas')
+        return publicacao['versao']
+
+    def relatorio_sql(self, top=10, ordem='tempo_total'):
+        '''
+        Mostra os comandos SQL mais custosos executados no DB do corpus desde que o perfil foi ativado por
+        "ajustar_perfil_sql", com os planos de execução dos comandos lentos.
+        Parâmetros:
+            top (int) --> Quantidade de modelos de comando mostrados. Se None, mostra todos (default: 10)
+            ordem (str) --> Coluna usada para ordenar os comandos: 'tempo_total', 'tempo_max', 'execucoes' ou 'linhas'
+                (default: 'tempo_total')
+        Retorno: Pandas DataFrame com as estatísticas dos comandos ou None se o perfil não estiver ativo
+        '''
+        return self._dao.relatorio_sql(top=top, ordem=ordem)
+
+    def semelhantes(self, ficha, teste=False, top_k=None):
         '''
         Pesquisa no corpus quais fichas tem características mais semelhantes às da ficha indicada.
         Parâmetros:
             ficha (string) --> Ficha que servirá de comparação para buscar as semelhantes
+            top_k (int) --> Se informado, retorna apenas as top_k fichas mais semelhantes, obtidas diretamente da tabela de
+                    vizinhos se ela estiver atualizada e tiver ao menos top_k vizinhos por ficha ou, senão, pela busca das
+                    melhores fichas de cada modelo (default: None)
         Retorno: uma tupla onde o primeiro elemento é um indicador de que há um resultado e o segundo é um Pandas DataFrame
             na ordem decrescente de semelhança das fichas
         '''
-        id_ficha = self.ficha2id(ficha)
-        if id_ficha is None: return False, None
-        resultado = self.modelos.semelhantes(id_ficha, teste=teste)
-        # Substitui os id's pelos valores das fichas
-        fichas = []
-        for indice in resultado.index:
-            fichas.append(self.id2ficha(indice))
-        resultado.index = fichas
-        return True, resultado
+        with medir('semelhantes', corpus=self.nome):
+            id_ficha = self.ficha2id(ficha)
+            if id_ficha is None: return False, None
+            resultado = None
+            if top_k and not teste:
+                resultado = self.modelos.semelhantes_vizinhos(id_ficha, top_k)
+                if resultado is None: resultado = self.modelos.melhores(id_ficha, top_k)
+            if resultado is None:
+                resultado = self.modelos.semelhantes(id_ficha, teste=teste)
+                if top_k: resultado = resultado.head(top_k)
+            # Substitui os id's pelos valores das fichas
+            with medir('nomes_fichas', corpus=self.nome):
+                resultado.index = self._dao.obter_fichas_ids(resultado.index)
+            return True, resultado
+
+    def semelhantes_documento(self, atributos, ind_tokens=True, teste=False):
+        '''
+        Pesquisa no corpus quais fichas tem características mais semelhantes às de um documento que não faz parte do
+        corpus. O documento é tokenizado com as mesmas regras de incluir_documentos_csv, mas não é incluído no corpus.
+        Parâmetros:
+            atributos (dict str:str) --> Valores dos atributos do documento, tendo o nome do atributo como chave
+            ind_tokens (boolean) --> Indica se os valores já são tokens montados (True) ou se é preciso compor os tokens
+                    agrupando os valores com os nomes dos atributos (False) (default: True)
+        Retorno: uma tupla onde o primeiro elemento é um indicador de que há um resultado e o segundo é um Pandas DataFrame
+            na ordem decrescente de semelhança das fichas
+        '''
+        with medir('semelhantes_documento', corpus=self.nome):
+            with medir('tokenizar', corpus=self.nome):
+                tokens = self._tokens_documento(atributos, ind_tokens)
+                bow = self._dao.obter_bow_tokens(tokens)
+                contar('tokens', len(tokens))
+            if not bow: return False, None
+            resultado = self.modelos.semelhantes_documento(bow, tokens, teste=teste)
+            # Substitui os id's pelos valores das fichas
+            with medir('nomes_fichas', corpus=self.nome):
+                resultado.index = self._dao.obter_fichas_ids(resultado.index)
+            return True, resultado
+
+    def semelhantes_fichas(self, ficha, fichas):
+        '''
+        Pesquisa a semelhança da ficha indicada apenas com as fichas informadas, sem ordenar todas as fichas do corpus. As
+        fichas informadas que não fazem parte do corpus são desconsideradas.
+        Parâmetros:
+            ficha (string) --> Ficha que servirá de comparação
+            fichas (list de string) --> Fichas a serem comparadas
+        Retorno: uma tupla onde o primeiro elemento é um indicador de que há um resultado e o segundo é um Pandas DataFrame
+            na ordem decrescente de semelhança, apenas com as fichas informadas
+        '''
+        with medir('semelhantes_fichas', corpus=self.nome):
+            id_ficha = self.ficha2id(ficha)
+            if id_ficha is None: return False, None
+            ids = [id_outra for id_outra in self._dao.obter_ids_fichas(fichas) if id_outra is not None]
+            resultado = self.modelos.semelhantes_ids(id_ficha, ids)
+            # Substitui os id's pelos valores das fichas
+            with medir('nomes_fichas', corpus=self.nome):
+                resultado.index = self._dao.obter_fichas_ids(resultado.index)
+            return True, resultado
+
+    def semelhantes_lote(self, consultas, ind_tokens=True, teste=False):
+        '''
+        Pesquisa as fichas mais semelhantes para um lote de consultas, calculando as similaridades de todo o lote de uma só
+        vez em cada modelo.
+        Parâmetros:
+            consultas (list) --> Consultas do lote. Cada consulta é o nome de uma ficha do corpus (string) ou os valores dos
+                    atributos de um documento avulso (dict str:str)
+            ind_tokens (boolean) --> Indica se os valores dos documentos avulsos já são tokens montados (True) ou se é preciso
+                    compor os tokens agrupando os valores com os nomes dos atributos (False) (default: True)
+        Retorno: lista de tuplas, uma para cada consulta, onde o primeiro elemento é um indicador de que há um resultado e o
+            segundo é um Pandas DataFrame na ordem decrescente de semelhança das fichas
+        '''
+        with medir('semelhantes_lote', corpus=self.nome):
+            contar('consultas', len(consultas))
+            # Converte as consultas para o formato de Models, descartando as que não podem ser respondidas
+            validas, posicoes = [], []
+            with medir('tokenizar', corpus=self.nome):
+                for posicao, consulta in enumerate(consultas):
+                    if isinstance(consulta, dict):
+                        tokens = self._tokens_documento(consulta, ind_tokens)
+                        bow = self._dao.obter_bow_tokens(tokens)
+                        contar('tokens', len(tokens))
+                        if not bow: continue
+                        validas.append((bow, tokens))
+                    else:
+                        id_ficha = self.ficha2id(consulta)
+                        if id_ficha is None: continue
+                        validas.append(id_ficha)
+                    posicoes.append(posicao)
+            retorno = [(False, None)] * len(consultas)
+            if not validas: return retorno
+            resultados = self.modelos.semelhantes_lote(validas, teste=teste)
+            with medir('nomes_fichas', corpus=self.nome):
+                for posicao, resultado in zip(posicoes, resultados):
+                    # Substitui os id's pelos valores das fichas
+                    resultado.index = self._dao.obter_fichas_ids(resultado.index)
+                    retorno[posicao] = (True, resultado)
+            return retorno
 
     def testar_corpus(self, vetor_testes=[], sucesso=100):
         '''
@@ -529,10 +973,12 @@ class Corpus:
         return pd.DataFrame(data=resultados)
 
     def testar_modelos_topicos(self, modelos=None, num_topicos=[20, 50, 100, 200, 300, 400, 500, 1000, 1500]
-                              ,perc_fichas=0.2, vetor_testes=[], tipo_teste='similaridade'):
+                              ,perc_fichas=0.2, vetor_testes=[], tipo_teste='similaridade', num_processos=None
+                              ,memoria_max=None):
         '''
         Testa os modelos gerados por tópicos para uma lista de quantidade de tópicos a fim de encontrar
-        o melhor número de tópicos para o modelo com relação ao corpus.
+        o melhor número de tópicos para o modelo com relação ao corpus. Os treinamentos de todos os modelos e quantidades
+        de tópicos são executados em um único pool de processos.
         Parâmetros:
             modelos (list de strings) --> Modelos a serem testados: "lda", "lsi" ou "doc2vec". Se None, testa todos.
             num_topics (list de int) --> Lista de números de tópicos a serem testados (default: [20, 50, 100, 200, 300, 400, 500, 1000, 1500])
@@ -540,6 +986,10 @@ class Corpus:
             vetor_testes (list de tuple (str, str)) --> Lista de pares de fichas, sendo a primeira o argumento de pesquisa
                 e a segunda a ficha cuja semelhança se espera encontrar
             tipo_testes (string) --> Tipo de teste: "u_mass" ou "similaridade" (default: "similaridade")
+            num_processos (int) --> Quantidade máxima de treinamentos simultâneos. Se None, usa a quantidade de CPUs
+                    (default: None)
+            memoria_max (int) --> Memória máxima estimada, em bytes, da soma dos treinamentos simultâneos. Se None, não
+                    limita a memória (default: None)
         Retorno: um dicionário de dicionários. A chave do dicionário principal é o nome do modelo. Para cada modelo há outro
             dicionário, com as seguintes chaves:
                 "medida" --> Um objeto Series de pandas com os valores de medida calculados para o modelo com cada número
@@ -559,22 +1009,29 @@ class Corpus:
         testes_modelos = {}
         tipos_modelos = ['lda', 'lsi', 'doc2vec']
         modelos = modelos or tipos_modelos
-        for modelo in tqdm(modelos):
+        for modelo in modelos:
             if modelo not in tipos_modelos:
                 print(f'O modelo "{modelo}" ou não foi implementado ou não é de tópicos.')
-            print(f'Testando o modelo para tranformar o corpus "{self.nome}" no tipo "{modelo}"')
-            t0 = AGORA()
-            testes = self.modelos.testar_num_topics(modelo=modelo, num_topicos=num_topicos, perc_fichas=perc_fichas
-                                                   ,vetor_testes=vetor_testes, tipo_teste=tipo_teste)
-            TEMPO.formatar(AGORA() - t0)
-            print(f'Modelo "{modelo}" testado em {TEMPO}')
-            print()
-            if not testes:
+        modelos = [modelo for modelo in modelos if modelo in tipos_modelos]
+        if tipo_teste == 'u_mass' and 'doc2vec' in modelos:
+            print('O teste de coerência com u_mass não pode ser usado para o modelo doc2vec.')
+            testes_modelos['doc2vec'] = None
+            modelos.remove('doc2vec')
+        print(f'Testando os modelos {modelos} para tranformar o corpus "{self.nome}"')
+        t0 = AGORA()
+        with medir('testar_modelos_topicos', corpus=self.nome):
+            testes = self.modelos._testar_topicos(modelos, num_topicos, perc_fichas, vetor_testes, tipo_teste
+                                                  ,num_processos=num_processos, memoria_max=memoria_max) or {}
+        TEMPO.formatar(AGORA() - t0)
+        print(f'Modelos testados em {TEMPO}')
+        print()
+        for modelo in modelos:
+            if not testes.get(modelo):
                 testes_modelos[modelo] = None
                 continue
-            medida = pd.Series([testes[num]['medida'] for num in testes], index=list(testes.keys()))
+            medida = pd.Series([testes[modelo][num]['medida'] for num in testes[modelo]], index=list(testes[modelo].keys()))
             medida = medida.sort_index()
-            testes_modelos[modelo] = {'medida': medida, 'modelos': {num: testes[num]['modelo'] for num in testes}}
+            testes_modelos[modelo] = {'medida': medida, 'modelos': {num: testes[modelo][num]['modelo'] for num in testes[modelo]}}
         return testes_modelos
 
     def testar_modelos(self, modelos=None, vetor_testes=[], sucesso=100):
@@ -606,7 +1063,9 @@ class Corpus:
                 print(f'O modelo "{modelo}" ou não foi implementado.')
             print(f'Testando o modelo para tranformar o corpus "{self.nome}" no tipo "{modelo}"')
             t0 = AGORA()
-            testes_modelos[modelo] = self.modelos.testar_modelo(modelo=modelo, vetor_testes=vetor_testes, sucesso=sucesso)
+            with medir('testar_modelo', corpus=self.nome, modelo=modelo):
+                contar('consultas', len(vetor_testes))
+                testes_modelos[modelo] = self.modelos.testar_modelo(modelo=modelo, vetor_testes=vetor_testes, sucesso=sucesso)
             sucessos.append(testes_modelos[modelo]['sucesso'].sum())
             TEMPO.formatar(AGORA() - t0)
             print(f'Modelo "{modelo}" testado em {TEMPO}')
@@ -614,11 +1073,21 @@ class Corpus:
         testes_modelos['Geral'] = pd.DataFrame(data={'modelo': modelos, 'sucessos': sucessos})
         return testes_modelos
 
-    def vetorizar(self, modelos=None):
+    def vetorizar(self, modelos=None, num_processos=None, memoria_max=None, forcar=False):
         '''
-        Cria modelos para representações vetorizadas do corpus.
+        Cria modelos para representações vetorizadas do corpus. O treinamento e a indexação de cada modelo são tarefas de um
+        agendador, que executa em paralelo as tarefas independentes. Apenas o "lsi" depende de outro modelo, o "tfidf", e a
+        indexação de cada modelo depende do seu treinamento. Nos processos paralelos, o LDA é treinado com o LdaModel, pois o
+        LdaMulticore cria os seus próprios processos, e o Doc2Vec ocupa as CPUs das suas threads de treinamento. As etapas
+        cujas entradas (dicionário, corpus e hiperparâmetros) não mudaram desde a última geração são dispensadas.
         Parâmetros:
             modelos (list de string) --> Lista de modelos a serem executados. Se None, executa todos os modelos.
+            num_processos (int) --> Quantidade de CPUs usadas pelas tarefas. Se 1, os modelos são gerados em sequência, no
+                    próprio processo. Se None, usa a quantidade de CPUs da máquina (default: None)
+            memoria_max (int) --> Memória máxima, em bytes, estimada para as tarefas em execução simultânea. Se None, não há
+                    limite (default: None)
+            forcar (boolean) --> Indica se os modelos são gerados mesmo que as suas entradas não tenham mudado
+                    (default: False)
         Retorno: None
         '''
         # Verifica se consegue carregar no objeto de modelos o dicionário do corpus
@@ -628,17 +1097,39 @@ class Corpus:
             print('Não serão montadas as demais representações vetoriais do corpus')
             return
         # Monta os corpus e matrizes de similaridade nos tipos implementados
+        todos = not modelos
         if not modelos: modelos = self.modelos.tipos_modelos()
-        for modelo in tqdm(modelos):
+        for modelo in [modelo for modelo in modelos if modelo not in self.modelos]:
             # Verifica se o modelo já foi implementado
-            if modelo not in self.modelos:
-                print(f'O modelo "{modelo}" não foi implementado.')
-                continue
-            print(f'Gerando o modelo para tranformar o corpus "{self.nome}" no tipo "{modelo}"')
-            t0 = AGORA()
-            self.modelos.gerar_modelo(modelo=modelo)
-            TEMPO.formatar(AGORA() - t0)
-            print(f'Corpus no tipo "{modelo}" montado em {TEMPO}')
+            print(f'O modelo "{modelo}" não foi implementado.')
+        modelos = [modelo for modelo in modelos if modelo in self.modelos]
+        t0 = AGORA()
+        plano = self._plano_modelos(modelos, forcar=forcar)
+        with medir('vetorizar', corpus=self.nome):
+            resultados = _montar_agendador(self.projeto, plano, num_processos, memoria_max).executar()
+        self.modelos._versao += 1
+        TEMPO.formatar(AGORA() - t0)
+        gerados = [modelo for modelo in modelos if f'indexar_{modelo}' in resultados]
+        print(f'Modelos {gerados} do corpus "{self.nome}" montados em {TEMPO}')
+        # Registra o treinamento, que passa a ser a referência das atualizações incrementais
+        if todos and len(gerados) == len(modelos): self._registrar_treino()
+
+    def _abrir_publicacao(self):
+        '''
+        Aponta as pastas dos modelos e dos índices, o DB e o arquivo shelve das configurações para a última versão publicada
+        do corpus. Se nenhuma versão foi publicada, mantém os arquivos atuais do corpus.
+        Retorno: None
+        '''
+        publicacao = self._publicacoes.atual()
+        if publicacao is None:
+            print(f'O corpus "{self.nome}" não tem versão publicada. Serão consultados os seus arquivos atuais.')
+            return
+        pasta = self._publicacoes.pasta_versao(publicacao)
+        self._pastas['modelos'] = os.path.join(pasta, 'modelos')
+        self._pastas['indices'] = os.path.join(pasta, 'indices')
+        self._arqs['db'] = os.path.join(pasta, 'corpus.db')
+        self._arqs['shelve'] = os.path.join(pasta, 'objetos')
+        self._versao_publicada = publicacao['versao']
 
     def _agregar_tokens(self, tokens, id_atributo):
         '''
@@ -663,18 +1154,18 @@ class Corpus:
         '''
         return True
 
-    def _encerrar_incluir_documentos(self):
+    def _encerrar_incluir_documentos(self, construir=True):
         '''
         Encerra o método incluir_documentos_csv.
         Esse método foi criado para poder ser sobrescrito na subclasse CorpusDimensao.
+        Parâmetros:
+            construir (boolean) --> Indica se os modelos devem ser atualizados (default: True)
         Retorno: None
         '''
         # Obtém os dados do corpus
         self._obter_dados_corpus()
-        # Monta o dicionário
-        self.montar_dicionario()
-        # Cria as versões vetorizadas do corpus
-        self.vetorizar()
+        # Inclui as fichas novas nos modelos ou os treina novamente
+        if construir: self.atualizar_modelos()
 
     def _iniciar_corpus(self):
         '''
@@ -703,16 +1194,14 @@ class Corpus:
         # Define os nomes do arquivo com o DB do corpus e com o Shelve
         self._arqs['db'] = os.path.join(self._pastas['corpus'], f'{self._link_nome}.db')
         self._arqs['shelve'] = os.path.join(self._pastas['projeto'], 'objetos.db')
+        # Aponta os arquivos para a última versão publicada, se for o caso
+        self._publicacoes = Publicacoes(os.path.join(base, 'publicacoes', self._link_nome))
+        if self.publicado: self._abrir_publicacao()
         # Instancia a classe DAOCorpus e a inicia para criar as tabelas do banco, se for o caso
-        self._dao = DAOCorpus(self._arqs['db'])
-        self._dao.iniciar_dao()
-        # Verifica se já há dados de configurações do corpus
-        if os.path.isfile(f'{self._arqs["shelve"]}.dat'):
-            # Verifica se os dados do corpus estão no arquivo shelve
-            with shelve.open(self._arqs['shelve']) as db:
-                if self._shelf not in db: config = None
-                else: config = db[self._shelf]
-            if config: self._povoar_atributos(config)
+        self._dao = DAOCorpus(self._arqs['db'], somente_leitura=self.publicado)
+        if not self.somente_leitura: self._dao.iniciar_dao()
+        # Recupera as configurações anteriores do corpus, se houver
+        self._ler_configuracoes()
         # Compila os regex que serão usados no corpus
         self._regex['word'] = re.compile(r'(_|\b)word(_|\b)')
         self._regex['espaco'] = re.compile(r'\s+')
@@ -734,6 +1223,20 @@ class Corpus:
         '''
         return self._dao.consultar_db(sql, t)
 
+    def _ler_configuracoes(self):
+        '''
+        Recupera do arquivo shelve as configurações persistidas do corpus, se houver. Permite atualizar o objeto com as
+        configurações gravadas por outra instância do mesmo corpus.
+        Retorno: None
+        '''
+        # Verifica se já há dados de configurações do corpus
+        if not os.path.isfile(f'{self._arqs["shelve"]}.dat'): return
+        # Verifica se os dados do corpus estão no arquivo shelve
+        with abrir_shelve(self._arqs['shelve'], flag='r' if self.somente_leitura else 'c') as db:
+            if self._shelf not in db: config = None
+            else: config = db[self._shelf]
+        if config: self._povoar_atributos(config)
+
     def _montar_corpus(self, chunk, ind_tokens):
         '''
         Percorre as colunas do objeto zip, quebrando os valores de cada atributo e formando os tokens para fins de geração
@@ -781,12 +1284,36 @@ class Corpus:
                        self._tokens[token]['freq_token']) for token in self._tokens]
         # Regista na base do corpus as ocorrências
         self._dao.registrar_frequencias(ocorrencias)
+        contar('linhas')
+        contar('tokens', len(ocorrencias))
         # Verifica se há relacionamentos a registrar ==> PARA A SUBCLASSE Corpus_dimensao
         if self._update_relac: self._salvar_relacionamentos(ficha)
         # Incrementa o contador de documentos lidos e salva-o
         self._docs_lidos += 1
         self._salvar_configuracoes()
 
+    def _motivo_treino(self, forcar=False):
+        '''
+        Verifica se os modelos devem ser treinados novamente ou se as fichas novas podem ser incluídas de forma incremental.
+        Parâmetros:
+            forcar (boolean) --> Indica se os modelos devem ser treinados novamente em qualquer caso (default: False)
+        Retorno: tupla com o motivo para treinar novamente os modelos (ou None, se a atualização pode ser incremental) e as
+            métricas de "metricas_atualizacao" (tuple (str, dict))
+        '''
+        metricas = self.metricas_atualizacao()
+        motivo = None
+        if forcar: motivo = 'treinamento solicitado'
+        elif not self.atualizacao_incremental: motivo = 'a atualização incremental está desativada'
+        elif not metricas: motivo = 'não há registro de treinamento anterior'
+        elif metricas['fichas_alteradas']: motivo = f'{metricas["fichas_alteradas"]} fichas já existentes receberam novos tokens'
+        elif metricas['perc_fichas_novas'] > self.max_fichas_incrementais:
+            motivo = f'{metricas["perc_fichas_novas"]:.1%} de fichas novas desde o último treinamento'
+        elif metricas['perc_oov'] > self.max_oov:
+            motivo = f'{metricas["perc_oov"]:.1%} das ocorrências de tokens das fichas novas estão fora do dicionário'
+        elif self.max_dias_treino is not None and metricas['dias'] >= self.max_dias_treino:
+            motivo = f'o último treinamento foi há {metricas["dias"]} dias'
+        return motivo, metricas
+
     def _obter_dados_corpus(self):
         '''
         Povoa os dados do corpus após uma importação. É um método separado em razão do CorpusDimensao
@@ -795,7 +1322,8 @@ class Corpus:
         # Obtém os dados do corpus
         print(f'Obtendo os dados do corpus "{self.nome}"')
         t0 = AGORA()
-        self._povoar_atributos(self._dao.obter_dados_corpus(), zero=True)
+        with medir('dados_corpus', corpus=self.nome):
+            self._povoar_atributos(self._dao.obter_dados_corpus(), zero=True)
         TEMPO.formatar(AGORA() - t0)
         print(f'Obteve os dados do corpus em {TEMPO}')
 
@@ -825,6 +1353,36 @@ class Corpus:
         # Retorna as palavras pré-processadas tokenizadas com o seu atributo
         return [f'{atributo}_{word}' for word in words]
 
+    def _plano_modelos(self, modelos, prefixo='', dependencias=(), forcar=False):
+        '''
+        Monta as tarefas de treinamento e de indexação dos modelos do corpus, no formato usado por _montar_agendador.
+        Parâmetros:
+            modelos (list de str) --> Modelos a serem gerados
+            prefixo (str) --> Prefixo dos nomes das tarefas (default: '')
+            dependencias (list de str) --> Tarefas das quais todos os treinamentos dependem (default: tupla vazia)
+            forcar (boolean) --> Indica se os modelos são gerados mesmo que as suas entradas não tenham mudado
+                    (default: False)
+        Retorno: dicionário com as tarefas, tendo o nome da tarefa como chave
+        '''
+        plano = {}
+        parametros = self.modelos._modelos
+        # CPUs ocupadas no treinamento pelas threads do Doc2Vec e pelos processos do LdaMulticore
+        threads = {'doc2vec': parametros['doc2vec']['workers'] or max(1, mp.cpu_count() // 2)}
+        if parametros['lda']['backend'] == 'multicore':
+            threads['lda'] = parametros['lda']['workers'] or max(1, mp.cpu_count() - 1)
+        for modelo in modelos:
+            for etapa in ['treinar', 'indexar']:
+                if etapa == 'indexar': deps = [f'{prefixo}treinar_{modelo}']
+                elif modelo == 'lsi': deps = list(dependencias) + [f'{prefixo}treinar_tfidf']
+                else: deps = list(dependencias)
+                plano[f'{prefixo}{etapa}_{modelo}'] = dict(
+                    classe=type(self).__name__, corpus=self.nome, etapa=etapa, modelo=modelo, dependencias=deps
+                   ,memoria=self.modelos.estimar_memoria(modelo, etapa)
+                   ,threads=threads.get(modelo, 1)
+                   ,forcar=forcar
+                   ,descricao=f'{"treinamento" if etapa == "treinar" else "indexação"} do modelo "{modelo}" do corpus "{self.nome}"')
+        return plano
+
     def _povoar_atributos(self, values, zero=False):
         '''
         Povoa os atributos com os valores do dicionário passado. Esse é um método genérico para setar e persistir configurações.
@@ -839,6 +1397,33 @@ class Corpus:
             else: exec(f'self.{k} = {v}')
         self._salvar_configuracoes()
 
+    def _registrar_treino(self, incremental=False):
+        '''
+        Registra o estado do corpus em que os índices dos modelos foram montados, que marca o que é novo na próxima
+        atualização. Na atualização incremental, mantém a data e as marcas do último treinamento completo, usadas nas
+        métricas de deriva.
+        Parâmetros:
+            incremental (boolean) --> Indica se os índices foram atualizados de forma incremental (True) ou se os modelos
+                    foram treinados (False) (default: False)
+        Retorno: None
+        '''
+        id_corpus, id_detalhe = self._dao.obter_marcas()
+        if incremental and self._treino:
+            data = self._treino['data']
+            fichas_treino = self._treino.get('fichas_treino', self._treino['num_fichas'])
+            id_detalhe_treino = self._treino.get('id_detalhe_treino', self._treino['id_detalhe'])
+        else:
+            data = AGORA().strftime('%Y-%m-%d %H:%M:%S')
+            fichas_treino, id_detalhe_treino = self.num_fichas, id_detalhe
+        self._treino = dict(num_fichas=self.num_fichas
+                           ,id_corpus=id_corpus
+                           ,id_detalhe=id_detalhe
+                           ,data=data
+                           ,fichas_treino=fichas_treino
+                           ,id_detalhe_treino=id_detalhe_treino)
+        self._salvar_configuracoes()
+        if self.publicar_versoes: self.publicar()
+
     def _salvar_relacionamentos(self, ficha):
         '''
         Esse método é implementado em CorpusDimensao
@@ -847,9 +1432,10 @@ class Corpus:
 
     def _salvar_configuracoes(self):
         '''
-        Persiste os dados de configuração do corpus.
+        Persiste os dados de configuração do corpus. Não faz nada se o corpus foi aberto somente para leitura.
         Retorno: None
         '''
+        if self.somente_leitura: return
         config = dict(nome = self.nome
                      ,projeto = self.projeto
                      ,acentos = self.acentos
@@ -879,6 +1465,12 @@ class Corpus:
                      ,min_tokens_ficha = self.min_tokens_ficha
                      ,avg_tokens_ficha = self.avg_tokens_ficha
                      ,sdv_tokens_ficha = self.sdv_tokens_ficha
+                     ,atualizacao_incremental = self.atualizacao_incremental
+                     ,max_fichas_incrementais = self.max_fichas_incrementais
+                     ,max_oov = self.max_oov
+                     ,max_dias_treino = self.max_dias_treino
+                     ,publicar_versoes = self.publicar_versoes
+                     ,versoes_mantidas = self.versoes_mantidas
                      ,_atributo_ficha = self._atributo_ficha
                      ,_lendo_csv = self._lendo_csv
                      ,_arquivo_csv = self._arquivo_csv
@@ -888,10 +1480,65 @@ class Corpus:
                      ,_docs_lidos = self._docs_lidos
                      ,_id_origem = self._id_origem
                      ,_atributos = self._atributos
-                     ,_has_dict = self._has_dict)
-        with shelve.open(self._arqs['shelve']) as db:
+                     ,_has_dict = self._has_dict
+                     ,_treino = self._treino
+                     ,_assinatura_dicionario = self._assinatura_dicionario
+                     ,_assinatura_bow = self._assinatura_bow)
+        with abrir_shelve(self._arqs['shelve']) as db:
             db[self._shelf] = config
 
+    def _somar_assinatura_bow(self, id_ficha_ini):
+        '''
+        Soma à assinatura do corpus no formato BOW a assinatura das fichas incluídas nos índices de forma incremental, para
+        que a próxima geração dos modelos perceba que o corpus mudou.
+        Parâmetros:
+            id_ficha_ini (int) --> Id da primeira ficha incluída
+        Retorno: None
+        '''
+        if not self._assinatura_bow: return
+        novas = self._dao.obter_assinatura_bow(id_ficha_ini)
+        self._assinatura_bow = [anterior + nova for anterior, nova in zip(self._assinatura_bow, novas)]
+        self._salvar_configuracoes()
+
+    def _tokenizar_documento(self, atributos, ind_tokens):
+        '''
+        Tokeniza um documento avulso com as mesmas regras de _montar_corpus, sem registrar nada no DB.
+        Parâmetros:
+            atributos (dict str:str) --> Valores dos atributos do documento, tendo o nome do atributo como chave
+            ind_tokens (boolean) --> Indica se os valores já são tokens montados (True) ou se é preciso compor os tokens agrupando
+                                     os valores com os nomes dos atributos (False)
+        Retorno: uma tupla onde o primeiro elemento é a lista dos tokens dos atributos do corpus e o segundo é a lista dos
+            tokens genéricos de relacionamentos
+        '''
+        tokens_doc, tokens_relac = [], []
+        for atributo, values in atributos.items():
+            # Desconsidera a ficha e os atributos sem valor
+            if atributo == self._atributo_ficha or not values: continue
+            # Verifica se é um atributo word para realizar o pré-processamento diferenciado
+            if self._regex['word'].search(atributo):
+                if atributo in self._atributos: tokens_doc.extend(self._obter_token_word(values, atributo))
+                continue
+            # Verifica se é um atributo que precisa remover a acentuação
+            if atributo in self.acentos: values = g_utils.deaccent(values)
+            if ind_tokens: tokens = values.split()
+            else: tokens = [f'{atributo}_{value}' for value in values.split()]
+            if atributo in self._atributos: tokens_doc.extend(tokens)
+            # Monta os tokens genéricos de relacionamentos
+            for tag in self.tags_relac:
+                if not self._regex[f'relac_{tag}'].search(atributo): continue
+                tokens_relac.extend([value.replace(atributo, tag) for value in tokens])
+        return tokens_doc, tokens_relac
+
+    def _tokens_documento(self, atributos, ind_tokens):
+        '''
+        Obtém os tokens de um documento avulso que são representados no corpus. No Corpus, os tokens genéricos de
+        relacionamentos fazem parte do documento.
+        Esse método foi criado para poder ser sobrescrito na subclasse CorpusDimensao.
+        Retorno: a lista de tokens do documento (list de string)
+        '''
+        tokens, tokens_relac = self._tokenizar_documento(atributos, ind_tokens)
+        return tokens + tokens_relac
+
     def _tratar_relacionamentos(self, values, atributo, new_atributo):
         '''
         Realiza o tratamento correspondente aos relacionamentos substituindo o atributo original pelo tipo de pessoa
@@ -920,6 +1567,9 @@ class CorpusDimensao(Corpus):
                 espaços entre as palavras
         nome (string) --> Nome do corpus. Não é sensitive case, ignora acentos e quantidade de espaços entre as palavras
                 (default: "Geral")
+        somente_leitura (boolean) --> Indica se o corpus é aberto apenas para consultas, sem persistir as configurações
+                (default: False)
+        publicado (boolean) --> Indica se o corpus é aberto a partir da última versão publicada (ver Corpus) (default: False)
     Atributos:
         nome (string) --> Nome da dimensão
         projeto (string) --> Nome do projeto ao qual pertence o corpus
@@ -941,23 +1591,24 @@ class CorpusDimensao(Corpus):
         num_fichas (int) --> Total de fichas do corpus
         num_words (int) --> Total de palavras processadas no corpus
     '''
-    def __init__(self, projeto, nome):
-        super().__init__(projeto, nome)
+    def __init__(self, projeto, nome, somente_leitura=False, publicado=False):
+        super().__init__(projeto, nome, somente_leitura=somente_leitura, publicado=publicado)
         # Instancia o CorpusDimensão "relacionamentos" se o corpus não for o de relacionamentos
         if self._link_nome == 'relacionamentos': self._dim_relac = None
-        else: self._dim_relac = CorpusDimensao(nome='Relacionamentos', projeto=self.projeto)
+        else: self._dim_relac = CorpusDimensao(nome='Relacionamentos', projeto=self.projeto, somente_leitura=somente_leitura
+                                               ,publicado=publicado)
 
-    def _encerrar_incluir_documentos(self):
+    def _encerrar_incluir_documentos(self, construir=True):
         '''
         Encerra o método incluir_documentos_csv.
+        Parâmetros:
+            construir (boolean) --> Indica se os modelos devem ser atualizados (default: True)
         Retorno: None
         '''
         # Obtém os dados do corpus
         self._obter_dados_corpus()
-        # Monta o dicionário
-        self.montar_dicionario()
-        # Cria as versões vetorizadas do corpus
-        self.vetorizar()
+        # Inclui as fichas novas nos modelos ou os treina novamente
+        if construir: self.atualizar_modelos()
         # Verifica se tem que atualizar os relacionamentos
         if self._dim_relac._lendo_csv:
             # Atualiza na dimensão relacionamentos o número de documentos lidos
@@ -966,10 +1617,8 @@ class CorpusDimensao(Corpus):
             self._dim_relac._salvar_configuracoes()
             # Obtém os dados do corpus da dimensão relacionamentos
             self._dim_relac._obter_dados_corpus()
-            # Monta o dicionário da dimensão relacionamentos
-            self._dim_relac.montar_dicionario()
-            # Cria as versões vetorizadas do corpus
-            self._dim_relac.vetorizar()
+            # Inclui as fichas novas nos modelos da dimensão relacionamentos ou os treina novamente
+            if construir: self._dim_relac.atualizar_modelos()
 
     def _salvar_relacionamentos(self, ficha):
         '''
@@ -995,6 +1644,16 @@ class CorpusDimensao(Corpus):
         self._dim_relac._tokens = {}
         self._update_relac = False
 
+    def _tokens_documento(self, atributos, ind_tokens):
+        '''
+        Obtém os tokens de um documento avulso que são representados no corpus da dimensão. Os tokens genéricos de
+        relacionamentos fazem parte apenas do documento da dimensão "Relacionamentos".
+        Retorno: a lista de tokens do documento (list de string)
+        '''
+        tokens, tokens_relac = self._tokenizar_documento(atributos, ind_tokens)
+        if self._link_nome == 'relacionamentos': return tokens_relac
+        return tokens
+
     def _tratar_relacionamentos(self, values, atributo, new_atributo):
         '''
         Realiza o tratamento correspondente aos relacionamentos substituindo o atributo original pelo tipo de pessoa
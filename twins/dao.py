@@ -1,15 +1,48 @@
 # Imports Python
 import datetime as dt
 import math
+import re
 # Imports Twins
-from twins.utils import ConexaoDB
+from twins.utils import ConexaoDB, PerfilSQL, TabelaFichas
 
 class DAOCorpus:
     '''
     Interface entre a aplicação e o banco de dados onde estão persistidos alguns atributos do objeto Corpus ou CorpusDimensao.
+    A conexão ao DB é mantida aberta entre as consultas, uma por thread (ver ConexaoDB).
+    Parâmetros:
+        arq_db (str) --> Endereço do arquivo do DB
+        pragmas (dict str:str) --> Pragmas do SQLite que substituem os defaults de ConexaoDB.PRAGMAS (default: None)
+        somente_leitura (boolean) --> Indica se o DB é aberto apenas para leitura (default: False)
     '''
-    def __init__(self, arq_db):
-        self._conn = ConexaoDB(arq_db)
+    # Tabelas usadas nas consultas de fichas semelhantes, copiadas nas versões publicadas do corpus
+    TABELAS_CONSULTA = {'fichas': 'id_ficha', 'atributos': None, 'tokens_dict': None, 'bow_corpus': 'id_ficha'}
+
+    def __init__(self, arq_db, pragmas=None, somente_leitura=False):
+        self._conn = ConexaoDB(arq_db, pragmas=pragmas, somente_leitura=somente_leitura)
+        self._fichas = None
+        self._mapa_tokens = None
+
+    def ajustar_perfil_sql(self, ativo=True, lento=0.1):
+        '''
+        Ativa ou desativa o perfil dos comandos SQL executados no DB do corpus (ver PerfilSQL). Ao ser ativado, o perfil
+        começa vazio.
+        Parâmetros:
+            ativo (boolean) --> Indica se os comandos SQL passam a ser registrados (default: True)
+            lento (float) --> Tempo, em segundos, a partir do qual o plano de execução do comando é capturado (default: 0.1)
+        Retorno: o perfil ativado (PerfilSQL) ou None se ele foi desativado
+        '''
+        self._conn.perfil = PerfilSQL(lento=lento) if ativo else None
+        return self._conn.perfil
+
+    def ajustar_pragmas(self, **pragmas):
+        '''
+        Altera os pragmas do SQLite usados nas conexões ao DB do corpus (ver ConexaoDB.PRAGMAS), como cache_size ou
+        mmap_size. As conexões abertas são reabertas com os novos pragmas no próximo uso.
+        Parâmetros:
+            O nome do pragma e o valor que se quer atribuir a ele. Um valor None volta a usar o default
+        Retorno: None
+        '''
+        self._conn.ajustar_pragmas(**pragmas)
 
     def consultar_db(self, sql, t=None):
         '''
@@ -25,6 +58,66 @@ class DAOCorpus:
             values = c.fetchall()
         return values
 
+    def exportar_consultas(self, arq_db, num_fichas):
+        '''
+        Grava em um novo DB uma cópia das tabelas usadas nas consultas (ver TABELAS_CONSULTA), limitada às fichas já
+        incluídas nos índices dos modelos. As tabelas são copiadas em uma única transação, o que garante uma cópia
+        consistente mesmo que outra conexão esteja gravando no DB do corpus.
+        Parâmetros:
+            arq_db (str) --> Endereço do novo DB, que não deve existir
+            num_fichas (int) --> Quantidade de fichas incluídas nos índices
+        Retorno: None
+        '''
+        tabelas = ', '.join('?' * len(self.TABELAS_CONSULTA))
+        anexado = False
+        try:
+            with self._conn as c:
+                c.execute(f'SELECT type, sql FROM sqlite_master WHERE tbl_name IN ({tabelas}) AND sql IS NOT NULL'
+                         ,tuple(self.TABELAS_CONSULTA))
+                comandos = c.fetchall()
+                c.execute('ATTACH DATABASE ? AS exportacao', (arq_db, ))
+                anexado = True
+                # Cria as tabelas, copia os registros e só então cria os índices, o que é mais rápido do que copiar com eles
+                for tipo, sql in comandos:
+                    if tipo == 'table': c.execute(re.sub(r'^CREATE TABLE\s+', 'CREATE TABLE exportacao.', sql))
+                for tabela, coluna in self.TABELAS_CONSULTA.items():
+                    if coluna:
+                        c.execute(f'INSERT INTO exportacao.{tabela} SELECT * FROM main.{tabela} WHERE {coluna}<?', (num_fichas, ))
+                    else: c.execute(f'INSERT INTO exportacao.{tabela} SELECT * FROM main.{tabela}')
+                for tipo, sql in comandos:
+                    if tipo == 'index': c.execute(re.sub(r'^CREATE INDEX\s+', 'CREATE INDEX exportacao.', sql))
+        finally:
+            # O DB exportado não pode continuar anexado à conexão do corpus, que é mantida aberta, mesmo após uma falha
+            if anexado:
+                with self._conn as c:
+                    c.execute('DETACH DATABASE exportacao')
+
+    def incluir_bow_fichas(self, id_ficha_ini, id_corpus):
+        '''
+        Inclui na tabela do corpus no formato BOW as fichas novas, usando o dicionário já montado, sem refazê-lo. Os tokens
+        que não constam do dicionário são descartados. Pode ser executado novamente para as mesmas fichas.
+        Parâmetros:
+            id_ficha_ini (int) --> Id da primeira ficha nova. As fichas novas têm ids sequenciais a partir dele
+            id_corpus (int) --> Maior id da tabela corpus antes da inclusão das fichas novas
+        Retorno: None
+        '''
+        with self._conn as c:
+            # Descarta uma inclusão anterior das mesmas fichas que tenha sido interrompida
+            c.execute('DELETE FROM bow_corpus WHERE id_ficha >= ?', (id_ficha_ini, ))
+            t = (id_corpus, id_ficha_ini)
+            c.execute('''INSERT INTO bow_corpus
+                         SELECT tab2.id_ficha
+                               ,tab1.id_token_dict
+                               ,tab3.ficha
+                               ,tab1.token
+                               ,tab2.freq_token
+                         FROM corpus AS tab2
+                         INNER JOIN tokens_dict AS tab1
+                            ON tab1.id_token=tab2.id_token
+                         LEFT JOIN fichas AS tab3
+                            ON tab2.id_ficha=tab3.id_ficha
+                         WHERE tab2.id_corpus > ? AND tab2.id_ficha >= ?''', t)
+
     def iniciar_dao(self):
         '''
         Verifica se a base existe, criando-a se não existe.
@@ -108,6 +201,8 @@ class DAOCorpus:
         Retorno: um dicionário com as estatísticas do dicionário de palavras antes e depois da filtragem
         '''
         est = {}
+        # Descarta o mapa de tokens em memória, pois os ids do dicionário serão refeitos
+        self._mapa_tokens = None
         with self._conn as c:
             # Obtém o número de fichas do corpus
             c.execute('SELECT count(*) FROM fichas')
@@ -211,8 +306,40 @@ class DAOCorpus:
             value = c.fetchone()
             if not value[0]: est['sdv_tokens_ficha'] = None
             else: est['sdv_tokens_ficha'] = math.sqrt(value[0])
+        # Obtém as assinaturas do dicionário e do corpus no formato BOW
+        est['_assinatura_dicionario'] = self.obter_assinatura_dicionario()
+        est['_assinatura_bow'] = self.obter_assinatura_bow()
         return est
 
+    def obter_assinatura_bow(self, id_ficha_ini=0):
+        '''
+        Calcula a assinatura do conteúdo da tabela do corpus no formato BOW: a quantidade de registros e a soma de um hash de
+        cada registro. Como a soma não depende da ordem dos registros, a assinatura das fichas novas pode ser somada à
+        assinatura anterior.
+        Parâmetros:
+            id_ficha_ini (int) --> Id da primeira ficha considerada (default: 0)
+        Retorno: lista com a quantidade de registros e a soma dos hashes (list [int, int])
+        '''
+        with self._conn as c:
+            t = (id_ficha_ini, )
+            c.execute('''SELECT count(*)
+                               ,sum(((id_ficha * 1000003 + id_token_dict) * 8191 + freq_token) % 2147483647)
+                         FROM bow_corpus
+                         WHERE id_ficha >= ?''', t)
+            quantidade, soma = c.fetchone()
+        return [quantidade, soma or 0]
+
+    def obter_assinatura_dicionario(self):
+        '''
+        Calcula a assinatura do dicionário do corpus: a quantidade de tokens e a soma de um hash do token e do seu id no
+        dicionário.
+        Retorno: lista com a quantidade de tokens e a soma dos hashes (list [int, int])
+        '''
+        with self._conn as c:
+            c.execute('SELECT count(*), sum((id_token_dict * 1000003 + id_token) % 2147483647) FROM tokens_dict')
+            quantidade, soma = c.fetchone()
+        return [quantidade, soma or 0]
+
     def obter_atributos(self):
         '''
         Retorna a lista de atributos que existem no corpus.
@@ -256,24 +383,20 @@ class DAOCorpus:
             
     def obter_bow_tokens(self, tokens):
         '''
-        Obtém o documento no formato BOW para o string de tokens informados. Se nenhum dos tokens da string estiver no dicionário,
-        retorna uma lista vazia.
+        Obtém o documento no formato BOW para os tokens informados. Se nenhum dos tokens estiver no dicionário, retorna uma
+        lista vazia.
+        Parâmetros:
+            tokens (string ou list de string) --> Tokens do documento, em uma string separados por espaço ou em uma lista
         Retorno: uma lista de tuplas ou uma lista vazia
         '''
+        if isinstance(tokens, str): tokens = tokens.split()
         # Monta um dicionário com os tokens e sua frequência
         tokens_freq = {}
-        for token in tokens.split():
+        for token in tokens:
             tokens_freq[token] = tokens_freq.get(token, 0) + 1
-        # Monta o BOW do documento consultando o id de cada token
-        bow = []
-        with self._conn as c:
-            for token in tokens_freq:
-                t = (token, )
-                c.execute('SELECT id_token_dict FROM tokens_dict WHERE token=?', t)
-                values = c.fetchone()
-                if not values: continue
-                bow.append((values[0], tokens_freq[token]))
-        return bow
+        # Monta o BOW do documento com o id de cada token no dicionário
+        mapa = self._obter_mapa_tokens()
+        return sorted((mapa[token], freq) for token, freq in tokens_freq.items() if token in mapa)
 
     def obter_dados_corpus(self):
         '''
@@ -299,17 +422,19 @@ class DAOCorpus:
         Retorna a lista de fichas que constam do corpus na ordem em que elas aparecem do DB.
         Retorno: lista de fichas (lista de string)
         '''
-        fichas = []
-        with self._conn as c:
-            c.execute('SELECT count(*) FROM fichas')
-            num_fichas = c.fetchone()[0]
-            for id_ficha in range(num_fichas):
-                t = (id_ficha, )
-                c.execute('SELECT ficha FROM fichas WHERE id_ficha=?', t)
-                values = c.fetchone()
-                if not values: fichas.append(None)
-                else: fichas.append(values[0])
-        return fichas
+        return self._tabela_fichas().todas()
+
+    def obter_fichas_ids(self, ids_fichas):
+        '''
+        Retorna os nomes das fichas associadas aos ids passados no argumento.
+        Parâmetros:
+            ids_fichas (iterável de int) --> Ids das fichas que se deseja obter
+        Retorno: lista com os nomes das fichas (list de string), com None para os ids que não foram encontrados no corpus
+        '''
+        ids_fichas = list(ids_fichas)
+        tabela = self._tabela_fichas()
+        if ids_fichas and max(ids_fichas) >= len(tabela): tabela = self._tabela_fichas(atualizar=True)
+        return tabela.nomes(ids_fichas)
 
     def obter_ficha_id(self, id_ficha):
         '''
@@ -318,12 +443,9 @@ class DAOCorpus:
             id_ficha (int) --> Número do id da ficha que se deseja obter
         Retorno: o nome da ficha que corresponde ao id passado (string) ou None se não encontrar o id no corpus
         '''
-        with self._conn as c:
-            t = (id_ficha, )
-            c.execute('SELECT ficha FROM fichas WHERE id_ficha=?', t)
-            value = c.fetchone()
-            if not value: return None
-            else: return value[0]
+        tabela = self._tabela_fichas()
+        if id_ficha >= len(tabela): tabela = self._tabela_fichas(atualizar=True)
+        return tabela.nome(id_ficha)
 
     def obter_id_ficha(self, ficha):
         '''
@@ -333,12 +455,57 @@ class DAOCorpus:
             ficha (string) --> A ficha cujo id se deseja obter
         Retorno: o id da ficha passada (int)
         '''
+        tabela = self._tabela_fichas()
+        if ficha not in tabela: tabela = self._tabela_fichas(atualizar=True)
+        return tabela.id(ficha)
+
+    def obter_ids_fichas(self, fichas):
+        '''
+        Retorna os índices dos documentos aos quais se referem as fichas passadas. A tabela das fichas é atualizada no máximo
+        uma vez, se alguma ficha não estiver presente nela.
+        Parâmetros:
+            fichas (iterável de string) --> Fichas cujos ids se deseja obter
+        Retorno: lista com os ids das fichas (list de int), com None para as fichas que não constam do corpus
+        '''
+        fichas = list(fichas)
+        tabela = self._tabela_fichas()
+        if any(ficha not in tabela for ficha in fichas): tabela = self._tabela_fichas(atualizar=True)
+        return [tabela.id(ficha) for ficha in fichas]
+
+    def obter_marcas(self):
+        '''
+        Obtém os maiores ids das tabelas corpus e detalhes, que marcam o ponto a partir do qual os registros seguintes são
+        considerados novos.
+        Retorno: tupla com o maior id_corpus e o maior id_detalhe (tuple (int, int))
+        '''
         with self._conn as c:
-            t = (ficha, )
-            c.execute('SELECT id_ficha FROM fichas WHERE ficha=?', t)
-            value = c.fetchone()
-            if not value: return None
-            else: return value[0]
+            c.execute('SELECT max(id_corpus) FROM corpus')
+            id_corpus = c.fetchone()[0] or 0
+            c.execute('SELECT max(id_detalhe) FROM detalhes')
+            id_detalhe = c.fetchone()[0] or 0
+        return id_corpus, id_detalhe
+
+    def obter_metricas_novos(self, id_ficha_ini, id_detalhe):
+        '''
+        Obtém as métricas dos registros incluídos após a marca informada: a quantidade de fichas antigas que receberam novos
+        tokens e a quantidade de ocorrências de tokens das fichas novas, no total e fora do dicionário.
+        Parâmetros:
+            id_ficha_ini (int) --> Id da primeira ficha nova
+            id_detalhe (int) --> Maior id da tabela detalhes na marca anterior
+        Retorno: tupla com a quantidade de fichas alteradas, o total de ocorrências das fichas novas e as ocorrências das
+            fichas novas fora do dicionário (tuple (int, int, int))
+        '''
+        with self._conn as c:
+            t = (id_ficha_ini, id_ficha_ini, id_ficha_ini, id_detalhe)
+            c.execute('''SELECT count(DISTINCT CASE WHEN tab1.id_ficha < ? THEN tab1.id_ficha END)
+                               ,sum(CASE WHEN tab1.id_ficha >= ? THEN tab1.freq_token ELSE 0 END)
+                               ,sum(CASE WHEN tab1.id_ficha >= ? AND tab2.id_token IS NULL THEN tab1.freq_token ELSE 0 END)
+                         FROM detalhes AS tab1
+                         LEFT JOIN tokens_dict AS tab2
+                            ON tab1.id_token=tab2.id_token
+                         WHERE tab1.id_detalhe > ?''', t)
+            alteradas, ocorrencias, fora = c.fetchone()
+        return alteradas or 0, ocorrencias or 0, fora or 0
 
     def obter_num_fichas_corpus(self):
         '''
@@ -388,18 +555,15 @@ class DAOCorpus:
             ficha (String) --> ficha cujo id se deseja obter
         Retorno: o id da ficha (Int)
         '''
+        # Verifica se a ficha já está registrada
+        num_id = self.obter_id_ficha(ficha)
+        if num_id is not None: return num_id
         with self._conn as c:
-            # Verifica se a ficha já está registrada
-            t = (ficha, )
-            c.execute('SELECT id_ficha FROM fichas WHERE ficha=?', t)
-            num_id = c.fetchone()
-            if num_id: num_id = num_id[0]
-            else:
-                # Obtém o próximo valor de índice e registra a nova ficha
-                c.execute('SELECT count(*) FROM fichas')
-                num_id = c.fetchone()[0]
-                t = (num_id, ficha)
-                c.execute('INSERT INTO fichas VALUES (?,?)', t)
+            # Obtém o próximo valor de índice e registra a nova ficha
+            num_id = len(self._fichas)
+            t = (num_id, ficha)
+            c.execute('INSERT INTO fichas VALUES (?,?)', t)
+        self._fichas.incluir(ficha)
         return num_id
 
     def registrar_frequencias(self, lst_values):
@@ -499,3 +663,44 @@ class DAOCorpus:
                 c.execute(sql_select, t)
                 num_id = c.fetchone()[0]
         return num_id
+
+    def relatorio_sql(self, top=10, ordem='tempo_total'):
+        '''
+        Mostra os comandos SQL mais custosos registrados no perfil do DB do corpus (ver PerfilSQL.relatorio).
+        Parâmetros:
+            top (int) --> Quantidade de modelos de comando mostrados. Se None, mostra todos (default: 10)
+            ordem (str) --> Coluna usada para ordenar os comandos (default: 'tempo_total')
+        Retorno: Pandas DataFrame com as estatísticas dos comandos ou None se o perfil não estiver ativo
+        '''
+        if self._conn.perfil is None:
+            print('O perfil dos comandos SQL não está ativo. Use o método "ajustar_perfil_sql" para ativá-lo.')
+            return None
+        return self._conn.perfil.relatorio(top=top, ordem=ordem)
+
+    def _tabela_fichas(self, atualizar=False):
+        '''
+        Retorna a tabela em memória das fichas do corpus, carregando-a na primeira chamada. Se atualizar for True, inclui
+        na tabela as fichas registradas no DB após a última carga, o que cobre as fichas incluídas por outra instância.
+        Parâmetros:
+            atualizar (boolean) --> Indica se deve buscar no DB as fichas ainda não carregadas (default: False)
+        Retorno: a tabela das fichas (TabelaFichas)
+        '''
+        if self._fichas is not None and not atualizar: return self._fichas
+        if self._fichas is None: self._fichas = TabelaFichas()
+        with self._conn as c:
+            t = (len(self._fichas), )
+            c.execute('SELECT ficha FROM fichas WHERE id_ficha>=? ORDER BY id_ficha', t)
+            for (ficha, ) in c.fetchall(): self._fichas.incluir(ficha)
+        return self._fichas
+
+    def _obter_mapa_tokens(self):
+        '''
+        Retorna o mapa em memória dos tokens do dicionário para os seus ids, carregando-o na primeira chamada. O mapa é
+        descartado quando o dicionário é remontado.
+        Retorno: dicionário python onde a chave é o token (string) e o valor é o id do token no dicionário (int)
+        '''
+        if self._mapa_tokens is None:
+            with self._conn as c:
+                c.execute('SELECT token, id_token_dict FROM tokens_dict')
+                self._mapa_tokens = dict(c.fetchall())
+        return self._mapa_tokens
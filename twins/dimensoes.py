@@ -1,19 +1,23 @@
 # Imports Python
 import os
 import json
-import shelve
 # Imports Twins
 from twins.corpus import CorpusDimensao
-from twins.utils import obter_link_name
+from twins.utils import abrir_shelve, obter_link_name
 
 class Dimensoes:
     '''
     Iterável de objetos CorpusDimensoes.
+    Parâmetros:
+        projeto (string) --> Nome do projeto
+        publicado (boolean) --> Indica se as dimensões são abertas somente para leitura a partir das suas últimas versões
+                publicadas, sem persistir as configurações (ver Corpus) (default: False)
     '''
-    def __init__(self, projeto):
+    def __init__(self, projeto, publicado=False):
         self._dimensoes = {}
         self._dados = {}
         self._projeto = projeto
+        self._publicado = publicado
         self._shelve = os.path.join(f'./projetos/{obter_link_name(self._projeto)}', 'objetos.db')
         # Iniciar dimensoes
         self._iniciar_dimensoes()
@@ -58,7 +62,7 @@ class Dimensoes:
         if link_name in self._dados:
             print(f'Essa dimensão já foi incluída sob o nome "{self._dados[link_name]["nome"]}".')
             return
-        self._dimensoes[link_name] = CorpusDimensao(nome=nome, projeto=self._projeto)
+        self._dimensoes[link_name] = CorpusDimensao(nome=nome, projeto=self._projeto, publicado=self._publicado)
         self._dados[link_name] = {'nome': nome, 'peso': 1.0}
         self._salvar_dimensoes()
 
@@ -83,7 +87,7 @@ class Dimensoes:
         # Verifica se há configurações anteriores para serem recuperadas
         if not os.path.isfile(f'{self._shelve}.dat'): return
         # Verifica se há dados sobre dimensoes no arquivo shelve
-        with shelve.open(self._shelve) as db:
+        with abrir_shelve(self._shelve, flag='r' if self._publicado else 'c') as db:
             if 'dimensoes' not in db: return
             dados = db['dimensoes']
         # Recupera as configurações anteriores de dimensoes
@@ -97,8 +101,19 @@ class Dimensoes:
 
     def _salvar_dimensoes(self):
         '''
-        Persiste os dados do objeto para recuperação futura.
+        Persiste os dados do objeto para recuperação futura. Não faz nada se as dimensões foram abertas a partir das
+        versões publicadas.
         Retorno: None
         '''
-        with shelve.open(self._shelve) as db:
+        if self._publicado: return
+        with abrir_shelve(self._shelve) as db:
             db['dimensoes'] = self._dados
+
+    def _substituir(self, dimensao):
+        '''
+        Substitui o objeto de uma dimensão já incluída, como na abertura de uma nova versão publicada.
+        Parâmetros:
+            dimensao (CorpusDimensao) --> Novo objeto da dimensão
+        Retorno: None
+        '''
+        self._dimensoes[dimensao._link_nome] = dimensao
@@ -0,0 +1,840 @@
+# Imports Python
+import os
+import json
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+# Imports Gensim
+from gensim import matutils, utils
+from gensim.similarities.docsim import Similarity
+
+class IndiceInvertido:
+    '''
+    Índice invertido (token --> fichas) para as representações esparsas do corpus ("tfidf" e "tfidf_pivot"). Os pesos
+    de cada ficha são normalizados (norma L2) na montagem do índice, de modo que o produto interno entre a consulta e
+    as fichas é a similaridade de cosseno, a mesma calculada pela matriz de similaridade do Gensim. Na consulta, apenas
+    as fichas que têm ao menos um token em comum com a consulta acumulam pontuação.
+    Parâmetros:
+        num_features (int) --> Dimensionalidade dos vetores, isto é, o número de tokens do dicionário
+    Atributos:
+        num_features (int) --> Dimensionalidade dos vetores, isto é, o número de tokens do dicionário
+        num_fichas (int) --> Quantidade de fichas indexadas
+    '''
+    def __init__(self, num_features):
+        self.num_features = num_features
+        self.num_fichas = 0
+        # Representação ficha --> tokens (formato CSR) com os pesos normalizados
+        self._fichas_ptr = np.zeros(1, dtype=np.int64)
+        self._fichas_tokens = np.zeros(0, dtype=np.int32)
+        self._fichas_pesos = np.zeros(0, dtype=np.float32)
+        # Listas de postings token --> fichas (formato CSC) e o maior peso de cada token
+        self._tokens_ptr = np.zeros(num_features + 1, dtype=np.int64)
+        self._tokens_fichas = np.zeros(0, dtype=np.int32)
+        self._tokens_pesos = np.zeros(0, dtype=np.float32)
+        self._max_pesos = np.zeros(num_features, dtype=np.float32)
+        # Vetores adicionados que ainda não foram consolidados nas listas de postings
+        self._pendentes = []
+
+    def __len__(self):
+        return self.num_fichas
+
+    def adicionar(self, vetor):
+        '''
+        Inclui no índice o vetor de uma ficha. O id da ficha é a ordem em que o vetor foi adicionado. As listas de postings
+        só são atualizadas na chamada de "consolidar".
+        Parâmetros:
+            vetor (list de tuple (int, float)) --> Vetor esparso da ficha no formato do Gensim
+        Retorno: None
+        '''
+        tokens, pesos = self._normalizar(vetor)
+        self._pendentes.append((tokens, pesos))
+        self.num_fichas += 1
+
+    def consolidar(self):
+        '''
+        Incorpora os vetores adicionados à representação das fichas e remonta as listas de postings.
+        Retorno: None
+        '''
+        if self._pendentes:
+            tamanhos = np.array([len(tokens) for tokens, _ in self._pendentes], dtype=np.int64)
+            ptr = self._fichas_ptr[-1] + np.cumsum(tamanhos)
+            self._fichas_ptr = np.concatenate([self._fichas_ptr, ptr])
+            self._fichas_tokens = np.concatenate([self._fichas_tokens] + [tokens for tokens, _ in self._pendentes])
+            self._fichas_pesos = np.concatenate([self._fichas_pesos] + [pesos for _, pesos in self._pendentes])
+            self._pendentes = []
+        # Transpõe a matriz ficha --> token para obter as listas de postings ordenadas pelo id da ficha
+        fichas = np.repeat(np.arange(self.num_fichas, dtype=np.int32), np.diff(self._fichas_ptr))
+        ordem = np.argsort(self._fichas_tokens, kind='stable')
+        self._tokens_fichas = fichas[ordem]
+        self._tokens_pesos = self._fichas_pesos[ordem]
+        contagem = np.bincount(self._fichas_tokens, minlength=self.num_features)
+        self._tokens_ptr = np.concatenate([[0], np.cumsum(contagem)]).astype(np.int64)
+        # Obtém o maior peso de cada token, usado como limite superior na busca das melhores fichas
+        self._max_pesos = np.zeros(self.num_features, dtype=np.float32)
+        if self._tokens_pesos.size:
+            np.maximum.at(self._max_pesos, self._fichas_tokens[ordem], self._tokens_pesos)
+
+    def melhores(self, vetor, k, excluir=None):
+        '''
+        Obtém as k fichas mais semelhantes ao vetor informado com terminação antecipada no estilo MaxScore. Os tokens da
+        consulta são percorridos na ordem decrescente da sua contribuição máxima e, quando a k-ésima maior pontuação parcial
+        supera a soma das contribuições máximas dos tokens restantes, nenhuma ficha nova pode entrar no resultado e as listas
+        restantes passam a atualizar apenas as fichas já candidatas.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou tuple (ndarray, ndarray)) --> Vetor esparso da consulta
+            k (int) --> Quantidade de fichas a serem retornadas
+            excluir (int) --> Id de uma ficha a ser desconsiderada no resultado, normalmente a própria consulta (default: None)
+        Retorno: uma tupla com os ids das fichas (ndarray de int) e as respectivas similaridades (ndarray de float) em ordem
+            decrescente de similaridade
+        '''
+        if k <= 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        tokens, pesos = self._normalizar(vetor)
+        tokens, pesos = self._filtrar_tokens(tokens, pesos)
+        limites = pesos * self._max_pesos[tokens]
+        ordem = np.argsort(-limites, kind='stable')
+        tokens, pesos, limites = tokens[ordem], pesos[ordem], limites[ordem]
+        # Soma das contribuições máximas dos tokens a partir de cada posição
+        restantes = np.concatenate([np.cumsum(limites[::-1])[::-1], [0]])
+        acumulado = np.zeros(self.num_fichas, dtype=np.float32)
+        candidato = np.zeros(self.num_fichas, dtype=bool)
+        essencial = True
+        for i, (token, peso) in enumerate(zip(tokens, pesos)):
+            ini, fim = self._tokens_ptr[token], self._tokens_ptr[token+1]
+            ids = self._tokens_fichas[ini:fim]
+            contribuicoes = peso * self._tokens_pesos[ini:fim]
+            if not essencial:
+                # Atualiza apenas as fichas que já são candidatas
+                mascara = candidato[ids]
+                ids, contribuicoes = ids[mascara], contribuicoes[mascara]
+            acumulado[ids] += contribuicoes
+            candidato[ids] = True
+            if excluir is not None: candidato[excluir] = False
+            # Verifica se os tokens restantes ainda podem colocar uma ficha nova entre as k melhores
+            if essencial:
+                parciais = acumulado[candidato]
+                if parciais.size >= k and np.partition(parciais, -k)[-k] >= restantes[i+1]: essencial = False
+        ids = np.flatnonzero(candidato)
+        if ids.size > k: ids = ids[np.argpartition(-acumulado[ids], k-1)[:k]]
+        ids = ids[np.argsort(-acumulado[ids], kind='stable')]
+        return ids, acumulado[ids]
+
+    def similaridades(self, vetor):
+        '''
+        Calcula a similaridade do vetor informado com todas as fichas do índice, acumulando pontuação apenas nas fichas que
+        constam das listas de postings dos tokens da consulta.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou tuple (ndarray, ndarray)) --> Vetor esparso da consulta
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float)
+        '''
+        tokens, pesos = self._normalizar(vetor)
+        tokens, pesos = self._filtrar_tokens(tokens, pesos)
+        if not tokens.size: return np.zeros(self.num_fichas, dtype=np.float32)
+        inicios, fins = self._tokens_ptr[tokens], self._tokens_ptr[tokens+1]
+        ids = np.concatenate([self._tokens_fichas[ini:fim] for ini, fim in zip(inicios, fins)])
+        contribuicoes = np.concatenate([peso * self._tokens_pesos[ini:fim] for peso, ini, fim in zip(pesos, inicios, fins)])
+        return np.bincount(ids, weights=contribuicoes, minlength=self.num_fichas).astype(np.float32)
+
+    def similaridades_ficha(self, id_ficha):
+        '''
+        Calcula a similaridade de uma ficha do índice com todas as demais fichas.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha que servirá de consulta
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float)
+        '''
+        return self.similaridades(self.vetor(id_ficha))
+
+    def similaridades_ids(self, vetor, ids):
+        '''
+        Calcula a similaridade do vetor informado apenas com as fichas indicadas, a partir dos vetores das fichas.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou tuple (ndarray, ndarray)) --> Vetor esparso da consulta
+            ids (iterável de int) --> Ids das fichas
+        Retorno: vetor com a similaridade de cada ficha, na ordem dos ids (ndarray de float)
+        '''
+        tokens, pesos = self._normalizar(vetor)
+        consulta = np.zeros(self.num_features, dtype=np.float32)
+        mascara = (tokens >= 0) & (tokens < self.num_features)
+        consulta[tokens[mascara]] = pesos[mascara]
+        ids = np.asarray(ids, dtype=np.int64)
+        # Posições dos tokens de todas as fichas indicadas, concatenadas na ordem dos ids
+        inicios, tamanhos = self._fichas_ptr[ids], self._fichas_ptr[ids + 1] - self._fichas_ptr[ids]
+        deslocamentos = np.cumsum(tamanhos) - tamanhos
+        posicoes = np.arange(tamanhos.sum()) + np.repeat(inicios - deslocamentos, tamanhos)
+        produtos = consulta[self._fichas_tokens[posicoes]] * self._fichas_pesos[posicoes]
+        return np.bincount(np.repeat(np.arange(len(ids)), tamanhos), weights=produtos, minlength=len(ids)).astype(np.float32)
+
+    def vetor(self, id_ficha):
+        '''
+        Retorna o vetor normalizado de uma ficha do índice.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha
+        Retorno: uma tupla com os ids dos tokens (ndarray de int) e os respectivos pesos (ndarray de float)
+        '''
+        ini, fim = self._fichas_ptr[id_ficha], self._fichas_ptr[id_ficha+1]
+        return self._fichas_tokens[ini:fim], self._fichas_pesos[ini:fim]
+
+    def salvar(self, arq):
+        '''
+        Persiste o índice no arquivo informado (formato npz do numpy).
+        Parâmetros:
+            arq (string) --> Endereço do arquivo onde será salvo o índice
+        Retorno: None
+        '''
+        self.consolidar()
+        with open(arq, 'wb') as f:
+            np.savez(f, num_features=self.num_features, num_fichas=self.num_fichas
+                    ,fichas_ptr=self._fichas_ptr, fichas_tokens=self._fichas_tokens, fichas_pesos=self._fichas_pesos
+                    ,tokens_ptr=self._tokens_ptr, tokens_fichas=self._tokens_fichas, tokens_pesos=self._tokens_pesos
+                    ,max_pesos=self._max_pesos)
+
+    @classmethod
+    def carregar(cls, arq):
+        '''
+        Recupera um índice salvo anteriormente.
+        Parâmetros:
+            arq (string) --> Endereço do arquivo onde está salvo o índice
+        Retorno: o índice recuperado (IndiceInvertido)
+        '''
+        with np.load(arq) as dados:
+            indice = cls(int(dados['num_features']))
+            indice.num_fichas = int(dados['num_fichas'])
+            indice._fichas_ptr = dados['fichas_ptr']
+            indice._fichas_tokens = dados['fichas_tokens']
+            indice._fichas_pesos = dados['fichas_pesos']
+            indice._tokens_ptr = dados['tokens_ptr']
+            indice._tokens_fichas = dados['tokens_fichas']
+            indice._tokens_pesos = dados['tokens_pesos']
+            indice._max_pesos = dados['max_pesos']
+        return indice
+
+    def _filtrar_tokens(self, tokens, pesos):
+        '''
+        Descarta os tokens da consulta que estão fora da dimensionalidade do índice ou que não têm postings.
+        '''
+        mascara = (tokens >= 0) & (tokens < self.num_features)
+        tokens, pesos = tokens[mascara], pesos[mascara]
+        mascara = self._tokens_ptr[tokens+1] > self._tokens_ptr[tokens]
+        return tokens[mascara], pesos[mascara]
+
+    def _normalizar(self, vetor):
+        '''
+        Converte um vetor esparso para arrays de tokens e pesos com norma L2 unitária.
+        '''
+        if isinstance(vetor, tuple):
+            tokens, pesos = np.asarray(vetor[0], dtype=np.int32), np.asarray(vetor[1], dtype=np.float32)
+        elif len(vetor):
+            tokens, pesos = zip(*vetor)
+            tokens, pesos = np.array(tokens, dtype=np.int32), np.array(pesos, dtype=np.float32)
+        else:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        norma = np.sqrt(np.dot(pesos, pesos))
+        if norma > 0: pesos = pesos / norma
+        return tokens, pesos
+
+
+class IndiceDenso:
+    '''
+    Índice de similaridade para as representações densas do corpus ("lsi", "lda" e "doc2vec") com armazenamento quantizado
+    dos vetores. Os vetores são normalizados (norma L2) e armazenados em float32, float16 ou int8 (quantização escalar
+    simétrica com uma escala por ficha). Opcionalmente, os vetores exatos em float32 são gravados em um arquivo à parte,
+    acessado por mapeamento de memória, para reordenar de forma exata as melhores fichas da consulta aproximada.
+    Parâmetros:
+        num_features (int) --> Dimensionalidade dos vetores
+        quantizacao (str) --> Tipo de armazenamento dos vetores: "float32", "float16" ou "int8" (default: "float16")
+        arq_exatos (str) --> Endereço do arquivo onde serão gravados os vetores exatos para a reordenação. Se None, não
+                grava os vetores exatos (default: None)
+    Atributos:
+        num_features (int) --> Dimensionalidade dos vetores
+        quantizacao (str) --> Tipo de armazenamento dos vetores
+        num_fichas (int) --> Quantidade de fichas indexadas
+    '''
+    TIPOS = ['float32', 'float16', 'int8']
+    TAMANHO_BLOCO = 65536
+
+    def __init__(self, num_features, quantizacao='float16', arq_exatos=None):
+        self.num_features = num_features
+        self.quantizacao = quantizacao
+        self.num_fichas = 0
+        self._matriz = np.zeros((0, num_features), dtype=quantizacao)
+        self._escalas = np.zeros(0, dtype=np.float32)
+        self._arq_exatos = arq_exatos
+        self._exatos = None
+        self._pendentes = []
+        self._blocos = []
+        # Os vetores exatos são gravados em um arquivo temporário, que só substitui o arquivo anterior ao salvar o índice,
+        # pois o arquivo anterior pode estar mapeado em memória por um índice em uso
+        self._arq_temporario = f'{arq_exatos}.tmp' if arq_exatos else None
+        if arq_exatos: open(self._arq_temporario, 'wb').close()
+
+    def __len__(self):
+        return self.num_fichas
+
+    def adicionar(self, vetor):
+        '''
+        Inclui no índice o vetor de uma ficha. O id da ficha é a ordem em que o vetor foi adicionado.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou ndarray) --> Vetor da ficha no formato esparso do Gensim ou denso
+        Retorno: None
+        '''
+        self._pendentes.append(self._normalizar(vetor))
+        self.num_fichas += 1
+        if len(self._pendentes) >= self.TAMANHO_BLOCO: self._quantizar()
+
+    def consolidar(self):
+        '''
+        Quantiza os vetores adicionados e os incorpora à matriz do índice, gravando os vetores exatos, se for o caso. Os
+        blocos quantizados durante a inclusão são reunidos à matriz de uma só vez.
+        Retorno: None
+        '''
+        self._quantizar()
+        if not self._blocos: return
+        self._matriz = np.concatenate([self._matriz] + [bloco for bloco, _ in self._blocos])
+        self._escalas = np.concatenate([self._escalas] + [escalas for _, escalas in self._blocos])
+        self._blocos = []
+
+    def blocos(self):
+        '''
+        Divide as fichas do índice em blocos contíguos para a varredura da matriz.
+        Retorno: lista de tuplas com a posição inicial e final de cada bloco (list de tuple (int, int))
+        '''
+        return [(ini, min(ini + self.TAMANHO_BLOCO, self.num_fichas)) for ini in range(0, self.num_fichas, self.TAMANHO_BLOCO)]
+
+    def consulta(self, vetor):
+        '''
+        Prepara o vetor da consulta, convertendo-o para um array denso normalizado.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou ndarray) --> Vetor da consulta
+        Retorno: o vetor da consulta normalizado (ndarray de float)
+        '''
+        return self._normalizar(vetor)
+
+    def reordenar(self, sims, consulta, rerank):
+        '''
+        Recalcula com os vetores exatos a similaridade das melhores fichas da consulta aproximada. Não altera as similaridades
+        se o índice não tiver sido montado com os vetores exatos.
+        Parâmetros:
+            sims (ndarray de float) --> Similaridades aproximadas de todas as fichas, que são alteradas no próprio array
+            consulta (ndarray de float) --> Vetor da consulta normalizado
+            rerank (int) --> Quantidade das melhores fichas cuja similaridade será recalculada
+        Retorno: o array de similaridades (ndarray de float)
+        '''
+        exatos = self._obter_exatos()
+        if rerank and exatos is not None and self.num_fichas:
+            rerank = min(rerank, self.num_fichas)
+            ids = np.argpartition(-sims, rerank-1)[:rerank]
+            sims[ids] = exatos[ids] @ consulta
+        return sims
+
+    def similaridades(self, vetor, rerank=0):
+        '''
+        Calcula a similaridade do vetor informado com todas as fichas do índice. A matriz quantizada é percorrida em blocos
+        convertidos para float32, o que limita a memória temporária da consulta.
+        Parâmetros:
+            vetor (list de tuple (int, float) ou ndarray) --> Vetor da consulta
+            rerank (int) --> Quantidade das melhores fichas cuja similaridade será recalculada com os vetores exatos. Só tem
+                    efeito se o índice tiver sido montado com os vetores exatos (default: 0)
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float)
+        '''
+        consulta = self.consulta(vetor)
+        sims = np.empty(self.num_fichas, dtype=np.float32)
+        for ini, fim in self.blocos():
+            sims[ini:fim] = self.varrer(consulta, ini, fim)
+        return self.reordenar(sims, consulta, rerank)
+
+    def similaridades_ficha(self, id_ficha, rerank=0):
+        '''
+        Calcula a similaridade de uma ficha do índice com todas as demais fichas.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha que servirá de consulta
+            rerank (int) --> Quantidade das melhores fichas cuja similaridade será recalculada com os vetores exatos (default: 0)
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float)
+        '''
+        return self.similaridades(self.vetor(id_ficha), rerank=rerank)
+
+    def similaridades_ids(self, consulta, ids):
+        '''
+        Calcula a similaridade aproximada da consulta apenas com as fichas indicadas, da mesma forma que "varrer".
+        Parâmetros:
+            consulta (ndarray de float) --> Vetor da consulta normalizado
+            ids (iterável de int) --> Ids das fichas
+        Retorno: vetor com a similaridade de cada ficha, na ordem dos ids (ndarray de float)
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        return (self._matriz[ids].astype(np.float32) @ consulta) * self._escalas[ids]
+
+    def varrer(self, consulta, ini, fim):
+        '''
+        Calcula a similaridade aproximada da consulta com um bloco de fichas do índice.
+        Parâmetros:
+            consulta (ndarray de float) --> Vetor da consulta normalizado ou matriz com uma consulta normalizada por coluna
+            ini (int) --> Posição inicial do bloco
+            fim (int) --> Posição final do bloco (exclusiva)
+        Retorno: vetor com a similaridade de cada ficha do bloco (ndarray de float). Se a consulta for uma matriz com um
+            vetor por coluna, retorna uma matriz com uma linha por ficha e uma coluna por consulta
+        '''
+        sims = self._matriz[ini:fim].astype(np.float32) @ consulta
+        if sims.ndim == 2: return sims * self._escalas[ini:fim, None]
+        return sims * self._escalas[ini:fim]
+
+    def vetor(self, id_ficha):
+        '''
+        Retorna o vetor normalizado de uma ficha do índice, usando o vetor exato quando disponível.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha
+        Retorno: o vetor da ficha (ndarray de float)
+        '''
+        exatos = self._obter_exatos()
+        if exatos is not None: return np.array(exatos[id_ficha])
+        return self._matriz[id_ficha].astype(np.float32) * self._escalas[id_ficha]
+
+    def salvar(self, arq):
+        '''
+        Persiste o índice no arquivo informado (formato npz do numpy). Os vetores exatos permanecem no arquivo indicado
+        na criação do índice.
+        Parâmetros:
+            arq (string) --> Endereço do arquivo onde será salvo o índice
+        Retorno: None
+        '''
+        self.consolidar()
+        if self._arq_temporario:
+            os.replace(self._arq_temporario, self._arq_exatos)
+            self._arq_temporario = None
+            self._exatos = None
+        with open(arq, 'wb') as f:
+            np.savez(f, num_features=self.num_features, num_fichas=self.num_fichas, quantizacao=self.quantizacao
+                    ,arq_exatos=self._arq_exatos or '', matriz=self._matriz, escalas=self._escalas)
+
+    @classmethod
+    def carregar(cls, arq):
+        '''
+        Recupera um índice salvo anteriormente.
+        Parâmetros:
+            arq (string) --> Endereço do arquivo onde está salvo o índice
+        Retorno: o índice recuperado (IndiceDenso)
+        '''
+        with np.load(arq) as dados:
+            indice = cls.__new__(cls)
+            indice.num_features = int(dados['num_features'])
+            indice.num_fichas = int(dados['num_fichas'])
+            indice.quantizacao = str(dados['quantizacao'])
+            indice._arq_exatos = str(dados['arq_exatos']) or None
+            indice._matriz = dados['matriz']
+            indice._escalas = dados['escalas']
+        indice._exatos = None
+        indice._pendentes = []
+        indice._blocos = []
+        indice._arq_temporario = None
+        return indice
+
+    def _normalizar(self, vetor):
+        '''
+        Converte o vetor para um array denso em float32 com norma L2 unitária.
+        '''
+        if isinstance(vetor, np.ndarray): denso = vetor.astype(np.float32).ravel()
+        else:
+            denso = np.zeros(self.num_features, dtype=np.float32)
+            if len(vetor):
+                ids, valores = zip(*vetor)
+                denso[np.array(ids, dtype=np.int64)] = valores
+        norma = np.sqrt(np.dot(denso, denso))
+        if norma > 0: denso = denso / norma
+        return denso
+
+    def _obter_exatos(self):
+        '''
+        Mapeia em memória o arquivo dos vetores exatos, se houver.
+        '''
+        arq = self._arq_temporario or self._arq_exatos
+        if self._exatos is None and arq and os.path.isfile(arq) and self.num_fichas:
+            self._exatos = np.memmap(arq, dtype=np.float32, mode='r', shape=(self.num_fichas, self.num_features))
+        return self._exatos
+
+    def _quantizar(self):
+        '''
+        Quantiza os vetores adicionados e guarda o bloco para ser incorporado à matriz em "consolidar", gravando os vetores
+        exatos, se for o caso.
+        '''
+        if not self._pendentes: return
+        bloco = np.vstack(self._pendentes)
+        self._pendentes = []
+        arq = self._arq_temporario or self._arq_exatos
+        if arq:
+            with open(arq, 'ab') as f:
+                bloco.tofile(f)
+            self._exatos = None
+        if self.quantizacao == 'int8':
+            escalas = np.abs(bloco).max(axis=1) / 127
+            escalas[escalas == 0] = 1
+            bloco = np.round(bloco / escalas[:, None]).astype(np.int8)
+        else:
+            escalas = np.ones(bloco.shape[0], dtype=np.float32)
+            bloco = bloco.astype(self.quantizacao)
+        self._blocos.append((bloco, escalas.astype(np.float32)))
+
+
+class TabelaVizinhos:
+    '''
+    Tabela pré-calculada das k fichas mais semelhantes a cada ficha de um corpus (grafo kNN). É gravada em disco em três
+    arquivos com o mesmo prefixo: os ids dos vizinhos (".ids.npy", int32, com -1 nas posições vazias), as similaridades
+    (".sims.npy", float16, uma coluna por modelo ou dimensão e a última com a similaridade geral) e os metadados (".json").
+    Os arrays são acessados por mapeamento de memória, de modo que obter os vizinhos de uma ficha não depende do tamanho do
+    corpus. A tabela é montada por blocos de fichas e os metadados registram os blocos concluídos, o que permite retomar
+    uma montagem interrompida.
+    Parâmetros:
+        prefixo (string) --> Caminho e início do nome dos arquivos da tabela
+    Atributos:
+        prefixo (string) --> Caminho e início do nome dos arquivos da tabela
+        meta (dict) --> Metadados da tabela: "k", "num_fichas", "colunas", "tamanho_bloco", "assinatura" e "blocos_concluidos"
+    '''
+    def __init__(self, prefixo):
+        self.prefixo = prefixo
+        self.meta = None
+        self._arqs = {'ids': f'{prefixo}.ids.npy', 'sims': f'{prefixo}.sims.npy', 'meta': f'{prefixo}.json'}
+        self._ids = None
+        self._sims = None
+        self._versao_meta = None
+
+    def abrir(self):
+        '''
+        Lê os metadados da tabela, se ela existir, mantendo-os enquanto o arquivo não for alterado.
+        Retorno: True se a tabela existe e False caso contrário
+        '''
+        if not os.path.isfile(self._arqs['meta']): return False
+        versao = os.path.getmtime(self._arqs['meta'])
+        if versao == self._versao_meta: return True
+        with open(self._arqs['meta'], encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._versao_meta = versao
+        self._ids = self._sims = None
+        return True
+
+    def atual(self, assinatura):
+        '''
+        Verifica se a tabela está completa e foi montada com a assinatura informada, ou seja, com os mesmos modelos,
+        índices e parâmetros.
+        Parâmetros:
+            assinatura (dict) --> Assinatura atual do corpus
+        Retorno: True se a tabela pode ser usada e False caso contrário
+        '''
+        if not self.abrir(): return False
+        return self.completa() and self.meta['assinatura'] == json.loads(json.dumps(assinatura))
+
+    def blocos_pendentes(self):
+        '''
+        Relaciona os blocos de fichas que ainda não foram gravados.
+        Retorno: lista de tuplas com a posição inicial e final de cada bloco pendente (list de tuple (int, int))
+        '''
+        concluidos = set(self.meta['blocos_concluidos'])
+        num_fichas, tamanho = self.meta['num_fichas'], self.meta['tamanho_bloco']
+        return [(ini, min(ini + tamanho, num_fichas)) for ini in range(0, num_fichas, tamanho) if ini not in concluidos]
+
+    def completa(self):
+        '''
+        Verifica se todos os blocos da tabela foram gravados.
+        Retorno: True se a tabela está completa e False caso contrário
+        '''
+        return bool(self.meta) and not self.blocos_pendentes()
+
+    def criar(self, num_fichas, k, colunas, tamanho_bloco, assinatura, **extras):
+        '''
+        Cria os arquivos de uma tabela vazia, descartando a tabela anterior, ou retoma a tabela anterior se ela tiver sido
+        iniciada com os mesmos parâmetros e a mesma assinatura.
+        Parâmetros:
+            num_fichas (int) --> Quantidade de fichas do corpus
+            k (int) --> Quantidade de vizinhos de cada ficha
+            colunas (list de string) --> Nomes das colunas de similaridade, sendo a última a similaridade geral
+            tamanho_bloco (int) --> Quantidade de fichas de cada bloco
+            assinatura (dict) --> Assinatura atual do corpus
+            extras --> Outros dados a serem gravados nos metadados
+        Retorno: True se a tabela anterior foi retomada e False se foi criada uma tabela nova
+        '''
+        meta = json.loads(json.dumps(dict(k=k, num_fichas=num_fichas, colunas=list(colunas), tamanho_bloco=tamanho_bloco
+                                          ,assinatura=assinatura, **extras)))
+        if self.abrir() and all(self.meta.get(chave) == valor for chave, valor in meta.items()) \
+           and os.path.isfile(self._arqs['ids']) and os.path.isfile(self._arqs['sims']):
+            return True
+        ids = np.lib.format.open_memmap(self._arqs['ids'], mode='w+', dtype=np.int32, shape=(num_fichas, k))
+        ids[:] = -1
+        ids.flush()
+        sims = np.lib.format.open_memmap(self._arqs['sims'], mode='w+', dtype=np.float16, shape=(num_fichas, k, len(colunas)))
+        sims.flush()
+        del ids, sims
+        meta['blocos_concluidos'] = []
+        self._gravar_meta(meta)
+        return False
+
+    def gravar_bloco(self, ini, ids, sims):
+        '''
+        Grava os vizinhos de um bloco de fichas e o registra como concluído nos metadados.
+        Parâmetros:
+            ini (int) --> Posição da primeira ficha do bloco
+            ids (ndarray de int) --> Ids dos vizinhos de cada ficha do bloco (fichas x k)
+            sims (ndarray de float) --> Similaridades dos vizinhos (fichas x k x colunas)
+        Retorno: None
+        '''
+        for tipo, valores in [('ids', ids), ('sims', sims)]:
+            matriz = np.load(self._arqs[tipo], mmap_mode='r+')
+            matriz[ini:ini+len(valores)] = valores
+            matriz.flush()
+            del matriz
+        self.meta['blocos_concluidos'].append(ini)
+        self._gravar_meta(self.meta)
+
+    def linhas(self, ids_fichas):
+        '''
+        Obtém os vizinhos de várias fichas, sem retirar as posições vazias.
+        Parâmetros:
+            ids_fichas (list de int) --> Ids das fichas
+        Retorno: uma tupla com os ids dos vizinhos (ndarray de int32, fichas x k) e as suas similaridades (ndarray de float32,
+            fichas x k x colunas)
+        '''
+        if self._ids is None:
+            self._ids = np.load(self._arqs['ids'], mmap_mode='r')
+            self._sims = np.load(self._arqs['sims'], mmap_mode='r')
+        ids_fichas = np.asarray(ids_fichas, dtype=np.int64)
+        return np.array(self._ids[ids_fichas]), np.array(self._sims[ids_fichas], dtype=np.float32)
+
+    def vizinhos(self, id_ficha):
+        '''
+        Obtém os vizinhos de uma ficha.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha
+        Retorno: uma tupla com os ids dos vizinhos (ndarray de int) e as suas similaridades (ndarray de float, vizinhos x
+            colunas), em ordem decrescente de similaridade geral, sem as posições vazias
+        '''
+        ids, sims = self.linhas([id_ficha])
+        validos = ids[0] >= 0
+        return ids[0][validos], sims[0][validos]
+
+    def _gravar_meta(self, meta):
+        '''
+        Grava os metadados de forma atômica, para que uma interrupção não deixe o arquivo incompleto.
+        '''
+        temporario = f'{self._arqs["meta"]}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(temporario, self._arqs['meta'])
+        self.meta = meta
+        self._versao_meta = os.path.getmtime(self._arqs['meta'])
+
+
+def espelhar_corpus(corpus, indice):
+    '''
+    Gera os vetores do corpus ao mesmo tempo em que os inclui no índice informado, permitindo montar o índice na mesma
+    passada do corpus usada para montar a matriz de similaridade do Gensim.
+    Parâmetros:
+        corpus (iterável) --> Corpus transformado por um modelo
+        indice (IndiceInvertido ou IndiceDenso) --> Índice no qual os vetores serão incluídos
+    Retorno: um gerador dos vetores do corpus
+    '''
+    for vetor in corpus:
+        indice.adicionar(vetor)
+        yield vetor
+
+
+class ExecutorConsultas:
+    '''
+    Executa as consultas de similaridade em pools de threads. Os blocos de um índice (os shards da matriz de similaridade
+    do Gensim ou os blocos da matriz de um IndiceDenso) são varridos em paralelo, assim como os índices de modelos
+    diferentes. As operações de produto interno do numpy liberam o GIL, de modo que as threads usam núcleos distintos.
+    São usados dois pools: um para as tarefas de consulta a índices, que podem aguardar a varredura de blocos, e outro
+    apenas para a varredura dos blocos, o que evita o bloqueio mútuo entre as tarefas.
+    Parâmetros:
+        num_threads (int) --> Número de threads de cada pool. Se None, usa o número de CPUs da máquina (default: None)
+    Atributos:
+        num_threads (int) --> Número de threads de cada pool
+    '''
+    def __init__(self, num_threads=None):
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._pool_indices = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix='twins_indices')
+        self._pool_blocos = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix='twins_blocos')
+
+    def encerrar(self):
+        '''
+        Encerra os pools de threads.
+        Retorno: None
+        '''
+        self._pool_indices.shutdown(wait=True)
+        self._pool_blocos.shutdown(wait=True)
+
+    def mapear(self, funcao, itens):
+        '''
+        Aplica a função a cada item concorrentemente, no pool de consultas a índices.
+        Parâmetros:
+            funcao (FunctionObject) --> Função a ser aplicada a cada item
+            itens (iterável) --> Itens aos quais a função será aplicada
+        Retorno: lista dos resultados na mesma ordem dos itens
+        '''
+        return list(self._pool_indices.map(funcao, itens))
+
+    def melhores(self, index, consulta, k, excluir=None, rerank=0):
+        '''
+        Obtém as k fichas mais semelhantes à consulta. Cada bloco do índice produz o seu top-k parcial em paralelo e os
+        resultados parciais são combinados em um heap.
+        Parâmetros:
+            index (Similarity, IndiceDenso ou IndiceInvertido) --> Índice a ser consultado
+            consulta (int ou vetor) --> Id de uma ficha do índice ou vetor da consulta
+            k (int) --> Quantidade de fichas a serem retornadas
+            excluir (int) --> Id de uma ficha a ser desconsiderada no resultado (default: None)
+            rerank (int) --> Quantidade de fichas a serem reordenadas de forma exata em um IndiceDenso (default: 0)
+        Retorno: uma tupla com os ids das fichas (ndarray de int) e as respectivas similaridades (ndarray de float) em ordem
+            decrescente de similaridade
+        '''
+        if isinstance(index, IndiceInvertido):
+            if isinstance(consulta, (int, np.integer)): consulta = index.vetor(consulta)
+            return index.melhores(consulta, k, excluir=excluir)
+        if isinstance(index, IndiceDenso) and rerank:
+            # A reordenação exata precisa das similaridades de todas as fichas
+            sims = self.similaridades(index, consulta, rerank=rerank)
+            parciais = [self._top_k(sims, 0, k, excluir)]
+        else:
+            parciais = list(self._pool_blocos.map(lambda bloco: self._top_k(bloco[1](), bloco[0], k, excluir)
+                                                 ,self._blocos(index, consulta)))
+        melhores = heapq.nlargest(k, (par for parcial in parciais for par in parcial))
+        ids = np.array([id_ficha for _, id_ficha in melhores], dtype=np.int64)
+        return ids, np.array([sim for sim, _ in melhores], dtype=np.float32)
+
+    def similaridades(self, index, consulta, rerank=0):
+        '''
+        Calcula a similaridade da consulta com todas as fichas do índice, varrendo os blocos do índice em paralelo.
+        Parâmetros:
+            index (Similarity, IndiceDenso ou IndiceInvertido) --> Índice a ser consultado
+            consulta (int ou vetor) --> Id de uma ficha do índice ou vetor da consulta
+            rerank (int) --> Quantidade de fichas a serem reordenadas de forma exata em um IndiceDenso (default: 0)
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float)
+        '''
+        if isinstance(index, IndiceInvertido):
+            if isinstance(consulta, (int, np.integer)): return index.similaridades_ficha(consulta)
+            return index.similaridades(consulta)
+        blocos = self._blocos(index, consulta)
+        sims = np.hstack(list(self._pool_blocos.map(lambda bloco: bloco[1](), blocos))).ravel().astype(np.float32)
+        if isinstance(index, IndiceDenso):
+            sims = index.reordenar(sims, self._consulta_densa(index, consulta), rerank)
+        return sims
+
+    def similaridades_ids(self, index, consulta, ids):
+        '''
+        Calcula a similaridade da consulta apenas com as fichas indicadas, em um índice que permite o acesso direto aos
+        vetores das fichas. Nos índices densos, não há reordenação exata.
+        Parâmetros:
+            index (IndiceDenso ou IndiceInvertido) --> Índice a ser consultado
+            consulta (int ou vetor) --> Id de uma ficha do índice ou vetor da consulta
+            ids (iterável de int) --> Ids das fichas
+        Retorno: vetor com a similaridade de cada ficha, na ordem dos ids (ndarray de float)
+        '''
+        if isinstance(index, IndiceInvertido):
+            if isinstance(consulta, (int, np.integer)): consulta = index.vetor(consulta)
+            return index.similaridades_ids(consulta, ids)
+        if isinstance(index, IndiceDenso): return index.similaridades_ids(self._consulta_densa(index, consulta), ids)
+        raise TypeError(f'Tipo de índice não suportado: {type(index).__name__}')
+
+    def similaridades_lote(self, index, consultas, rerank=0):
+        '''
+        Calcula a similaridade de um lote de consultas com todas as fichas do índice. Nos índices densos, as consultas são
+        reunidas em uma matriz e cada bloco do índice é varrido uma única vez para todo o lote.
+        Parâmetros:
+            index (Similarity, IndiceDenso ou IndiceInvertido) --> Índice a ser consultado
+            consultas (list de int ou vetor) --> Ids de fichas do índice ou vetores das consultas
+            rerank (int) --> Quantidade de fichas a serem reordenadas de forma exata em um IndiceDenso (default: 0)
+        Retorno: matriz com uma linha por consulta e uma coluna por ficha (ndarray de float)
+        '''
+        if isinstance(index, IndiceInvertido):
+            return np.vstack([self.similaridades(index, consulta) for consulta in consultas])
+        if isinstance(index, IndiceDenso):
+            matriz = np.column_stack([self._consulta_densa(index, consulta) for consulta in consultas])
+            blocos = [(ini, lambda ini=ini, fim=fim: index.varrer(matriz, ini, fim)) for ini, fim in index.blocos()]
+            sims = np.vstack(list(self._pool_blocos.map(lambda bloco: bloco[1](), blocos))).T.astype(np.float32)
+            for i in range(sims.shape[0]):
+                sims[i] = index.reordenar(sims[i], matriz[:, i], rerank)
+            return sims
+        if isinstance(index, Similarity):
+            vetores = [self._vetor_gensim(index.vector_by_id(consulta)) if isinstance(consulta, (int, np.integer))
+                       else consulta for consulta in consultas]
+            partes = self._pool_blocos.map(lambda shard: np.atleast_2d(self._varrer_shard(shard, vetores)), index.shards)
+            return np.hstack(list(partes)).astype(np.float32)
+        raise TypeError(f'Tipo de índice não suportado: {type(index).__name__}')
+
+    def _blocos(self, index, consulta):
+        '''
+        Monta a lista de blocos do índice a serem varridos. Cada bloco é uma tupla com a posição da primeira ficha do bloco
+        e uma função sem argumentos que calcula as similaridades do bloco.
+        '''
+        if isinstance(index, IndiceDenso):
+            vetor = self._consulta_densa(index, consulta)
+            return [(ini, lambda ini=ini, fim=fim: index.varrer(vetor, ini, fim)) for ini, fim in index.blocos()]
+        if isinstance(index, Similarity):
+            if isinstance(consulta, (int, np.integer)): consulta = index.vector_by_id(consulta)
+            blocos, ini = [], 0
+            for shard in index.shards:
+                blocos.append((ini, lambda shard=shard: self._varrer_shard(shard, consulta)))
+                ini += len(shard)
+            return blocos
+        raise TypeError(f'Tipo de índice não suportado: {type(index).__name__}')
+
+    def _consulta_densa(self, index, consulta):
+        '''
+        Obtém o vetor normalizado da consulta em um IndiceDenso.
+        '''
+        if isinstance(consulta, (int, np.integer)): consulta = index.vetor(consulta)
+        return index.consulta(consulta)
+
+    def _top_k(self, sims, ini, k, excluir):
+        '''
+        Obtém as k maiores similaridades de um bloco na forma de uma lista de tuplas (similaridade, id da ficha).
+        '''
+        sims = np.asarray(sims).ravel()
+        if excluir is not None and ini <= excluir < ini + len(sims):
+            sims = sims.copy()
+            sims[excluir - ini] = -np.inf
+        n = min(k, len(sims))
+        if not n: return []
+        ids = np.argpartition(-sims, n-1)[:n] if n < len(sims) else np.arange(len(sims))
+        return [(float(sims[i]), int(i) + ini) for i in ids if np.isfinite(sims[i])]
+
+    def _varrer_shard(self, shard, consulta):
+        '''
+        Calcula as similaridades da consulta com as fichas de um shard da matriz de similaridade do Gensim. O índice do shard
+        é consultado diretamente, sem alterar os atributos do shard, que é compartilhado entre as threads, e continua
+        carregado para as próximas consultas.
+        '''
+        index = shard.get_index()
+        lote, consulta = utils.is_corpus(consulta)
+        if not matutils.ismatrix(consulta):
+            consulta = [matutils.unitvec(vetor) for vetor in consulta] if lote else matutils.unitvec(consulta)
+        return index.get_similarities(consulta)
+
+    def _vetor_gensim(self, vetor):
+        '''
+        Converte o vetor de uma ficha da matriz de similaridade do Gensim (denso ou esparso do scipy) para o formato
+        esparso de lista de tuplas (int, float).
+        '''
+        if isinstance(vetor, np.ndarray): return matutils.full2sparse(vetor.ravel())
+        return matutils.scipy2sparse(vetor)
+
+
+_EXECUTOR = None
+_TRAVA_EXECUTOR = threading.Lock()
+
+def configurar_executor(num_threads=None):
+    '''
+    Define o número de threads usado nas consultas, substituindo o executor compartilhado.
+    Parâmetros:
+        num_threads (int) --> Número de threads de cada pool. Se None, usa o número de CPUs da máquina (default: None)
+    Retorno: o novo executor (ExecutorConsultas)
+    '''
+    global _EXECUTOR
+    with _TRAVA_EXECUTOR:
+        anterior, _EXECUTOR = _EXECUTOR, ExecutorConsultas(num_threads)
+    if anterior: anterior.encerrar()
+    return _EXECUTOR
+
+def obter_executor():
+    '''
+    Retorna o executor de consultas compartilhado, criando-o na primeira chamada.
+    Retorno: o executor de consultas (ExecutorConsultas)
+    '''
+    global _EXECUTOR
+    with _TRAVA_EXECUTOR:
+        if _EXECUTOR is None: _EXECUTOR = ExecutorConsultas()
+        return _EXECUTOR
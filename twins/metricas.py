@@ -0,0 +1,267 @@
+# Imports Python
+import os
+import json
+import time
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+# Imports Twins
+from twins.utils import ConexaoDB, encerrar_janela_memoria, iniciar_janela_memoria
+
+class Metricas:
+    '''
+    Registra spans aninhados das etapas de construção e de consulta dos corpus. Cada span mede o tempo de relógio, o tempo
+    de CPU do processo e o pico de memória residente do processo durante o span, além de contadores (linhas lidas, tokens,
+    comandos SQL, ...). Os contadores de um span são somados aos do span que o contém quando ele é encerrado. O aninhamento
+    é controlado por thread, de modo que spans abertos em outra thread começam uma nova árvore. Enquanto o registro estiver
+    desativado, abrir spans e incrementar contadores não tem custo relevante.
+    Parâmetros:
+        max_spans (int) --> Quantidade máxima de spans encerrados mantidos em memória (default: 100000)
+    Atributos:
+        ativo (boolean) --> Indica se os spans estão sendo registrados
+        spans (deque de dict) --> Spans encerrados, na ordem de encerramento
+    '''
+    def __init__(self, max_spans=100000):
+        self.ativo = False
+        self.spans = deque(maxlen=max_spans)
+        self._hooks = []
+        self._local = threading.local()
+        self._trava = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def atual(self):
+        '''
+        Retorna o span aberto mais interno da thread atual.
+        Retorno: o span (dict) ou None se não houver span aberto
+        '''
+        pilha = getattr(self._local, 'pilha', None)
+        return pilha[-1] if pilha else None
+
+    def contar(self, contador, valor=1):
+        '''
+        Incrementa um contador do span aberto mais interno da thread atual. Não faz nada se não houver span aberto.
+        Parâmetros:
+            contador (str) --> Nome do contador
+            valor (int ou float) --> Valor somado ao contador (default: 1)
+        Retorno: None
+        '''
+        pilha = getattr(self._local, 'pilha', None)
+        if not pilha: return
+        contadores = pilha[-1]['contadores']
+        contadores[contador] = contadores.get(contador, 0) + valor
+
+    def exportar_jsonl(self, arq, limpar=False):
+        '''
+        Acrescenta os spans encerrados a um arquivo no formato JSON lines, um span por linha.
+        Parâmetros:
+            arq (str) --> Endereço do arquivo
+            limpar (boolean) --> Indica se os spans exportados são descartados da memória (default: False)
+        Retorno: a quantidade de spans exportados (int)
+        '''
+        with self._trava:
+            spans = list(self.spans)
+            if limpar: self.spans.clear()
+        with open(arq, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False) + '\n')
+        return len(spans)
+
+    def exportar_prometheus(self, arq, prefixo='twins'):
+        '''
+        Grava os spans encerrados, agregados por nome e rótulos, no formato texto do Prometheus, para ser lido pelo textfile
+        collector do node_exporter. O arquivo é substituído de forma atômica.
+        Parâmetros:
+            arq (str) --> Endereço do arquivo
+            prefixo (str) --> Prefixo dos nomes das métricas (default: 'twins')
+        Retorno: None
+        '''
+        metricas = {'execucoes_total': ('counter', 'Quantidade de execuções do span', {})
+                   ,'segundos_total': ('counter', 'Tempo de relógio acumulado do span, em segundos', {})
+                   ,'cpu_segundos_total': ('counter', 'Tempo de CPU acumulado do span, em segundos', {})
+                   ,'pico_memoria_bytes': ('gauge', 'Maior pico de memória residente do processo durante o span', {})
+                   ,'contador_total': ('counter', 'Contadores acumulados do span', {})}
+        with self._trava:
+            spans = list(self.spans)
+        for span in spans:
+            rotulos = (('span', span['nome']), ) + tuple(sorted((k, str(v)) for k, v in span['rotulos'].items()))
+            for nome, valor in [('execucoes_total', 1), ('segundos_total', span['duracao']), ('cpu_segundos_total', span['cpu'])]:
+                valores = metricas[nome][2]
+                valores[rotulos] = valores.get(rotulos, 0) + valor
+            if span['pico_memoria'] is not None:
+                valores = metricas['pico_memoria_bytes'][2]
+                valores[rotulos] = max(valores.get(rotulos, 0), span['pico_memoria'])
+            for contador, valor in span['contadores'].items():
+                valores, chave = metricas['contador_total'][2], rotulos + (('contador', contador), )
+                valores[chave] = valores.get(chave, 0) + valor
+        def formatar(rotulos):
+            texto = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in rotulos)
+            return f'{{{texto}}}'
+        linhas = []
+        for nome, (tipo, descricao, valores) in metricas.items():
+            linhas.append(f'# HELP {prefixo}_span_{nome} {descricao}')
+            linhas.append(f'# TYPE {prefixo}_span_{nome} {tipo}')
+            for rotulos, valor in valores.items():
+                linhas.append(f'{prefixo}_span_{nome}{formatar(rotulos)} {valor}')
+        temporario = f'{arq}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(linhas) + '\n')
+        os.replace(temporario, arq)
+
+    def incluir_hook(self, funcao):
+        '''
+        Inclui uma função chamada a cada span encerrado, recebendo o span (dict). Os hooks são chamados no processo
+        principal, inclusive para os spans das tarefas executadas em outros processos pelo agendador.
+        Parâmetros:
+            funcao (function) --> Função que recebe o span encerrado
+        Retorno: None
+        '''
+        if funcao not in self._hooks: self._hooks.append(funcao)
+
+    def incorporar(self, spans):
+        '''
+        Incorpora os spans encerrados em outro processo. Os spans sem pai passam a ser filhos do span aberto na thread atual,
+        que recebe os seus contadores.
+        Parâmetros:
+            spans (list de dict) --> Spans encerrados no outro processo
+        Retorno: None
+        '''
+        pai = self.atual()
+        for span in spans:
+            if span['pai'] is None and pai is not None:
+                span['pai'] = pai['id']
+                for contador, valor in span['contadores'].items():
+                    pai['contadores'][contador] = pai['contadores'].get(contador, 0) + valor
+            self._registrar(span)
+
+    def limpar(self):
+        '''
+        Descarta os spans encerrados mantidos em memória.
+        Retorno: None
+        '''
+        with self._trava:
+            self.spans.clear()
+
+    def remover_hook(self, funcao):
+        '''
+        Remove uma função incluída por "incluir_hook".
+        Parâmetros:
+            funcao (function) --> Função a ser removida
+        Retorno: None
+        '''
+        if funcao in self._hooks: self._hooks.remove(funcao)
+
+    def resumo(self):
+        '''
+        Agrega os spans encerrados por nome.
+        Retorno: Pandas DataFrame com a quantidade de execuções, os tempos de relógio (total, médio e máximo) e de CPU, o
+            maior pico de memória e a soma de cada contador, por nome de span
+        '''
+        with self._trava:
+            spans = list(self.spans)
+        if not spans: return pd.DataFrame()
+        dados = pd.DataFrame([dict(nome=span['nome'], duracao=span['duracao'], cpu=span['cpu']
+                                  ,pico_memoria=span['pico_memoria'], **span['contadores']) for span in spans])
+        agregacoes = dict(execucoes=('duracao', 'size'), duracao_total=('duracao', 'sum'), duracao_media=('duracao', 'mean')
+                         ,duracao_max=('duracao', 'max'), cpu_total=('cpu', 'sum'), pico_memoria=('pico_memoria', 'max'))
+        for contador in dados.columns.drop(['nome', 'duracao', 'cpu', 'pico_memoria']):
+            agregacoes[contador] = (contador, 'sum')
+        return dados.groupby('nome').agg(**agregacoes).sort_values('duracao_total', ascending=False)
+
+    @contextmanager
+    def span(self, nome, **rotulos):
+        '''
+        Abre um span, encerrando-o ao final do bloco with. Não registra nada se o registro estiver desativado.
+        Parâmetros:
+            nome (str) --> Nome da etapa medida
+            rotulos --> Rótulos que identificam o span, como o corpus e o modelo. Os rótulos None são descartados
+        Retorno: o span aberto (dict) ou None, em um bloco with
+        '''
+        if not self.ativo:
+            yield None
+            return
+        pilha = getattr(self._local, 'pilha', None)
+        if pilha is None: pilha = self._local.pilha = []
+        span = dict(nome=nome, id=f'{os.getpid()}-{next(self._ids)}', pai=pilha[-1]['id'] if pilha else None
+                   ,pid=os.getpid(), rotulos={k: v for k, v in rotulos.items() if v is not None}, inicio=time.time(), duracao=None, cpu=None, pico_memoria=None
+                   ,contadores={})
+        pilha.append(span)
+        janela = iniciar_janela_memoria()
+        relogio, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        finally:
+            span['duracao'] = time.perf_counter() - relogio
+            span['cpu'] = time.process_time() - cpu
+            span['pico_memoria'] = encerrar_janela_memoria(janela)
+            pilha.pop()
+            if pilha:
+                contadores = pilha[-1]['contadores']
+                for contador, valor in span['contadores'].items():
+                    contadores[contador] = contadores.get(contador, 0) + valor
+            self._registrar(span)
+
+    def _registrar(self, span):
+        '''
+        Guarda o span encerrado e o repassa aos hooks. Um hook que falha não interrompe a etapa medida.
+        Parâmetros:
+            span (dict) --> Span encerrado
+        Retorno: None
+        '''
+        with self._trava:
+            self.spans.append(span)
+        for funcao in list(self._hooks):
+            try: funcao(span)
+            except Exception as erro: print(f'O hook de métricas {funcao!r} falhou: {erro!r}')
+
+
+_METRICAS = Metricas()
+
+def _contar_sql(sql):
+    '''
+    Conta um comando SQL executado no span aberto. É registrada nas conexões de ConexaoDB enquanto as métricas estiverem
+    ativas.
+    Parâmetros:
+        sql (str) --> Comando executado
+    Retorno: None
+    '''
+    _METRICAS.contar('sql')
+
+def configurar_metricas(ativo=True, max_spans=None):
+    '''
+    Ativa ou desativa o registro das métricas compartilhado. Com o registro ativo, as conexões ao DB dos corpus passam a
+    contar os comandos SQL executados.
+    Parâmetros:
+        ativo (boolean) --> Indica se os spans são registrados (default: True)
+        max_spans (int) --> Quantidade máxima de spans mantidos em memória. Se None, mantém a atual (default: None)
+    Retorno: o registro das métricas (Metricas)
+    '''
+    _METRICAS.ativo = ativo
+    if max_spans is not None:
+        with _METRICAS._trava:
+            _METRICAS.spans = deque(_METRICAS.spans, maxlen=max_spans)
+    ConexaoDB.rastreador = _contar_sql if ativo else None
+    return _METRICAS
+
+def contar(contador, valor=1):
+    '''
+    Incrementa um contador do span aberto no registro compartilhado (ver Metricas.contar).
+    Retorno: None
+    '''
+    _METRICAS.contar(contador, valor)
+
+def medir(nome, **rotulos):
+    '''
+    Abre um span no registro compartilhado, para uso em um bloco with (ver Metricas.span).
+    Retorno: o gerenciador de contexto do span
+    '''
+    return _METRICAS.span(nome, **rotulos)
+
+def obter_metricas():
+    '''
+    Retorna o registro das métricas compartilhado.
+    Retorno: o registro das métricas (Metricas)
+    '''
+    return _METRICAS
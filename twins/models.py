@@ -2,18 +2,245 @@
 import os
 import multiprocessing as mp
 import json
+import copy
+import hashlib
+import pickle
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
-import shelve
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from tqdm.notebook import tqdm
 # Imports Gensim
+from gensim.corpora import MmCorpus
 from gensim.models.ldamodel import LdaModel
+from gensim.models.ldamulticore import LdaMulticore
 from gensim.models.lsimodel import LsiModel
 from gensim.models.tfidfmodel import TfidfModel
 from gensim.models.doc2vec import Doc2Vec
 from gensim.models.coherencemodel import CoherenceModel
 from gensim.similarities.docsim import Similarity
 # Imports Twins
-from twins.utils import Doc2VecCorpus
+from twins.utils import CacheLRU, Doc2VecCorpus, abrir_shelve, obter_memoria_atual
+from twins.utils import encerrar_janela_memoria, iniciar_janela_memoria
+from twins.indices import IndiceInvertido, IndiceDenso, TabelaVizinhos, espelhar_corpus, obter_executor
+from twins.metricas import medir
+
+# Cache compartilhado das similaridades brutas de cada modelo, que não dependem dos pesos e percentuais mínimos
+_CACHE_SIMILARIDADES = CacheLRU(max_itens=1000, max_bytes=512*2**20)
+
+def configurar_cache_similaridades(max_itens=None, max_bytes=None):
+    '''
+    Define os limites do cache das similaridades brutas calculadas pelos modelos de todos os corpus. Com o cache, ajustar
+    os pesos ou os percentuais mínimos dos modelos e repetir uma pesquisa refaz apenas a combinação dos modelos.
+    Parâmetros:
+        max_itens (int) --> Quantidade máxima de vetores de similaridade. Se for 0, desativa o cache. Se None, mantém o
+                valor atual (default: None)
+        max_bytes (int) --> Tamanho máximo, em bytes, dos vetores de similaridade. Se None, mantém o valor atual (default: None)
+    Retorno: o cache das similaridades (CacheLRU)
+    '''
+    _CACHE_SIMILARIDADES.ajustar(max_itens, max_bytes)
+    if not _CACHE_SIMILARIDADES.max_itens: _CACHE_SIMILARIDADES.limpar()
+    return _CACHE_SIMILARIDADES
+
+def _configurar_lsi(parametros, num_topicos, num_termos, num_docs, tokens_doc, memoria_base=0):
+    '''
+    Define a configuração de treinamento do LSI. Sem memória máxima, usa os parâmetros do modelo. Com memória máxima, as
+    amostras extras da decomposição aleatória são reduzidas pela metade, com uma iteração de potência a mais para manter a
+    precisão, até que caibam na memória as matrizes da decomposição e um bloco mínimo de documentos. O bloco de documentos
+    é o maior que cabe na memória restante, limitado ao "chunksize" do modelo. A memória já ocupada pelo processo é
+    descontada da memória máxima, para que o pico do processo fique abaixo dela.
+    Parâmetros:
+        parametros (dict) --> Parâmetros do modelo "lsi": "chunksize", "onepass", "power_iters", "extra_samples" e
+                "memoria_max" (memória máxima, em bytes, ou None)
+        num_topicos (int) --> Quantidade de tópicos
+        num_termos (int) --> Quantidade de tokens do dicionário
+        num_docs (int) --> Quantidade de documentos do corpus de treinamento
+        tokens_doc (float) --> Quantidade média de tokens distintos por documento
+        memoria_base (int) --> Memória, em bytes, já ocupada pelo processo que fará o treinamento (default: 0)
+    Retorno: dicionário com "chunksize", "onepass", "power_iters", "extra_samples", a memória estimada do treinamento
+        ("memoria"), a memória já ocupada ("memoria_base") e a memória máxima ("memoria_max")
+    '''
+    tokens_doc = max(1, tokens_doc or 1)
+    def estimar(chunksize, extra_samples):
+        # A projeção acumulada e a do bloco (termos x tópicos), duas matrizes da decomposição aleatória (termos x amostras)
+        # e, por documento do bloco, as tuplas Python, a matriz esparsa e as linhas das matrizes auxiliares
+        amostras = num_topicos + extra_samples
+        return (2 * num_topicos + 2 * amostras) * num_termos * 8 + chunksize * (tokens_doc * 150 + 2 * amostras * 8)
+    chunksize = max(1, min(parametros['chunksize'], num_docs or parametros['chunksize']))
+    power_iters, extra_samples = parametros['power_iters'], parametros['extra_samples']
+    memoria_max = parametros['memoria_max']
+    if memoria_max:
+        # Reserva 10% da memória máxima para as alocações temporárias do numpy e do Python
+        disponivel = memoria_max * 0.9 - memoria_base
+        minimo = min(chunksize, 1000)
+        while extra_samples > 10 and estimar(minimo, extra_samples) > disponivel:
+            extra_samples, power_iters = max(10, extra_samples // 2), power_iters + 1
+        por_doc = estimar(1, extra_samples) - estimar(0, extra_samples)
+        chunksize = int(max(minimo, min(chunksize, (disponivel - estimar(0, extra_samples)) // por_doc)))
+    return dict(chunksize=chunksize, onepass=parametros['onepass'], power_iters=power_iters, extra_samples=extra_samples
+               ,memoria=int(estimar(chunksize, extra_samples)), memoria_base=memoria_base, memoria_max=memoria_max)
+
+def _estimar_memoria_topicos(modelo, num_topicos, num_termos, num_docs):
+    '''
+    Estima a memória, em bytes, usada no treinamento e na medida de um modelo de tópicos. A memória do LSI é estimada
+    por _configurar_lsi.
+    Parâmetros:
+        modelo (str) --> Nome do modelo: "lda" ou "doc2vec"
+        num_topicos (int) --> Quantidade de tópicos ou tamanho dos vetores do modelo
+        num_termos (int) --> Quantidade de tokens do dicionário
+        num_docs (int) --> Quantidade de documentos do corpus de treinamento
+    Retorno: a memória estimada (int)
+    '''
+    # O LDA mantém as matrizes lambda, expElogbeta e as estatísticas suficientes (tópicos x termos). O Doc2Vec mantém os
+    # vetores dos documentos e os vetores de entrada e saída das palavras. Em ambos, soma-se o índice de similaridade
+    indice = num_docs * num_topicos * 4
+    if modelo == 'lda': return 4 * num_topicos * num_termos * 8 + indice
+    return (num_docs + 2 * num_termos) * num_topicos * 4 + indice
+
+def _obter_posicao_target(index, id_query, id_target):
+    '''
+    Pesquisa pelo id_query na matriz de similaridades sims e retorna a posição de id_target considerando a ordem
+    decrescente das probabilidades de semelhança.
+    Parâmetros:
+        index (Similarity) --> Matriz de similaridade de Gensim
+        id_query (int) --> Índice do vetor no corpus cujas similaridades se pretende encontrar
+        id_target (int) --> Índice do vetor no corpus cuja posição na ordem inversa das probabilidades se deseja encontrar
+    Retorno: uma tupla onde o primeiro elemento é a posição de id_target na resposta da consulta de similaridade ordenada
+        inversamente pelas probabilidades e o segundo é a probabilidade de similaridade do id_target (tuple (int, float))
+    '''
+    sims = index.similarity_by_id(id_query)
+    sims_df = pd.DataFrame(sims, columns=['per_sim'])
+    sims_df.sort_values(by='per_sim', ascending=False, inplace=True)
+    sims_df['ordem'] = [i for i in range(1, sims_df.shape[0]+1)]
+    if id_target not in sims_df.index: ordem = per_sim = None
+    else: ordem, per_sim = sims_df.loc[id_target, 'ordem'], sims_df.loc[id_target, 'per_sim']
+    return ordem, per_sim
+
+def _treinar_lda(corpus, id2word, num_topics, parametros):
+    '''
+    Treina um modelo LDA com o backend e os parâmetros de treinamento informados.
+    Parâmetros:
+        corpus (iterável de list de tuple (int, int)) --> Corpus de treinamento no formato BOW
+        id2word (dict int:str) --> Dicionário do corpus
+        num_topics (int) --> Quantidade de tópicos
+        parametros (dict) --> Parâmetros do modelo "lda": "backend" ("lda" para LdaModel ou "multicore" para LdaMulticore),
+                "workers" (processos do LdaMulticore; se None, a quantidade de CPUs menos uma), "chunksize", "passes" e
+                "eval_every" (None desativa o cálculo da perplexidade durante o treinamento)
+    Retorno: o modelo treinado (LdaModel ou LdaMulticore)
+    '''
+    kwargs = dict(corpus=corpus, id2word=id2word, num_topics=num_topics, chunksize=parametros['chunksize']
+                 ,passes=parametros['passes'], eval_every=parametros['eval_every'])
+    if parametros['backend'] == 'multicore':
+        return LdaMulticore(workers=parametros['workers'] or max(1, mp.cpu_count() - 1), **kwargs)
+    return LdaModel(**kwargs)
+
+def _treinar_lsi(corpus, id2word, num_topics, configuracao):
+    '''
+    Treina um modelo LSI com a configuração definida por _configurar_lsi e informa a configuração usada, o pico de memória
+    do processo durante o treinamento e a memória usada pelo treinamento (o pico menos a memória ocupada no seu início),
+    comparável à memória estimada, que também ficam registrados no atributo "configuracao_treino" do modelo. Avisa se a
+    memória máxima não comporta nem a configuração mínima.
+    Parâmetros:
+        corpus (iterável de list de tuple (int, float)) --> Corpus de treinamento no formato TF-IDF
+        id2word (dict int:str) --> Dicionário do corpus
+        num_topics (int) --> Quantidade de tópicos
+        configuracao (dict) --> Configuração de treinamento retornada por _configurar_lsi
+    Retorno: o modelo treinado (LsiModel)
+    '''
+    memoria_max = configuracao['memoria_max']
+    if memoria_max and configuracao['memoria_base'] + configuracao['memoria'] > memoria_max:
+        print(f'A memória máxima de {memoria_max / 2**20:.0f} MB é insuficiente para o LSI com {num_topics} tópicos e '
+              f'{len(id2word)} termos. Reduza a quantidade de tópicos ou o tamanho do dicionário.')
+    janela, inicial = iniciar_janela_memoria(), obter_memoria_atual()
+    model = LsiModel(corpus=corpus, id2word=id2word, num_topics=num_topics, chunksize=configuracao['chunksize']
+                    ,onepass=configuracao['onepass'], power_iters=configuracao['power_iters']
+                    ,extra_samples=configuracao['extra_samples'])
+    pico = encerrar_janela_memoria(janela)
+    memoria_treino = max(0, pico - inicial) if pico is not None and inicial is not None else None
+    model.configuracao_treino = dict(configuracao, pico_memoria=pico, memoria_treino=memoria_treino)
+    ajustes = ', '.join(f'{k}={configuracao[k]}' for k in ['chunksize', 'onepass', 'power_iters', 'extra_samples'])
+    if memoria_treino is None: print(f'LSI treinado com {ajustes}. Memória estimada: {configuracao["memoria"] / 2**20:.0f} MB.')
+    else:
+        print(f'LSI treinado com {ajustes}. Memória estimada: {configuracao["memoria"] / 2**20:.0f} MB. Memória usada no '
+              f'treinamento: {memoria_treino / 2**20:.0f} MB (pico do processo: {pico / 2**20:.0f} MB).')
+    return model
+
+def _testar_num_topicos(modelo, nums, arq_corpus, arq_dicionario, parametros, tipo_teste, pares, prefixo):
+    '''
+    Treina um modelo de tópicos e calcula a sua medida para as quantidades de tópicos informadas, dentro de um processo do
+    pool de testes. O corpus de treinamento é lido do arquivo gravado pelo processo principal. No LSI, o modelo é treinado
+    uma única vez com a maior quantidade de tópicos e as demais são medidas com o modelo truncado, pois os primeiros
+    vetores singulares da decomposição maior são os vetores da decomposição menor. O modelo treinado é salvo em arquivo
+    para ser carregado pelo processo principal.
+    Parâmetros:
+        modelo (str) --> Modelo a ser testado: "lda", "lsi" ou "doc2vec"
+        nums (tuple de int) --> Quantidades de tópicos. Só o LSI aceita mais de uma quantidade
+        arq_corpus (str) --> Arquivo com o corpus de treinamento: Matrix Market para "lda" e "lsi" e pickle para "doc2vec"
+        arq_dicionario (str) --> Arquivo pickle com o dicionário do corpus
+        parametros (dict) --> Parâmetros de treinamento dos modelos "lda", "lsi" e "doc2vec", tendo o nome do modelo como
+                chave
+        tipo_teste (str) --> Tipo de teste: "u_mass" ou "similaridade"
+        pares (list de tuple (int, int)) --> Posições das fichas de cada par de teste no corpus de treinamento
+        prefixo (str) --> Prefixo dos arquivos do modelo e do índice de similaridade
+    Retorno: tupla com as medidas calculadas para cada quantidade de tópicos e o arquivo do modelo treinado com a maior
+        quantidade (tuple (dict int:float, str))
+    '''
+    with open(arq_dicionario, 'rb') as f:
+        dicionario = pickle.load(f)
+    num_max = max(nums)
+    # Treina os modelo solicitado
+    if modelo == 'doc2vec':
+        with open(arq_corpus, 'rb') as f:
+            corpus_train = pickle.load(f)
+        model = Doc2Vec(vector_size=num_max
+                       ,workers=parametros['doc2vec']['workers']
+                       ,alpha=parametros['doc2vec']['alpha']
+                       ,min_alpha=parametros['doc2vec']['min_alpha'])
+        # Obtém o vocabulário do corpus para treinar o modelo Doc2Vec
+        model.build_vocab(corpus_train)
+        # Treina o modelo Doc2Vec
+        model.train(corpus_train, total_examples=model.corpus_count, epochs=model.epochs)
+    else:
+        corpus_train = MmCorpus(arq_corpus)
+        if modelo == 'lda': model = _treinar_lda(corpus_train, dicionario, num_max, parametros['lda'])
+        else:
+            configuracao = _configurar_lsi(parametros['lsi'], num_max, len(dicionario), corpus_train.num_docs
+                                          ,corpus_train.num_nnz / max(1, corpus_train.num_docs), obter_memoria_atual() or 0)
+            model = _treinar_lsi(corpus_train, dicionario, num_max, configuracao)
+    arq_modelo = f'{prefixo}.model'
+    model.save(arq_modelo)
+    medidas = {}
+    for num in sorted(nums, reverse=True):
+        model_num = truncar_lsi(model, num) if num < num_max else model
+        # Realiza o teste de coerência
+        if tipo_teste == 'u_mass':
+            cm = CoherenceModel(model=model_num, corpus=corpus_train, coherence='u_mass')
+            medidas[num] = cm.get_coherence()
+            continue
+        # Realiza o teste de similaridade
+        if modelo == 'doc2vec': corpus = Doc2VecCorpus(model_num)
+        else: corpus = model_num[corpus_train]
+        index = Similarity(output_prefix=f'{prefixo}_{num}.idx', corpus=corpus, num_features=num)
+        medidas[num] = pd.Series([1 / _obter_posicao_target(index, query, target)[0] for query, target in pares]).median()
+    return medidas, arq_modelo
+
+def truncar_lsi(model, num_topics):
+    '''
+    Obtém um modelo LSI com menos tópicos a partir de um modelo treinado, mantendo apenas os primeiros vetores singulares.
+    O modelo retornado é uma cópia rasa cujas matrizes da projeção são visões das matrizes do modelo original, sem cópia
+    dos dados.
+    Parâmetros:
+        model (LsiModel) --> Modelo LSI treinado
+        num_topics (int) --> Quantidade de tópicos do novo modelo, menor ou igual à do modelo treinado
+    Retorno: o modelo truncado (LsiModel)
+    '''
+    truncado = copy.copy(model)
+    truncado.projection = copy.copy(model.projection)
+    truncado.projection.u = model.projection.u[:, :num_topics]
+    truncado.projection.s = model.projection.s[:num_topics]
+    truncado.num_topics = min(num_topics, model.num_topics)
+    return truncado
 
 class Models:
     '''
@@ -30,7 +257,10 @@ class Models:
         self._modelos = {'tfidf': {}, 'tfidf_pivot': {}, 'lsi': {}, 'lda': {}, 'doc2vec': {}}
         self._exts = {'tfidf': 'bow2tfidf', 'tfidf_pivot': 'bow2tfidf_pivot', 'lsi': 'tfidf2lsi', 'lda': 'bow2lda', 'doc2vec': 'doc2vec'}
         self._shelf = f'models_{self.corpus._link_nome}'
-        self._arqs = {'modelos': {}, 'indices':{}}
+        self._arqs = {'modelos': {}, 'indices':{}, 'invertidos': {}, 'densos': {}, 'exatos': {}}
+        self._indices = {}
+        self._carregados = {}
+        self._versao = 0
         # Recupera as configurações anteriores
         self._iniciar_models()
 
@@ -51,18 +281,21 @@ class Models:
         if not os.path.isfile(self._arqs['modelos'][modelo]):
             print(f'O modelo "{modelo} não foi implementado ou montado."')
             return None
-        if modelo in ['tfidf', 'tfidf_pivot']: model = TfidfModel.load(self._arqs['modelos'][modelo])
-        elif modelo == 'lsi': model = LsiModel.load(self._arqs['modelos'][modelo])
-        elif modelo == 'lda': model = LdaModel.load(self._arqs['modelos'][modelo])
-        elif modelo == 'doc2vec': model = Doc2Vec.load(self._arqs['modelos'][modelo])
-        return model
+        return self._carregar_modelo(modelo)
 
     def __len__(self):
         return len(self._modelos)
 
     def ajustar_modelo(self, modelo, **kwargs):
         '''
-        Realiza os ajustes dos hiperparâmetros e pesos do modelo indicado.
+        Realiza os ajustes dos hiperparâmetros e pesos do modelo indicado. Nos modelos densos ("lsi", "lda" e "doc2vec"), o
+        parâmetro "quantizacao" ("float32", "float16", "int8" ou None) define o armazenamento do índice usado nas consultas
+        e "rerank" a quantidade das melhores fichas cuja similaridade é recalculada de forma exata. No modelo "lda", o
+        parâmetro "backend" escolhe entre o LdaModel ("lda") e o LdaMulticore ("multicore"), que usa "workers" processos,
+        e "chunksize", "passes" e "eval_every" são repassados ao treinamento. No modelo "lsi", "chunksize", "onepass",
+        "power_iters" e "extra_samples" são repassados ao treinamento e "memoria_max" (em bytes) ativa a escolha automática
+        de "chunksize", "power_iters" e "extra_samples" para que o treinamento caiba na memória. Os ajustes de
+        hiperparâmetros e do índice só têm efeito após gerar novamente o modelo.
         Retorno: None
         '''
         if modelo not in self._modelos:
@@ -72,76 +305,228 @@ class Models:
             if k not in self._modelos[modelo]:
                 print(f'O parâmetro "{k}" não faz parte do modelo "{modelo}".')
                 continue
+            if k == 'quantizacao' and v is not None and v not in IndiceDenso.TIPOS:
+                print(f'A quantização "{v}" não foi implementada. Use {IndiceDenso.TIPOS} ou None.')
+                continue
+            if k == 'backend' and v not in ['lda', 'multicore']:
+                print(f'O backend "{v}" do modelo "lda" não foi implementado. Use "lda" ou "multicore".')
+                continue
             self._modelos[modelo][k] = v
+        self._versao += 1
         self._salvar_models()
 
-    def gerar_modelo(self, modelo):
+    def assinatura(self, modelo, etapa):
+        '''
+        Calcula a impressão digital das entradas do treinamento ou da indexação do modelo. O treinamento depende das
+        assinaturas do dicionário e do corpus no formato BOW e dos hiperparâmetros do modelo (além do treinamento do "tfidf",
+        no caso do "lsi"). A indexação depende do treinamento e dos parâmetros do índice. Pesos, percentuais mínimos e
+        quantidade de workers não alteram o resultado e ficam de fora.
+        Parâmetros:
+            modelo (str) --> nome do modelo: "tfidf", "tfidf_pivot", "lsi", "lda" ou "doc2vec"
+            etapa (str) --> "treinar" ou "indexar"
+        Retorno: a impressão digital (str)
+        '''
+        parametros = self._modelos[modelo]
+        if etapa == 'indexar':
+            entradas = dict(treino=self.assinatura(modelo, 'treinar'), quantizacao=parametros.get('quantizacao')
+                           ,rerank=parametros.get('rerank'))
+        else:
+            entradas = dict(modelo=modelo, dicionario=self.corpus._assinatura_dicionario, bow=self.corpus._assinatura_bow
+                           ,parametros={k: v for k, v in parametros.items()
+                                        if k not in ['peso', 'min_per_sim', 'quantizacao', 'rerank', 'workers']})
+            if modelo == 'tfidf_pivot': entradas.update(num_docs=self.corpus.num_docs, num_tokens=self.corpus.num_tokens)
+            if modelo == 'lsi': entradas['tfidf'] = self.assinatura('tfidf', 'treinar')
+        return hashlib.sha1(json.dumps(entradas, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def assinatura_vizinhos(self):
+        '''
+        Retorna a assinatura que identifica os dados usados na tabela de vizinhos: a data de alteração dos arquivos dos
+        modelos e índices, os pesos e percentuais mínimos dos modelos e a quantidade de fichas do corpus. A tabela só é
+        usada nas consultas se tiver sido montada com a assinatura atual.
+        Retorno: dicionário com a assinatura
+        '''
+        arqs = [arq for tipo in ['modelos', 'indices', 'invertidos', 'densos'] for arq in self._arqs[tipo].values()]
+        return dict(arquivos=[os.path.getmtime(arq) if os.path.isfile(arq) else None for arq in arqs]
+                   ,modelos={modelo: [dados['peso'], dados['min_per_sim']] for modelo, dados in self._modelos.items()}
+                   ,num_fichas=self.corpus.num_fichas)
+
+    def atualizar(self, ids_fichas):
+        '''
+        Inclui fichas novas nos índices dos modelos já gerados, sem treiná-los novamente. Cada ficha é transformada pelo
+        modelo treinado, como um documento avulso, e acrescentada ao final do índice. No modelo "lsi", as fichas são
+        projetadas na base atual (fold-in), que não é alterada, para manter válidos os vetores já indexados.
+        Parâmetros:
+            ids_fichas (list de int) --> Ids das fichas novas, sequenciais a partir do tamanho atual dos índices
+        Retorno: lista com os modelos atualizados (list de str)
+        '''
+        ids_fichas = list(ids_fichas)
+        if not ids_fichas: return []
+        bows = [self.corpus._dao.obter_bow_id_ficha(id_ficha) for id_ficha in ids_fichas]
+        atualizados = []
+        for modelo in self._modelos:
+            if not os.path.isfile(self._arqs['modelos'][modelo]) or not os.path.isfile(self._arqs['indices'][modelo]): continue
+            index = Similarity.load(self._arqs['indices'][modelo])
+            # Desconsidera o modelo cujo índice já recebeu as fichas em uma atualização anterior
+            if len(index) == ids_fichas[-1] + 1:
+                atualizados.append(modelo)
+                continue
+            if len(index) != ids_fichas[0]:
+                print(f'O índice do modelo "{modelo}" tem {len(index)} fichas e não pode receber as fichas a partir do id '
+                      f'{ids_fichas[0]}. Gere novamente o modelo.')
+                continue
+            if modelo == 'doc2vec':
+                tokens = [self.corpus._dao.obter_tokens_id_ficha(id_ficha) for id_ficha in ids_fichas]
+                tokens = [[token for token, freq in dados.items() for i in range(freq)] for dados in tokens]
+            else: tokens = [None] * len(ids_fichas)
+            vetores = [self._vetorizar(modelo, bow, doc) for bow, doc in zip(bows, tokens)]
+            # Acrescenta os vetores aos índices invertido ou quantizado do modelo, se houver
+            for tipo, classe in [('invertidos', IndiceInvertido), ('densos', IndiceDenso)]:
+                arq_indice = self._arqs[tipo].get(modelo)
+                if not arq_indice or not os.path.isfile(arq_indice): continue
+                indice = classe.carregar(arq_indice)
+                if len(indice) == ids_fichas[-1] + 1: continue
+                for vetor in vetores:
+                    indice.adicionar(vetor)
+                indice.salvar(arq_indice)
+            index.add_documents(vetores)
+            index.save(self._arqs['indices'][modelo])
+            atualizados.append(modelo)
+        self._versao += 1
+        return atualizados
+
+    def carregar(self):
+        '''
+        Carrega em memória os modelos treinados e os seus índices de similaridade, para que as consultas seguintes não
+        precisem lê-los do disco.
+        Retorno: None
+        '''
+        for modelo in self._modelos:
+            if not os.path.isfile(self._arqs['modelos'][modelo]) or not os.path.isfile(self._arqs['indices'][modelo]): continue
+            self._carregar_modelo(modelo)
+            self._carregar_indice(modelo)
+
+    def estimar_memoria(self, modelo, etapa):
+        '''
+        Estima a memória, em bytes, usada no treinamento ou na indexação do modelo com o corpus atual.
+        Parâmetros:
+            modelo (str) --> nome do modelo: "tfidf", "tfidf_pivot", "lsi", "lda" ou "doc2vec"
+            etapa (str) --> "treinar" ou "indexar"
+        Retorno: a memória estimada (int)
+        '''
+        num_termos, num_docs = self.corpus.num_tokens, self.corpus.num_fichas
+        num_features = self._num_features(modelo)
+        if etapa == 'indexar':
+            # Cada shard da matriz de similaridade é montado em memória, além do índice invertido ou quantizado
+            if modelo in ['tfidf', 'tfidf_pivot']: return min(num_docs, 32768) * num_termos * 4 // 100 + num_docs * 1024
+            return (min(num_docs, 32768) + num_docs) * num_features * 4
+        if modelo in ['tfidf', 'tfidf_pivot']: return num_termos * 16
+        if modelo == 'lsi': return self._configuracao_lsi(num_features)['memoria']
+        return _estimar_memoria_topicos(modelo, num_features, num_termos, num_docs)
+
+    def gerar_modelo(self, modelo, forcar=False):
         '''
         Treina o modelo selecionado, salvando-o. Após, cria a matrix de similaridade para o corpus transformado.
         Parâmetros:
             modelo (str) --> nome do modelo: "tfidf", "tfidf_pivot", "lsi", "lda" ou "doc2vec"
+            forcar (boolean) --> Indica se o modelo é gerado mesmo que as suas entradas não tenham mudado (default: False)
         Retorno: None
         '''
-        # Verifica se o modelo foi implementado
+        with medir('treinar_modelo', corpus=self.corpus.nome, modelo=modelo):
+            treinado = self.treinar_modelo(modelo, forcar=forcar)
+        if not treinado: return
+        with medir('indexar_modelo', corpus=self.corpus.nome, modelo=modelo):
+            self.indexar_modelo(modelo, forcar=forcar)
+
+    def indexar_modelo(self, modelo, forcar=False):
+        '''
+        Cria a matriz de similaridade do corpus transformado pelo modelo já treinado e, na mesma passada do corpus, o índice
+        invertido dos modelos esparsos ou o índice quantizado dos modelos densos. A indexação é dispensada se o índice já
+        tiver sido criado com as mesmas entradas.
+        Parâmetros:
+            modelo (str) --> nome do modelo: "tfidf", "tfidf_pivot", "lsi", "lda" ou "doc2vec"
+            forcar (boolean) --> Indica se o índice é criado mesmo que as suas entradas não tenham mudado (default: False)
+        Retorno: True se o índice foi criado ou já estava atualizado ou False, caso contrário (boolean)
+        '''
         if modelo not in self._modelos:
             print(f'O modelo "{modelo}" não foi implementado.')
-            return
-        # Define os nomes dos arquivos
-        arq_model = os.path.join(self.corpus._pastas['modelos'], f'{self.corpus._link_nome}.{self._exts[modelo]}')
-        arq_index = os.path.join(self.corpus._pastas['indices'], f'{self.corpus._link_nome}_{modelo}.idx')
-        # Gera o modelo solicitado
-        if modelo == 'tfidf':
-            # Inicializa o modelo
-            corpus_train = self.corpus.corpus(tipo='bow')
-            num_features = self.corpus.num_tokens
-            model = TfidfModel(corpus=corpus_train
-                              ,id2word=self.corpus.dicionario())
-        elif modelo == 'tfidf_pivot':
-            # Inicializa o modelo
-            corpus_train = self.corpus.corpus(tipo='bow')
-            num_features = self.corpus.num_tokens
-            model = TfidfModel(corpus=corpus_train
-                              ,id2word=self.corpus.dicionario()
-                              ,smartirs='nfu'
-                              ,pivot = self.corpus.num_tokens / self.corpus.num_docs)
-        elif modelo == 'lda':
-            # Inicializa o modelo
-            corpus_train = self.corpus.corpus(tipo='bow')
-            num_features = self._modelos[modelo]['num_topics']
-            model = LdaModel(corpus=corpus_train
-                            ,id2word=self.corpus.dicionario()
-                            ,num_topics=num_features)
-        elif modelo == 'lsi':
-            # Inicia o modelo
-            corpus_train = self.corpus.corpus(tipo='tfidf')
-            num_features = self._modelos[modelo]['num_topics']
-            model = LsiModel(corpus=corpus_train
-                            ,id2word=self.corpus.dicionario()
-                            ,num_topics=num_features)
-        elif modelo == 'doc2vec':
-            # Instancia o modelo Doc2Vec
-            corpus_train = self.corpus.corpus(tipo='tagged')
-            num_features = self._modelos[modelo]['vector_size']
-            model = Doc2Vec(vector_size=num_features
-                           ,workers=mp.cpu_count()/2
-                           ,alpha=self._modelos[modelo]['alpha']
-                           ,min_alpha=self._modelos[modelo]['min_alpha'])
-            # Obtém o vocabulário do corpus para treinar o modelo Doc2Vec
-            model.build_vocab(corpus_train)
-            # Treina o modelo Doc2Vec
-            model.train(corpus_train, total_examples=model.corpus_count, epochs=model.epochs)
-        else:
-            print(f'O modelo "{modelo}" não foi implementado.')
-            return
-        # Salva o modelo treinado
-        model.save(self._arqs['modelos'][modelo])
+            return False
+        assinatura = self.assinatura(modelo, 'indexar')
+        if not forcar and self._verificar_assinatura(self._arqs['indices'][modelo], assinatura):
+            print(f'O índice do modelo "{modelo}" do corpus "{self.corpus.nome}" já está atualizado.')
+            return True
+        model = self[modelo]
+        if model is None: return False
+        num_features = self._num_features(modelo)
         # Define o corpus para a matriz de similaridade
         if modelo == 'doc2vec': corpus = Doc2VecCorpus(model)
-        else: corpus = model[corpus_train]
+        elif modelo == 'lsi': corpus = model[self.corpus.corpus(tipo='tfidf')]
+        else: corpus = model[self.corpus.corpus(tipo='bow')]
+        # Monta, na mesma passada do corpus, o índice invertido dos modelos esparsos ou o índice quantizado dos modelos densos
+        indice = None
+        if modelo in self._arqs['invertidos']:
+            indice, arq_indice = IndiceInvertido(num_features), self._arqs['invertidos'][modelo]
+        elif modelo in self._arqs['densos']:
+            arq_indice = self._arqs['densos'][modelo]
+            quantizacao = self._modelos[modelo]['quantizacao']
+            if quantizacao:
+                arq_exatos = self._arqs['exatos'][modelo] if self._modelos[modelo]['rerank'] else None
+                indice = IndiceDenso(num_features, quantizacao=quantizacao, arq_exatos=arq_exatos)
+            # Remove o índice quantizado anterior para que as consultas não usem vetores desatualizados
+            elif os.path.isfile(arq_indice): os.remove(arq_indice)
+        if indice is not None: corpus = espelhar_corpus(corpus, indice)
         # Gera o index a partir do modelo serializado
         index = Similarity(output_prefix=self._arqs['indices'][modelo], corpus=corpus, num_features=num_features)
         # Salva o índice
         index.save(self._arqs['indices'][modelo])
+        if indice is not None: indice.salvar(arq_indice)
+        self._gravar_assinatura(self._arqs['indices'][modelo], assinatura)
+        self._versao += 1
+        return True
+
+    def melhores(self, id_ficha_query, k):
+        '''
+        Obtém as k fichas mais semelhantes à ficha indicada sem calcular a similaridade com todas as fichas do corpus. Em
+        cada modelo, as melhores fichas são obtidas pelo executor de consultas (ou, nos índices densos, das similaridades
+        brutas em cache) e as similaridades das fichas candidatas são calculadas em todos os modelos. O resultado só é
+        aceito se nenhuma ficha fora das candidatas puder alcançar o percentual geral da k-ésima, considerando que, em cada
+        modelo, ela não supera a similaridade da última ficha obtida; caso contrário, a busca é repetida com mais fichas por
+        modelo. A primeira busca já obtém 4k fichas por modelo, pois o custo da varredura quase não depende de k.
+        Parâmetros:
+            id_ficha_query (int) --> Identificador da ficha que servirá de comparação para buscar as semelhantes
+            k (int) --> Quantidade de fichas a serem retornadas
+        Retorno: um Pandas DataFrame na ordem decrescente de semelhança das fichas, no mesmo formato de "semelhantes", ou
+            None se os índices ou os parâmetros dos modelos não permitirem a busca ou se o limite de fichas candidatas for
+            atingido. A coluna "ordem" de cada modelo se refere à ordem entre as fichas candidatas
+        '''
+        modelos = list(self._modelos)
+        if k <= 0 or not modelos: return None
+        # O limite das fichas não obtidas só vale com pesos não negativos e com um percentual mínimo que descarte as fichas
+        # sem similaridade. A reordenação exata dos índices densos exige as similaridades de todas as fichas
+        if any(self._modelos[modelo]['peso'] < 0 or self._modelos[modelo]['min_per_sim'] <= 0
+               or self._modelos[modelo].get('rerank', 0) for modelo in modelos): return None
+        indices = [self._carregar_indice(modelo) for modelo in modelos]
+        if not all(isinstance(index, (IndiceInvertido, IndiceDenso)) for index in indices): return None
+        executor = obter_executor()
+        num_fichas = min(len(index) for index in indices)
+        peso_total = sum(self._modelos[modelo]['peso'] for modelo in modelos)
+        n = 4 * k
+        with medir('melhores', corpus=self.corpus.nome):
+            while True:
+                parciais = executor.mapear(lambda par: self._melhores_modelo(par[0], par[1], id_ficha_query, n)
+                                          ,list(zip(modelos, indices)))
+                # Limite do percentual geral das fichas que não foram obtidas em nenhum modelo
+                limite = 0
+                for modelo, (ids, sims) in zip(modelos, parciais):
+                    if len(ids) == n and sims[-1] >= self._modelos[modelo]['min_per_sim']:
+                        limite += round(float(sims[-1]) * 100, 2) * self._modelos[modelo]['peso']
+                limite = round(limite / peso_total, 2)
+                ids = np.unique(np.concatenate([ids for ids, _ in parciais]))
+                sims_modelos = executor.mapear(lambda index: executor.similaridades_ids(index, id_ficha_query, ids), indices)
+                resultado = self._montar_resultado(sims_modelos, id_ficha_query, False, ids=ids)
+                if not limite or (len(resultado) >= k and resultado[('geral', 'per_sim')].iloc[k-1] >= limite):
+                    return resultado.head(k)
+                if n >= num_fichas // 4: return None
+                n *= 4
 
     def parametros(self):
         '''
@@ -158,58 +543,116 @@ class Models:
             id_ficha_query (int) --> Identificador da ficha que servirá de comparação para buscar as semelhantes
         Retorno: um Pandas DataFrame na ordem decrescente de semelhança das fichas
         '''
-        primeiro = True
-        for modelo in self._modelos:
-            # Obtém o peso do modelo
-            peso = self._modelos[modelo]['peso']
-            # Obtém a matriz de similaridade do modelo
-            index = Similarity.load(self._arqs['indices'][modelo])
-            sims = index.similarity_by_id(id_ficha_query)
-            # Cria um dicionário com o resultado da query para o modelo
-            sims_dict = {'ficha': [], 'per_sim': [], 'peso': []}
-            for id_ficha, per_sim in enumerate(sims):
-                if id_ficha == id_ficha_query: continue
-                if not teste and per_sim < self._modelos[modelo]['min_per_sim']: continue
-                sims_dict['ficha'].append(id_ficha)
-                sims_dict['per_sim'].append(round(per_sim * 100, 2))
-                sims_dict['peso'].append(peso)
-            # Monta o DataFrame com o resultado da query
-            # Se não for o primeiro modelo, junta com o resultado anterior
-            if primeiro:
-                resultado = pd.DataFrame(data=sims_dict)
-                resultado.set_index('ficha', inplace=True)
-                resultado.columns = pd.MultiIndex.from_product([[modelo], ['per_sim', 'peso']])
-                resultado.sort_values(by=(modelo, 'per_sim'), ascending=False, inplace=True)
-                resultado[(modelo, 'ordem')] = [i for i in range(1, resultado.shape[0]+1)]
-                resultado = resultado.astype({(modelo, 'ordem'): 'int64'})
-                primeiro = False
-            else:
-                parcial = pd.DataFrame(data=sims_dict)
-                parcial.set_index('ficha', inplace=True)
-                parcial.columns = pd.MultiIndex.from_product([[modelo], ['per_sim', 'peso']])
-                parcial.sort_values(by=(modelo, 'per_sim'), ascending=False, inplace=True)
-                parcial[(modelo, 'ordem')] = [i for i in range(1, parcial.shape[0]+1)]
-                parcial = parcial.astype({(modelo, 'ordem'): 'int64'})
-                resultado = resultado.join(parcial, how='outer')
-        # Preenches com zeros os valores não encontrados em cada modelo
-        resultado.fillna(0, inplace=True)
-        # Calcula a probabilidade geral com base no peso de cada modelo e ordena por esse valor em ordem decrescente
-        geral = ('geral', 'per_sim')
-        resultado[geral] = [0 for i in range(resultado.shape[0])]
-        peso_total = 0
-        for modelo in self._modelos:
-            resultado[geral] = resultado[geral] + (resultado[(modelo, 'per_sim')] * resultado[(modelo, 'peso')])
-            peso_total += self._modelos[modelo]['peso']
-        resultado[geral] = round(resultado[geral] / peso_total, 2)
-        resultado.sort_values(by=geral, ascending=False, inplace=True)
-        resultado[('geral', 'ordem')] = [i for i in range(1, resultado.shape[0]+1)]
+        with medir('similaridades', corpus=self.corpus.nome):
+            sims_modelos = self.similaridades(id_ficha_query)
+        with medir('resultado', corpus=self.corpus.nome):
+            return self._montar_resultado(sims_modelos, id_ficha_query, teste)
+
+    def semelhantes_documento(self, bow, tokens, teste=False):
+        '''
+        Pesquisa no corpus quais fichas tem características mais semelhantes às de um documento que não faz parte do corpus.
+        O documento é transformado por cada modelo treinado e comparado com os índices existentes, sem alterá-los.
+        Parâmetros:
+            bow (list de tuple (int, int)) --> Documento no formato BOW do dicionário do corpus
+            tokens (list de string) --> Tokens do documento, usados pelo modelo Doc2Vec
+        Retorno: um Pandas DataFrame na ordem decrescente de semelhança das fichas
+        '''
+        modelos = list(self._modelos)
+        with medir('similaridades', corpus=self.corpus.nome):
+            sims_modelos = obter_executor().mapear(lambda modelo: self._similaridades(modelo, (bow, tokens)), modelos)
+        with medir('resultado', corpus=self.corpus.nome):
+            return self._montar_resultado(sims_modelos, None, teste)
+
+    def semelhantes_ids(self, id_ficha_query, ids):
+        '''
+        Pesquisa a semelhança da ficha indicada apenas com as fichas informadas. Se os índices de todos os modelos permitirem
+        o acesso direto aos vetores das fichas, só as similaridades dessas fichas são calculadas; senão, elas são obtidas da
+        pesquisa em todas as fichas.
+        Parâmetros:
+            id_ficha_query (int) --> Identificador da ficha que servirá de comparação
+            ids (iterável de int) --> Identificadores das fichas a serem comparadas
+        Retorno: um Pandas DataFrame na ordem decrescente de semelhança, no mesmo formato de "semelhantes", apenas com as
+            fichas informadas. A coluna "ordem" de cada modelo se refere à ordem entre essas fichas
+        '''
+        ids = np.unique(np.asarray(list(ids), dtype=np.int64))
+        modelos = list(self._modelos)
+        indices = [self._carregar_indice(modelo) for modelo in modelos]
+        # A reordenação exata dos índices densos exige as similaridades de todas as fichas
+        if (not modelos or any(self._modelos[modelo].get('rerank', 0) for modelo in modelos)
+                or not all(isinstance(index, (IndiceInvertido, IndiceDenso)) for index in indices)):
+            resultado = self.semelhantes(id_ficha_query)
+            return resultado[resultado.index.isin(ids)]
+        # As fichas incluídas no corpus depois da indexação não fazem parte do resultado, como na pesquisa completa
+        ids = ids[ids < min(len(index) for index in indices)]
+        executor = obter_executor()
+        with medir('similaridades', corpus=self.corpus.nome):
+            sims_modelos = executor.mapear(lambda index: executor.similaridades_ids(index, id_ficha_query, ids), indices)
+        with medir('resultado', corpus=self.corpus.nome):
+            return self._montar_resultado(sims_modelos, id_ficha_query, False, ids=ids)
+
+    def semelhantes_lote(self, consultas, teste=False):
+        '''
+        Pesquisa as fichas mais semelhantes para um lote de consultas. Em cada modelo, as similaridades de todas as consultas
+        são calculadas de uma só vez, na forma de uma matriz.
+        Parâmetros:
+            consultas (list) --> Consultas do lote. Cada consulta é o id de uma ficha do corpus (int) ou uma tupla com o
+                    documento avulso no formato BOW e os seus tokens (tuple (list de tuple (int, int), list de string))
+        Retorno: lista de Pandas DataFrames na ordem decrescente de semelhança das fichas, um para cada consulta
+        '''
+        modelos = list(self._modelos)
+        def similaridades_modelo(modelo):
+            vetores = [consulta if isinstance(consulta, (int, np.integer)) else self._vetorizar(modelo, *consulta)
+                       for consulta in consultas]
+            index = self._carregar_indice(modelo)
+            return obter_executor().similaridades_lote(index, vetores, rerank=self._modelos[modelo].get('rerank', 0))
+        with medir('similaridades', corpus=self.corpus.nome):
+            sims_modelos = obter_executor().mapear(similaridades_modelo, modelos)
+        with medir('resultado', corpus=self.corpus.nome):
+            return [self._montar_resultado([sims[i] for sims in sims_modelos]
+                                          ,consulta if isinstance(consulta, (int, np.integer)) else None, teste)
+                    for i, consulta in enumerate(consultas)]
+
+    def semelhantes_vizinhos(self, id_ficha_query, k):
+        '''
+        Obtém as k fichas mais semelhantes à ficha indicada a partir da tabela de vizinhos pré-calculada, sem calcular
+        similaridades. Só usa a tabela se ela estiver completa, atualizada e tiver ao menos k vizinhos por ficha.
+        Parâmetros:
+            id_ficha_query (int) --> Identificador da ficha que servirá de comparação para buscar as semelhantes
+            k (int) --> Quantidade de fichas a serem retornadas
+        Retorno: um Pandas DataFrame na ordem decrescente de semelhança das fichas, no mesmo formato de "semelhantes", ou
+            None se a tabela não puder ser usada. A coluna "ordem" de cada modelo se refere à ordem entre as k fichas
+        '''
+        if not self._vizinhos.atual(self.assinatura_vizinhos()) or k > self._vizinhos.meta['k']: return None
+        with medir('vizinhos', corpus=self.corpus.nome):
+            ids, sims = self._vizinhos.vizinhos(id_ficha_query)
+        ids, sims = ids[:k], np.round(sims[:k].astype(np.float64) * 100, 2)
+        resultado = pd.DataFrame(index=pd.Index(ids, name='ficha'))
+        for coluna, modelo in enumerate(self._vizinhos.meta['colunas'][:-1]):
+            resultado[(modelo, 'per_sim')] = sims[:, coluna]
+            resultado[(modelo, 'peso')] = self._modelos[modelo]['peso'] if modelo in self._modelos else 0
+            resultado[(modelo, 'ordem')] = np.argsort(np.argsort(-sims[:, coluna], kind='stable'), kind='stable') + 1
+        resultado[('geral', 'per_sim')] = sims[:, -1]
+        resultado[('geral', 'ordem')] = np.arange(1, len(ids) + 1)
+        resultado.columns = pd.MultiIndex.from_tuples(resultado.columns)
         return resultado
 
+    def similaridades(self, id_ficha_query):
+        '''
+        Obtém concorrentemente as similaridades brutas da ficha com todas as fichas do corpus em cada modelo, sem aplicar
+        pesos e percentuais mínimos. Os vetores vêm do cache das similaridades sempre que possível.
+        Parâmetros:
+            id_ficha_query (int) --> Identificador da ficha que servirá de comparação
+        Retorno: lista de vetores de similaridade (list de ndarray), somente para leitura, na ordem dos modelos
+        '''
+        return obter_executor().mapear(lambda modelo: self._similaridades(modelo, id_ficha_query), list(self._modelos))
+
     def testar_num_topics(self, modelo, num_topicos=[20, 50, 100, 200, 300, 400, 500, 1000, 1500]
-                         ,perc_fichas=0.2, vetor_testes=None, tipo_teste='similaridade'):
+                         ,perc_fichas=0.2, vetor_testes=None, tipo_teste='similaridade', num_processos=None
+                         ,memoria_max=None):
         '''
         Testa a coerência dos modelos gerados por tópicos para uma lista de quantidade de tópicos para encontrar
-        o melhor número de tópicos para o modelo com relação ao corpus.
+        o melhor número de tópicos para o modelo com relação ao corpus. Os treinamentos e as medidas de cada quantidade de
+        tópicos são independentes e executados em um pool de processos.
         Parâmetros:
             modelo (str) --> Modelo a ser testado: "lda", "lsi" ou "doc2vec".
             num_topicos (list de int) --> Lista de números de tópicos a serem testados
@@ -218,94 +661,18 @@ class Models:
             vetor_teste (list de tuple) --> Lista de pares de fichas para testes de similaridade. É ignorado se o teste
                 é o "u_mass" (default: None)
             tipo_testes (str) --> Tipo de teste: "u_mass" ou "similaridade" (default: "similaridade")
+            num_processos (int) --> Quantidade máxima de treinamentos simultâneos. Se None, usa a quantidade de CPUs
+                    (default: None)
+            memoria_max (int) --> Memória máxima estimada, em bytes, da soma dos treinamentos simultâneos. Um treinamento
+                    que sozinho excede o limite é executado isoladamente. Se None, não limita a memória (default: None)
         Retorno: um dicionário de dicionários. A chave do dicionário principal é o número de tópicos e, para cada número de
             tópicos, há outro dicionário com as seguintes chaves:
                 "medida" --> Valor de coerência calculado para o modelo com aquele número de tópicos.
                 "modelo" --> O modelo gerado para aquele número de tópicos
         '''
-        # Verifica se o teste para o modelo foi implantado
-        if modelo not in ['lda', 'lsi', 'doc2vec']:
-            print(f'O modelo {modelo} ou não é de tópico ou não foi implantado.')
-            return
-        if tipo_teste not in ['u_mass', 'similaridade']:
-            print(f'O tipo de teste {tipo_teste} não foi implementado.')
-            return
-        if modelo == 'doc2vec' and tipo_teste == 'u_mass':
-            print('O teste de coerência com u_mass não pode ser usado para o modelo doc2vec.')
-            return
-        # Iniciando as variáveis para os testes
-        resultado = {}
-        arq_index = os.path.join(self.corpus._pastas['indices'], f'{self.corpus._link_nome}_testes.idx')
-        if vetor_testes:
-            flat = list(zip(*vetor_testes))
-            fichas_incluir = set(flat[0])
-            fichas_incluir.update(flat[1])
-        else: fichas_incluir = None
-        # Define os corpus de treinamento e o corpus parcial
-        if modelo == 'lsi':
-            bow = self.corpus.corpus(tipo='bow')
-            corpus_parcial = bow.fatiar(perc_fichas=perc_fichas, incluir=fichas_incluir)
-            model_tfidf = self['tfidf'] or TfidfModel(corpus=corpus_parcial, id2word=self.corpus.dicionario())
-            corpus_train = model_tfidf[corpus_parcial]
-        elif modelo == 'lda':
-            bow = self.corpus.corpus(tipo='bow')
-            corpus_parcial = corpus_train = bow.fatiar(perc_fichas=perc_fichas, incluir=fichas_incluir)
-        elif modelo == 'doc2vec':
-            corpus_tagged = self.corpus.corpus(tipo='tagged')
-            corpus_parcial = corpus_train = corpus_tagged.fatiar(perc_fichas=perc_fichas, incluir=fichas_incluir)
-        # Obtém a relação dos ids_fichas do corpus parcial
-        if fichas_incluir: ids_fichas = corpus_parcial.fichas()
-        else: ids_fichas = list(range(len(corpus_parcial)))
-        # Faz o teste para cada quantidade de tópicos
-        for num in tqdm(num_topicos):
-            print(f'Criando modelo "{modelo}" para num_topics={num}')
-            # Treina os modelo solicitado
-            if modelo == 'lda':
-                model = LdaModel(corpus=corpus_train
-                                ,id2word=self.corpus.dicionario()
-                                ,num_topics=num)
-            elif modelo == 'lsi':
-                model = LsiModel(corpus=corpus_train
-                                ,id2word=self.corpus.dicionario()
-                                ,num_topics=num)
-            elif modelo == 'doc2vec':
-                model = Doc2Vec(vector_size=num
-                               ,workers=mp.cpu_count()/2
-                               ,alpha=self._modelos[modelo]['alpha']
-                               ,min_alpha=self._modelos[modelo]['min_alpha'])
-                # Obtém o vocabulário do corpus para treinar o modelo Doc2Vec
-                model.build_vocab(corpus_train)
-                # Treina o modelo Doc2Vec
-                model.train(corpus_train, total_examples=model.corpus_count, epochs=model.epochs)
-            # Salva o modelo construído para o número de tópicos da iteração
-            resultado[num] = {'modelo': model}
-            # Realiza o teste de coerência
-            if tipo_teste == 'u_mass':
-                # Calcula a coerência do modelo para o número de tópicos setado
-                print(f'Calculando o score de coerência do modelo "{modelo}" para num_topics={num}')
-                cm = CoherenceModel(model=model, corpus=corpus_train, coherence='u_mass')
-                resultado[num]['medida'] = cm.get_coherence()
-                print(f'Score u_mass = {resultado[num]["medida"]}')
-            # Realiza o teste de similaridade
-            elif tipo_teste == 'similaridade':
-                # Define o corpus para a matriz de similaridade
-                if modelo == 'doc2vec': corpus = Doc2VecCorpus(model)
-                else: corpus = model[corpus_train]
-                # Calcula a similaridade do modelo para o número de tópicos setado
-                print(f'Calculando o score de similaridade do modelo "{modelo}" para num_topics={num}')
-                index = Similarity(output_prefix=arq_index, corpus=corpus, num_features=num)
-                medidas = []
-                for ficha_query, ficha_target in vetor_testes:
-                    id_query = self.corpus.ficha2id(ficha_query)
-                    query = ids_fichas.index(id_query)
-                    id_target = self.corpus.ficha2id(ficha_target)
-                    target = ids_fichas.index(id_target)
-                    posicao, _ = self._obter_posicao_target(index, query, target)
-                    medidas.append(1 / posicao)
-                valores = pd.Series(medidas)
-                resultado[num]['medida'] = valores.median()
-                print(f'Score similaridade = {resultado[num]["medida"]}')
-        return resultado
+        resultado = self._testar_topicos([modelo], num_topicos, perc_fichas, vetor_testes, tipo_teste, num_processos
+                                        ,memoria_max)
+        return resultado.get(modelo) if resultado else None
 
     def testar_modelo(self, modelo, vetor_testes, sucesso=100):
         '''
@@ -333,7 +700,7 @@ class Models:
             resultados['target'].append(target)
             id_query = self.corpus.ficha2id(query)
             id_target = self.corpus.ficha2id(target)
-            posicao, per_sim = self._obter_posicao_target(index, id_query, id_target)
+            posicao, per_sim = _obter_posicao_target(index, id_query, id_target)
             resultados['ordem'].append(posicao)
             resultados['per_sim'].append(per_sim)
             resultados['sucesso'].append(posicao <= sucesso)
@@ -346,6 +713,178 @@ class Models:
         '''
         return list(self._modelos.keys())
 
+    def treinar_modelo(self, modelo, forcar=False):
+        '''
+        Treina o modelo selecionado com o corpus atual e o salva, sem criar a matriz de similaridade. O treinamento é
+        dispensado se o modelo salvo tiver sido treinado com as mesmas entradas.
+        Parâmetros:
+            modelo (str) --> nome do modelo: "tfidf", "tfidf_pivot", "lsi", "lda" ou "doc2vec"
+            forcar (boolean) --> Indica se o modelo é treinado mesmo que as suas entradas não tenham mudado (default: False)
+        Retorno: True se o modelo foi treinado ou já estava atualizado ou False, caso contrário (boolean)
+        '''
+        num_features = self._num_features(modelo) if modelo in self._modelos else None
+        assinatura = self.assinatura(modelo, 'treinar') if modelo in self._modelos else None
+        if not forcar and assinatura and self._verificar_assinatura(self._arqs['modelos'][modelo], assinatura):
+            print(f'O modelo "{modelo}" do corpus "{self.corpus.nome}" já está treinado com as entradas atuais.')
+            return True
+        # Gera o modelo solicitado
+        if modelo == 'tfidf':
+            # Inicializa o modelo
+            model = TfidfModel(corpus=self.corpus.corpus(tipo='bow')
+                              ,id2word=self.corpus.dicionario())
+        elif modelo == 'tfidf_pivot':
+            # Inicializa o modelo
+            model = TfidfModel(corpus=self.corpus.corpus(tipo='bow')
+                              ,id2word=self.corpus.dicionario()
+                              ,smartirs='nfu'
+                              ,pivot = self.corpus.num_tokens / self.corpus.num_docs)
+        elif modelo == 'lda':
+            # Inicializa o modelo
+            model = _treinar_lda(self.corpus.corpus(tipo='bow'), self.corpus.dicionario(), num_features, self._modelos[modelo])
+        elif modelo == 'lsi':
+            # Inicia o modelo
+            corpus_train = self.corpus.corpus(tipo='tfidf')
+            if corpus_train is None: return False
+            configuracao = self._configuracao_lsi(num_features, memoria_base=obter_memoria_atual() or 0)
+            model = _treinar_lsi(corpus_train, self.corpus.dicionario(), num_features, configuracao)
+        elif modelo == 'doc2vec':
+            # Instancia o modelo Doc2Vec
+            corpus_train = self.corpus.corpus(tipo='tagged')
+            model = Doc2Vec(vector_size=num_features
+                           ,workers=self._modelos[modelo]['workers'] or max(1, mp.cpu_count() // 2)
+                           ,alpha=self._modelos[modelo]['alpha']
+                           ,min_alpha=self._modelos[modelo]['min_alpha'])
+            # Obtém o vocabulário do corpus para treinar o modelo Doc2Vec
+            model.build_vocab(corpus_train)
+            # Treina o modelo Doc2Vec
+            model.train(corpus_train, total_examples=model.corpus_count, epochs=model.epochs)
+        else:
+            print(f'O modelo "{modelo}" não foi implementado.')
+            return False
+        # Salva o modelo treinado
+        model.save(self._arqs['modelos'][modelo])
+        self._gravar_assinatura(self._arqs['modelos'][modelo], assinatura)
+        self._versao += 1
+        return True
+
+    def versao(self):
+        '''
+        Retorna um identificador da versão atual dos modelos, que muda quando os parâmetros dos modelos são ajustados ou
+        quando os arquivos dos modelos e dos índices são alterados, inclusive por outro processo.
+        Retorno: tupla que identifica a versão dos modelos
+        '''
+        arqs = [arq for tipo in ['modelos', 'indices', 'invertidos', 'densos'] for arq in self._arqs[tipo].values()]
+        arqs.append(f'{self._arqs["vizinhos"]}.json')
+        return (self._versao, *[os.path.getmtime(arq) if os.path.isfile(arq) else None for arq in arqs])
+
+    def vizinhos(self, ids_fichas, k):
+        '''
+        Calcula as k fichas mais semelhantes a cada ficha de um bloco, com a mesma combinação dos modelos de "semelhantes"
+        (percentual mínimo de cada modelo e média ponderada pelos pesos). As similaridades do bloco são calculadas de uma só
+        vez em cada modelo, na forma de uma matriz.
+        Parâmetros:
+            ids_fichas (list de int) --> Ids das fichas do bloco
+            k (int) --> Quantidade de vizinhos de cada ficha
+        Retorno: uma tupla com os ids dos vizinhos (ndarray de int32, fichas x k, com -1 nas posições vazias) e as suas
+            similaridades (ndarray de float32, fichas x k x (modelos + 1)), sendo a última coluna a similaridade geral
+        '''
+        modelos = list(self._modelos)
+        ids_fichas = np.asarray(ids_fichas, dtype=np.int64)
+        linhas = np.arange(len(ids_fichas))
+        peso_total = sum(self._modelos[modelo]['peso'] for modelo in modelos)
+        geral, algum, sims_modelos = None, None, []
+        for modelo in modelos:
+            index = self._carregar_indice(modelo)
+            sims = obter_executor().similaridades_lote(index, list(ids_fichas), rerank=self._modelos[modelo].get('rerank', 0))
+            # Aplica o percentual mínimo do modelo, como em "semelhantes"
+            validas = sims >= self._modelos[modelo]['min_per_sim']
+            sims = np.where(validas, sims, 0).astype(np.float32)
+            if geral is None: geral, algum = np.zeros_like(sims), np.zeros(sims.shape, dtype=bool)
+            geral += sims * self._modelos[modelo]['peso']
+            algum |= validas
+            sims_modelos.append(sims.astype(np.float16))
+        geral /= peso_total
+        # Desconsidera a própria ficha e as fichas que não alcançaram o percentual mínimo em nenhum modelo
+        algum[linhas, ids_fichas] = False
+        geral[~algum] = -np.inf
+        k_efetivo = min(k, geral.shape[1])
+        melhores = np.argpartition(-geral, k_efetivo - 1, axis=1)[:, :k_efetivo]
+        ordem = np.argsort(-geral[linhas[:, None], melhores], axis=1)
+        melhores = melhores[linhas[:, None], ordem]
+        ids = np.full((len(ids_fichas), k), -1, dtype=np.int32)
+        sims = np.zeros((len(ids_fichas), k, len(modelos) + 1), dtype=np.float32)
+        validos = np.isfinite(geral[linhas[:, None], melhores])
+        ids[:, :k_efetivo] = np.where(validos, melhores, -1)
+        for coluna, sims_modelo in enumerate(sims_modelos + [geral]):
+            sims[:, :k_efetivo, coluna] = np.where(validos, sims_modelo[linhas[:, None], melhores], 0)
+        return ids, sims
+
+    def _carregar_indice(self, modelo):
+        '''
+        Carrega o índice de similaridade do modelo, mantendo-o em memória enquanto o arquivo do índice não for alterado. Dá
+        preferência ao índice invertido, nos modelos esparsos, e ao índice quantizado, nos modelos densos, se houver.
+        Parâmetros:
+            modelo (str) --> Nome do modelo
+        Retorno: o índice do modelo (IndiceInvertido, IndiceDenso ou Similarity)
+        '''
+        classe, arq = Similarity, self._arqs['indices'][modelo]
+        for tipo, classe_tipo in [('invertidos', IndiceInvertido), ('densos', IndiceDenso)]:
+            arq_tipo = self._arqs[tipo].get(modelo)
+            if arq_tipo and os.path.isfile(arq_tipo): classe, arq = classe_tipo, arq_tipo
+        versao = (arq, os.path.getmtime(arq))
+        if modelo in self._indices and self._indices[modelo][0] == versao: return self._indices[modelo][1]
+        index = classe.load(arq) if classe is Similarity else classe.carregar(arq)
+        # Os índices guardam o endereço dos seus arquivos auxiliares, que é atualizado se eles foram copiados para outra
+        # pasta, como nas versões publicadas do corpus
+        if classe is Similarity:
+            index.output_prefix = arq
+            index.check_moved()
+            # Descarrega no disco os documentos ainda não incluídos em um shard, o que não precisa ser repetido nas consultas
+            index.close_shard()
+        elif classe is IndiceDenso and index._arq_exatos:
+            index._arq_exatos = os.path.join(os.path.dirname(arq), os.path.basename(index._arq_exatos))
+        self._indices[modelo] = (versao, index)
+        return index
+
+    def _carregar_modelo(self, modelo):
+        '''
+        Carrega o modelo treinado, mantendo-o em memória enquanto o arquivo do modelo não for alterado.
+        Parâmetros:
+            modelo (str) --> Nome do modelo
+        Retorno: o modelo treinado (TfidfModel, LsiModel, LdaModel ou Doc2Vec)
+        '''
+        arq = self._arqs['modelos'][modelo]
+        versao = os.path.getmtime(arq)
+        if modelo in self._carregados and self._carregados[modelo][0] == versao: return self._carregados[modelo][1]
+        if modelo in ['tfidf', 'tfidf_pivot']: model = TfidfModel.load(arq)
+        elif modelo == 'lsi': model = LsiModel.load(arq)
+        elif modelo == 'lda': model = LdaModel.load(arq)
+        elif modelo == 'doc2vec': model = Doc2Vec.load(arq)
+        self._carregados[modelo] = (versao, model)
+        return model
+
+    def _configuracao_lsi(self, num_topicos, memoria_base=0):
+        '''
+        Obtém a configuração de treinamento do modelo "lsi" para o corpus atual (ver _configurar_lsi).
+        Parâmetros:
+            num_topicos (int) --> Quantidade de tópicos
+            memoria_base (int) --> Memória, em bytes, já ocupada pelo processo que fará o treinamento (default: 0)
+        Retorno: dicionário com a configuração de treinamento
+        '''
+        return _configurar_lsi(self._modelos['lsi'], num_topicos, self.corpus.num_tokens, self.corpus.num_fichas
+                              ,self.corpus.avg_tokens_ficha, memoria_base)
+
+    def _gravar_assinatura(self, arq, assinatura):
+        '''
+        Grava a impressão digital das entradas ao lado do arquivo gerado com elas.
+        Parâmetros:
+            arq (str) --> Arquivo do modelo ou do índice
+            assinatura (str) --> Impressão digital das entradas
+        Retorno: None
+        '''
+        with open(f'{arq}.fp', 'w') as f:
+            json.dump({'assinatura': assinatura}, f)
+
     def _iniciar_models(self):
         '''
         Faz as configurações iniciais do objeto e recupera os dados anteriormente salvos
@@ -356,19 +895,45 @@ class Models:
             self._modelos[modelo] = {'peso': 1.0, 'min_per_sim': 0.4}
             if modelo in ['lsi', 'lda']:
                 self._modelos[modelo]['num_topics'] = 300
+            if modelo == 'lsi':
+                self._modelos[modelo]['chunksize'] = 20000
+                self._modelos[modelo]['onepass'] = True
+                self._modelos[modelo]['power_iters'] = 2
+                self._modelos[modelo]['extra_samples'] = 100
+                self._modelos[modelo]['memoria_max'] = None
+            if modelo == 'lda':
+                self._modelos[modelo]['backend'] = 'lda'
+                self._modelos[modelo]['workers'] = None
+                self._modelos[modelo]['chunksize'] = 2000
+                self._modelos[modelo]['passes'] = 1
+                self._modelos[modelo]['eval_every'] = None
             if modelo == 'doc2vec':
                 self._modelos[modelo]['vector_size'] = 300
                 self._modelos[modelo]['alpha'] = 0.055
                 self._modelos[modelo]['min_alpha'] = 0.005
+                self._modelos[modelo]['workers'] = None
+            if modelo in ['lsi', 'lda', 'doc2vec']:
+                self._modelos[modelo]['quantizacao'] = None
+                self._modelos[modelo]['rerank'] = 0
         # Montando o dicionário com os endereços dos arquivos dos modelos
         for modelo, ext in self._exts.items():
             self._arqs['modelos'][modelo] = os.path.join(self.corpus._pastas['modelos'],
                                                          f'{self.corpus._link_nome}.{ext}')
             self._arqs['indices'][modelo] = os.path.join(self.corpus._pastas['indices'],
                                                          f'{self.corpus._link_nome}_{modelo}.idx')
+            if modelo in ['tfidf', 'tfidf_pivot']:
+                self._arqs['invertidos'][modelo] = os.path.join(self.corpus._pastas['indices'],
+                                                                f'{self.corpus._link_nome}_{modelo}.inv.npz')
+            else:
+                self._arqs['densos'][modelo] = os.path.join(self.corpus._pastas['indices'],
+                                                            f'{self.corpus._link_nome}_{modelo}.qnt.npz')
+                self._arqs['exatos'][modelo] = os.path.join(self.corpus._pastas['indices'],
+                                                            f'{self.corpus._link_nome}_{modelo}.f32')
+        self._arqs['vizinhos'] = os.path.join(self.corpus._pastas['indices'], f'{self.corpus._link_nome}_vizinhos')
+        self._vizinhos = TabelaVizinhos(self._arqs['vizinhos'])
         # Verifica se há um arquivo shelve criado
         if not os.path.isfile(f'{self.corpus._arqs["shelve"]}.dat'): return
-        with shelve.open(self.corpus._arqs["shelve"]) as db:
+        with abrir_shelve(self.corpus._arqs["shelve"], flag='r' if self.corpus.somente_leitura else 'c') as db:
             # Verifica se a chave dos modelos do corpus está no arquivo
             if self._shelf not in db: dados = None
             else: dados = db[self._shelf]
@@ -379,29 +944,287 @@ class Models:
         # Salva uma nova versão das configurações para o caso de mudança de versão da classe
         self._salvar_models()
 
-    def _obter_posicao_target(self, index, id_query, id_target):
+    def _melhores_modelo(self, modelo, index, id_ficha_query, n):
         '''
-        Pesquisa pelo id_query na matriz de similaridades sims e retorna a posição de id_target considerando a ordem
-        decrescente das probabilidades de semelhança.
+        Obtém as n fichas mais semelhantes à ficha indicada em um modelo, exceto ela própria. Um índice denso é sempre
+        varrido por completo, então as suas melhores fichas são selecionadas das similaridades brutas do cache, que são
+        reaproveitadas quando a busca é repetida com mais fichas; no índice invertido, a busca descarta as fichas que não
+        podem estar entre as n melhores.
         Parâmetros:
-            index (Similarity) --> Matriz de similaridade de Gensim
-            id_query (int) --> Índice do vetor no corpus cujas similaridades se pretende encontrar
-            id_target (int) --> Índice do vetor no corpus cuja posição na ordem inversa das probabilidades se deseja encontrar
-        Retorno: uma tupla onde o primeiro elemento é a posição de id_target na resposta da consulta de similaridade ordenada
-            inversamente pelas probabilidades e o segundo é a probabilidade de similaridade do id_target (tuple (int, float))
-        '''
-        sims = index.similarity_by_id(id_query)
-        sims_df = pd.DataFrame(sims, columns=['per_sim'])
-        sims_df.sort_values(by='per_sim', ascending=False, inplace=True)
-        sims_df['ordem'] = [i for i in range(1, sims_df.shape[0]+1)]
-        if id_target not in sims_df.index: ordem = per_sim = None
-        else: ordem, per_sim = sims_df.loc[id_target, 'ordem'], sims_df.loc[id_target, 'per_sim']
-        return ordem, per_sim
+            modelo (str) --> Nome do modelo
+            index (IndiceDenso ou IndiceInvertido) --> Índice do modelo
+            id_ficha_query (int) --> Identificador da ficha que servirá de comparação
+            n (int) --> Quantidade de fichas a serem retornadas
+        Retorno: uma tupla com os ids das fichas (ndarray de int) e as respectivas similaridades (ndarray de float) em ordem
+            decrescente de similaridade
+        '''
+        if isinstance(index, IndiceInvertido): return obter_executor().melhores(index, id_ficha_query, n, excluir=id_ficha_query)
+        sims = np.array(self._similaridades(modelo, id_ficha_query))
+        if 0 <= id_ficha_query < len(sims): sims[id_ficha_query] = -np.inf
+        n = min(n, len(sims))
+        ids = np.argpartition(-sims, n-1)[:n] if 0 < n < len(sims) else np.arange(n)
+        ids = ids[np.isfinite(sims[ids])]
+        ids = ids[np.argsort(-sims[ids], kind='stable')].astype(np.int64)
+        return ids, sims[ids].astype(np.float32)
+
+    def _montar_resultado(self, sims_modelos, id_excluir, teste, ids=None):
+        '''
+        Combina as similaridades obtidas em cada modelo em um DataFrame com o percentual geral ponderado pelo peso dos modelos.
+        Em cada modelo, só contam as fichas que alcançam o seu percentual mínimo; nos demais modelos, a ficha fica com
+        percentual, peso e ordem zero. Como as similaridades de todos os modelos se referem às mesmas fichas, na mesma ordem,
+        as colunas são montadas diretamente sobre os vetores, sem juntar um DataFrame por modelo.
+        Parâmetros:
+            sims_modelos (list de ndarray) --> Similaridades de cada ficha em cada modelo, na ordem dos modelos
+            id_excluir (int) --> Id da ficha a ser retirada do resultado (a própria ficha da consulta) ou None
+            teste (boolean) --> Indica se a pesquisa é para fins de teste, caso em que não se aplica o min_per_sim
+            ids (ndarray de int) --> Ids das fichas a que se referem as similaridades. Se None, as similaridades se referem a
+                    todas as fichas do corpus, na ordem dos ids (default: None)
+        Retorno: um Pandas DataFrame na ordem decrescente de semelhança das fichas
+        '''
+        modelos = list(self._modelos)
+        # Os índices dos modelos podem ter quantidades diferentes de fichas, se alguma ficha ainda não foi indexada
+        num_fichas = max(len(sims) for sims in sims_modelos)
+        fichas = np.arange(num_fichas) if ids is None else np.asarray(ids)
+        mascaras = []
+        for modelo, sims in zip(modelos, sims_modelos):
+            mascara = np.zeros(num_fichas, dtype=bool)
+            mascara[:len(sims)] = True
+            if not teste: mascara[:len(sims)] &= sims >= self._modelos[modelo]['min_per_sim']
+            if id_excluir is not None: mascara &= fichas != id_excluir
+            mascaras.append(mascara)
+        # Mantém as fichas que alcançam o percentual mínimo de algum modelo
+        presentes = np.flatnonzero(np.logical_or.reduce(mascaras))
+        colunas = {}
+        geral = np.zeros(len(presentes), dtype=np.int64)
+        peso_total = 0
+        for modelo, sims, mascara in zip(modelos, sims_modelos, mascaras):
+            peso = self._modelos[modelo]['peso']
+            mascara = mascara[presentes]
+            posicoes = presentes[mascara]
+            per_sim = np.zeros(len(presentes), dtype=sims.dtype)
+            per_sim[mascara] = np.round(sims[posicoes] * 100, 2)
+            # A ordem da ficha no modelo só considera as fichas que alcançam o percentual mínimo do modelo
+            ordem = np.zeros(len(presentes), dtype=np.int64)
+            validas = np.flatnonzero(mascara)
+            ordem[validas[np.argsort(-per_sim[validas], kind='stable')]] = np.arange(1, len(validas) + 1)
+            colunas[(modelo, 'per_sim')] = per_sim
+            colunas[(modelo, 'peso')] = np.where(mascara, peso, 0)
+            colunas[(modelo, 'ordem')] = ordem
+            # Calcula a probabilidade geral com base no peso de cada modelo
+            geral = geral + per_sim * colunas[(modelo, 'peso')]
+            peso_total += peso
+        colunas[('geral', 'per_sim')] = np.round(geral / peso_total, 2)
+        # Ordena as fichas pela probabilidade geral em ordem decrescente
+        ordenacao = np.argsort(-colunas[('geral', 'per_sim')], kind='stable')
+        resultado = pd.DataFrame({coluna: valores[ordenacao] for coluna, valores in colunas.items()}
+                                ,index=pd.Index(fichas[presentes][ordenacao], name='ficha'))
+        resultado.columns = pd.MultiIndex.from_tuples(resultado.columns)
+        resultado[('geral', 'ordem')] = np.arange(1, resultado.shape[0] + 1)
+        return resultado
+
+    def _num_features(self, modelo):
+        '''
+        Retorna a dimensionalidade dos vetores do modelo.
+        Parâmetros:
+            modelo (str) --> Nome do modelo
+        Retorno: a quantidade de dimensões dos vetores (int)
+        '''
+        if modelo in ['tfidf', 'tfidf_pivot']: return self.corpus.num_tokens
+        if modelo == 'doc2vec': return self._modelos[modelo]['vector_size']
+        return self._modelos[modelo]['num_topics']
+
+    def _similaridades(self, modelo, consulta):
+        '''
+        Calcula a similaridade da consulta com todas as fichas do corpus no modelo informado. Os blocos do índice são
+        varridos em paralelo pelo executor de consultas. O resultado fica no cache das similaridades brutas, cuja chave
+        inclui a versão do índice (e, nos documentos avulsos, dos modelos), de modo que ajustes de pesos e percentuais
+        mínimos não exigem um novo cálculo.
+        Parâmetros:
+            modelo (str) --> Nome do modelo
+            consulta (int ou tuple) --> Id da ficha que servirá de consulta ou tupla com o documento avulso no formato BOW e
+                    os seus tokens
+        Retorno: vetor com a similaridade de cada ficha (ndarray de float), somente para leitura
+        '''
+        index = self._carregar_indice(modelo)
+        rerank = self._modelos[modelo].get('rerank', 0)
+        if isinstance(consulta, (int, np.integer)): chave = (self._indices[modelo][0], rerank, int(consulta))
+        else:
+            bow, tokens = consulta
+            modelos = ['tfidf', modelo] if modelo == 'lsi' else [modelo]
+            versoes = tuple(os.path.getmtime(self._arqs['modelos'][m]) for m in modelos)
+            chave = (self._indices[modelo][0], rerank, versoes, tuple(bow), tuple(tokens) if modelo == 'doc2vec' else None)
+        sims = _CACHE_SIMILARIDADES.obter(chave)
+        if sims is not None: return sims
+        if not isinstance(consulta, (int, np.integer)): consulta = self._vetorizar(modelo, bow, tokens)
+        sims = obter_executor().similaridades(index, consulta, rerank=rerank)
+        sims.setflags(write=False)
+        _CACHE_SIMILARIDADES.guardar(chave, sims)
+        return sims
 
     def _salvar_models(self):
         '''
-        Persiste os dados do modelo.
+        Persiste os dados do modelo. Não faz nada se o corpus foi aberto somente para leitura.
         Retorno: None
         '''
-        with shelve.open(self.corpus._arqs["shelve"]) as db:
+        if self.corpus.somente_leitura: return
+        with abrir_shelve(self.corpus._arqs["shelve"]) as db:
             db[self._shelf] = self._modelos
+
+    def _testar_topicos(self, modelos, num_topicos, perc_fichas, vetor_testes, tipo_teste, num_processos=None
+                       ,memoria_max=None):
+        '''
+        Testa as quantidades de tópicos de um ou mais modelos em um pool de processos. A fatia do corpus de cada tipo é
+        montada uma única vez e gravada em arquivo (Matrix Market para os corpus BOW e TF-IDF e pickle para o corpus
+        Tagged), de onde os processos a leem sem acessar o banco de dados do corpus. Os treinamentos são iniciados do maior
+        para o menor consumo estimado de memória, respeitando num_processos e memoria_max. O LSI é treinado uma única vez,
+        com a maior quantidade de tópicos, e truncado para as demais quantidades.
+        Parâmetros:
+            Os mesmos de testar_num_topics, com a lista dos modelos a serem testados
+        Retorno: dicionário cuja chave é o nome do modelo e o valor é o resultado de testar_num_topics para o modelo
+        '''
+        # Verifica se o teste para os modelos foi implantado
+        if tipo_teste not in ['u_mass', 'similaridade']:
+            print(f'O tipo de teste {tipo_teste} não foi implementado.')
+            return
+        for modelo in modelos:
+            if modelo not in ['lda', 'lsi', 'doc2vec']:
+                print(f'O modelo {modelo} ou não é de tópico ou não foi implantado.')
+                return
+            if modelo == 'doc2vec' and tipo_teste == 'u_mass':
+                print('O teste de coerência com u_mass não pode ser usado para o modelo doc2vec.')
+                return
+        if tipo_teste == 'similaridade' and not vetor_testes:
+            print('O teste de similaridade precisa de um vetor de testes.')
+            return
+        # Iniciando as variáveis para os testes
+        pasta = tempfile.mkdtemp(prefix=f'{self.corpus._link_nome}_testes_', dir=self.corpus._pastas['indices'])
+        # Os arquivos temporários são descartados mesmo que algum teste falhe
+        try:
+            if vetor_testes:
+                flat = list(zip(*vetor_testes))
+                fichas_incluir = set(flat[0])
+                fichas_incluir.update(flat[1])
+            else: fichas_incluir = None
+            dicionario = self.corpus.dicionario()
+            arq_dicionario = os.path.join(pasta, 'dicionario.pkl')
+            with open(arq_dicionario, 'wb') as f:
+                pickle.dump(dicionario, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Define os corpus de treinamento e grava a fatia de cada tipo em arquivo
+            arqs_corpus, pares, tarefas = {}, {}, []
+            for modelo in modelos:
+                if modelo in ['lsi', 'lda']:
+                    bow = self.corpus.corpus(tipo='bow')
+                    corpus_parcial = bow.fatiar(perc_fichas=perc_fichas, incluir=fichas_incluir)
+                    if modelo == 'lsi':
+                        model_tfidf = self['tfidf'] or TfidfModel(corpus=corpus_parcial, id2word=dicionario)
+                        corpus_train = model_tfidf[corpus_parcial]
+                    else: corpus_train = corpus_parcial
+                    arqs_corpus[modelo] = os.path.join(pasta, f'{modelo}.mm')
+                    MmCorpus.serialize(arqs_corpus[modelo], corpus_train, id2word=dicionario)
+                else:
+                    corpus_tagged = self.corpus.corpus(tipo='tagged')
+                    corpus_parcial = corpus_tagged.fatiar(perc_fichas=perc_fichas, incluir=fichas_incluir)
+                    arqs_corpus[modelo] = os.path.join(pasta, f'{modelo}.pkl')
+                    with open(arqs_corpus[modelo], 'wb') as f:
+                        pickle.dump(list(corpus_parcial), f, protocol=pickle.HIGHEST_PROTOCOL)
+                # Obtém as posições dos pares de teste no corpus parcial
+                if fichas_incluir: ids_fichas = corpus_parcial.fichas()
+                else: ids_fichas = list(range(len(corpus_parcial)))
+                pares[modelo] = []
+                if tipo_teste == 'similaridade':
+                    for ficha_query, ficha_target in vetor_testes:
+                        pares[modelo].append((ids_fichas.index(self.corpus.ficha2id(ficha_query))
+                                             ,ids_fichas.index(self.corpus.ficha2id(ficha_target))))
+                # O LSI é treinado uma única vez, com a maior quantidade de tópicos, e truncado para as demais
+                grupos = [tuple(num_topicos)] if modelo == 'lsi' else [(num, ) for num in num_topicos]
+                for nums in grupos:
+                    if modelo == 'lsi':
+                        memoria = _configurar_lsi(self._modelos['lsi'], max(nums), len(dicionario), len(ids_fichas)
+                                                 ,self.corpus.avg_tokens_ficha)['memoria']
+                        memoria += len(ids_fichas) * max(nums) * 4
+                    else: memoria = _estimar_memoria_topicos(modelo, max(nums), len(dicionario), len(ids_fichas))
+                    tarefas.append((memoria, modelo, nums))
+            num_processos = max(1, min(num_processos or mp.cpu_count(), len(tarefas)))
+            # Divide as CPUs entre os processos para o treinamento do Doc2Vec. O LdaMulticore, que cria os seus próprios
+            # processos, só é usado quando os testes são executados no processo principal
+            cpus = max(1, mp.cpu_count() // num_processos)
+            parametros = {'doc2vec': {'alpha': self._modelos['doc2vec']['alpha']
+                                     ,'min_alpha': self._modelos['doc2vec']['min_alpha'], 'workers': cpus}
+                         ,'lda': dict(self._modelos['lda'], backend=self._modelos['lda']['backend'] if num_processos == 1 else 'lda')
+                         ,'lsi': self._modelos['lsi']}
+            def argumentos(modelo, nums):
+                return (modelo, nums, arqs_corpus[modelo], arq_dicionario, parametros, tipo_teste, pares[modelo]
+                       ,os.path.join(pasta, f'{modelo}_{max(nums)}'))
+            # Executa os testes, iniciando pelos que consomem mais memória
+            tarefas.sort(reverse=True)
+            medidas = {}
+            barra = tqdm(total=len(tarefas))
+            if num_processos == 1:
+                for _, modelo, nums in tarefas:
+                    print(f'Criando modelo "{modelo}" para num_topics={max(nums)}')
+                    medidas[(modelo, nums)] = _testar_num_topicos(*argumentos(modelo, nums))
+                    barra.update(1)
+            else:
+                with ProcessPoolExecutor(max_workers=num_processos) as pool:
+                    futuros, em_uso = {}, 0
+                    while tarefas or futuros:
+                        # Inicia os testes pendentes que cabem na memória disponível
+                        for tarefa in list(tarefas):
+                            if len(futuros) >= num_processos: break
+                            memoria, modelo, nums = tarefa
+                            if futuros and memoria_max and em_uso + memoria > memoria_max: continue
+                            print(f'Criando modelo "{modelo}" para num_topics={max(nums)}')
+                            futuros[pool.submit(_testar_num_topicos, *argumentos(modelo, nums))] = tarefa
+                            em_uso += memoria
+                            tarefas.remove(tarefa)
+                        concluidos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                        for futuro in concluidos:
+                            memoria, modelo, nums = futuros.pop(futuro)
+                            em_uso -= memoria
+                            medidas[(modelo, nums)] = futuro.result()
+                            barra.update(1)
+            barra.close()
+            # Carrega os modelos gerados e descarta os arquivos temporários
+            classes = {'lda': LdaModel, 'lsi': LsiModel, 'doc2vec': Doc2Vec}
+            resultado = {modelo: {} for modelo in modelos}
+            for (modelo, nums), (medidas_nums, arq_modelo) in medidas.items():
+                model = classes[modelo].load(arq_modelo)
+                for num in nums:
+                    model_num = truncar_lsi(model, num) if num < max(nums) else model
+                    resultado[modelo][num] = {'modelo': model_num, 'medida': medidas_nums[num]}
+            for modelo in modelos:
+                resultado[modelo] = {num: resultado[modelo][num] for num in sorted(resultado[modelo])}
+                for num, dados in resultado[modelo].items():
+                    print(f'Score {tipo_teste} do modelo "{modelo}" para num_topics={num} = {dados["medida"]}')
+            return resultado
+        finally:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    def _verificar_assinatura(self, arq, assinatura):
+        '''
+        Verifica se o arquivo do modelo ou do índice existe e foi gerado com as entradas da impressão digital informada.
+        Parâmetros:
+            arq (str) --> Arquivo do modelo ou do índice
+            assinatura (str) --> Impressão digital das entradas atuais
+        Retorno: True se o arquivo está atualizado ou False, caso contrário (boolean)
+        '''
+        if not os.path.isfile(arq) or not os.path.isfile(f'{arq}.fp'): return False
+        try:
+            with open(f'{arq}.fp') as f:
+                return json.load(f).get('assinatura') == assinatura
+        except (OSError, ValueError):
+            return False
+
+    def _vetorizar(self, modelo, bow, tokens):
+        '''
+        Transforma um documento avulso na representação vetorial do modelo.
+        Parâmetros:
+            modelo (str) --> Nome do modelo
+            bow (list de tuple (int, int)) --> Documento no formato BOW do dicionário do corpus
+            tokens (list de string) --> Tokens do documento, usados pelo modelo Doc2Vec
+        Retorno: o vetor do documento no formato do Gensim (list de tuple (int, float))
+        '''
+        model = self._carregar_modelo(modelo)
+        if modelo == 'lsi': return model[self._carregar_modelo('tfidf')[bow]]
+        if modelo == 'doc2vec': return [(i, v) for i, v in enumerate(model.infer_vector(tokens))]
+        return model[bow]
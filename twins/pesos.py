@@ -0,0 +1,215 @@
+# Imports Python
+import itertools
+import numpy as np
+import pandas as pd
+from tqdm.notebook import tqdm
+
+class OtimizadorPesos:
+    '''
+    Otimizador dos pesos dos modelos e das dimensões a partir de pares de teste. As similaridades brutas de cada modelo, em
+    cada corpus, entre a ficha de pesquisa e as fichas candidatas de cada par são calculadas uma única vez e guardadas em
+    uma matriz. Como a similaridade geral é uma combinação linear dessas similaridades, cada combinação de pesos é avaliada
+    por um produto matricial que fornece a posição da ficha esperada no resultado, sem refazer as pesquisas.
+    As fichas candidatas de cada par são as max_candidatos mais semelhantes em cada modelo, além da ficha esperada. Se o
+    corpus tiver mais fichas, as posições além desse limite podem ser subestimadas, o que não afeta a métrica "sucesso"
+    enquanto max_candidatos for maior que a posição de sucesso. Nos empates, a ficha esperada fica na pior posição.
+    Parâmetros:
+        corpus (dict str:Corpus) --> Corpus cujos modelos serão ponderados, tendo como chave o nome da dimensão ou, no
+                corpus único, o nome do corpus
+        vetor_testes (list de tuple (str, str)) --> Lista de pares de fichas, sendo a primeira o argumento de pesquisa e a
+                segunda a ficha cuja semelhança se espera encontrar
+        pesos_dimensoes (dict str:float) --> Pesos atuais das dimensões. Se None, trata-se de um corpus único (default: None)
+        max_candidatos (int) --> Quantidade de fichas mais semelhantes de cada modelo incluídas como candidatas (default: 500)
+    Atributos:
+        pesos (dict tuple:float) --> Pesos atuais, com as chaves (corpus, modelo) para os pesos dos modelos e (dimensão, None)
+                para os pesos das dimensões
+        componentes (list de tuple (str, str)) --> Corpus e modelo de cada coluna da matriz de similaridades
+        historico (list de tuple (float, dict)) --> Valor da métrica e pesos de cada combinação avaliada na última otimização
+    '''
+    METODOS = ['coordenadas', 'grade', 'aleatoria']
+    METRICAS = ['mrr', 'mediana', 'sucesso']
+
+    def __init__(self, corpus, vetor_testes, pesos_dimensoes=None, max_candidatos=500):
+        self.pesos = {}
+        self.componentes = []
+        self.historico = []
+        self._dimensoes = pesos_dimensoes is not None
+        for nome, corpus_nome in corpus.items():
+            for modelo, dados in corpus_nome.modelos.parametros().items():
+                self.componentes.append((nome, modelo))
+                self.pesos[(nome, modelo)] = dados['peso']
+            self.pesos[(nome, None)] = pesos_dimensoes[nome] if self._dimensoes else 1
+        self._sims, self._validos, self._encontrados = self._montar_matriz(corpus, vetor_testes, max_candidatos)
+
+    def avaliar(self, pesos=None, metrica='mrr', sucesso=100):
+        '''
+        Calcula a métrica de ordenação dos pares de teste para uma combinação de pesos.
+        Parâmetros:
+            pesos (dict tuple:float) --> Pesos a serem avaliados, no formato do atributo "pesos". Os pesos não informados
+                    assumem os valores atuais. Se None, avalia os pesos atuais (default: None)
+            metrica (str) --> "mrr" (média do inverso da posição), "mediana" (mediana do inverso da posição) ou "sucesso"
+                    (fração de pares com a ficha esperada até a posição de sucesso) (default: "mrr")
+            sucesso (int) --> Posição máxima da ficha esperada para que o par seja considerado um sucesso (default: 100)
+        Retorno: o valor da métrica (float), maior quanto melhor, ou None se os pesos não formarem uma combinação válida
+        '''
+        posicoes = self.posicoes(pesos)
+        if posicoes is None: return None
+        if metrica == 'sucesso': return float(np.mean(posicoes <= sucesso))
+        inversos = 1 / posicoes
+        return float(np.median(inversos) if metrica == 'mediana' else np.mean(inversos))
+
+    def otimizar(self, metodo='coordenadas', metrica='mrr', sucesso=100, niveis=None, valores=(0, 0.5, 1, 2, 4)
+                ,num_amostras=200, max_iteracoes=10, semente=None):
+        '''
+        Procura a combinação de pesos com o melhor valor da métrica.
+        Parâmetros:
+            metodo (str) --> "coordenadas" (descida por coordenadas, variando um peso de cada vez entre os valores), "grade"
+                    (todas as combinações dos valores) ou "aleatoria" (pesos sorteados entre o menor e o maior valor)
+                    (default: "coordenadas")
+            metrica (str) --> Métrica a ser maximizada, como em "avaliar" (default: "mrr")
+            sucesso (int) --> Posição máxima da ficha esperada para a métrica "sucesso" (default: 100)
+            niveis (list de str) --> Pesos a serem otimizados: "modelos" e/ou "dimensoes". Se None, otimiza os pesos dos
+                    modelos e, se houver dimensões, também os das dimensões (default: None)
+            valores (tuple de float) --> Valores de peso testados (default: (0, 0.5, 1, 2, 4))
+            num_amostras (int) --> Quantidade de combinações avaliadas na busca aleatória e limite de combinações da busca
+                    em grade, que passa a ser uma amostra da grade se esse limite for excedido (default: 200)
+            max_iteracoes (int) --> Quantidade máxima de passagens da descida por coordenadas (default: 10)
+            semente (int) --> Semente dos sorteios (default: None)
+        Retorno: tupla com os melhores pesos (dict tuple:float) e o valor da métrica para eles (float)
+        '''
+        if metodo not in self.METODOS:
+            print(f'O método "{metodo}" não foi implementado. Use {self.METODOS}.')
+            return None, None
+        if metrica not in self.METRICAS:
+            print(f'A métrica "{metrica}" não foi implementada. Use {self.METRICAS}.')
+            return None, None
+        niveis = niveis or (['modelos', 'dimensoes'] if self._dimensoes else ['modelos'])
+        chaves = [chave for chave in self.pesos
+                  if (chave[1] is not None and 'modelos' in niveis) or (chave[1] is None and self._dimensoes and 'dimensoes' in niveis)]
+        rng = np.random.default_rng(semente)
+        self.historico = []
+        def avaliar(pesos):
+            valor = self.avaliar(pesos, metrica, sucesso)
+            if valor is not None: self.historico.append((valor, pesos))
+            return -np.inf if valor is None else valor
+        melhores, melhor = dict(self.pesos), avaliar(dict(self.pesos))
+        if metodo == 'coordenadas':
+            for _ in range(max_iteracoes):
+                melhorou = False
+                for chave in chaves:
+                    for valor in valores:
+                        if valor == melhores[chave]: continue
+                        pesos = dict(melhores)
+                        pesos[chave] = valor
+                        resultado = avaliar(pesos)
+                        if resultado > melhor: melhores, melhor, melhorou = pesos, resultado, True
+                if not melhorou: break
+        else:
+            if metodo == 'grade' and len(valores) ** len(chaves) <= num_amostras:
+                combinacoes = itertools.product(valores, repeat=len(chaves))
+            elif metodo == 'grade':
+                print(f'A grade tem {len(valores) ** len(chaves)} combinações. Serão avaliadas {num_amostras} delas, sorteadas.')
+                combinacoes = (rng.choice(valores, size=len(chaves)) for _ in range(num_amostras))
+            else: combinacoes = (rng.uniform(min(valores), max(valores), size=len(chaves)) for _ in range(num_amostras))
+            for combinacao in combinacoes:
+                pesos = dict(self.pesos)
+                pesos.update(zip(chaves, (float(valor) for valor in combinacao)))
+                resultado = avaliar(pesos)
+                if resultado > melhor: melhores, melhor = pesos, resultado
+        return melhores, melhor
+
+    def posicoes(self, pesos=None):
+        '''
+        Calcula a posição da ficha esperada no resultado de cada par de teste para uma combinação de pesos.
+        Parâmetros:
+            pesos (dict tuple:float) --> Pesos a serem avaliados, no formato do atributo "pesos". Se None, usa os pesos
+                    atuais (default: None)
+        Retorno: vetor com a posição de cada par (ndarray de float), infinita se a ficha esperada não foi encontrada, ou
+            None se os pesos não formarem uma combinação válida
+        '''
+        vetor = self._vetor_pesos({**self.pesos, **(pesos or {})})
+        if vetor is None: return None
+        gerais = self._sims @ vetor
+        alvos = gerais[:, :1]
+        posicoes = 1 + ((gerais[:, 1:] >= alvos) & self._validos[:, 1:]).sum(axis=1).astype(np.float64)
+        posicoes[~self._encontrados] = np.inf
+        return posicoes
+
+    def resumo(self, quantidade=10):
+        '''
+        Resume as melhores combinações de pesos avaliadas na última otimização.
+        Parâmetros:
+            quantidade (int) --> Quantidade de combinações a serem apresentadas (default: 10)
+        Retorno: um DataFrame Pandas com uma coluna para cada peso e a coluna "metrica", em ordem decrescente da métrica
+        '''
+        melhores = sorted(self.historico, key=lambda item: -item[0])[:quantidade]
+        colunas = [(nome, modelo if modelo else 'dimensao') for nome, modelo in self.pesos]
+        dados = [[pesos[chave] for chave in self.pesos] + [valor] for valor, pesos in melhores]
+        resultado = pd.DataFrame(data=dados, columns=pd.MultiIndex.from_tuples(colunas + [('geral', 'metrica')]))
+        resultado.index = [i for i in range(1, resultado.shape[0]+1)]
+        return resultado
+
+    def _montar_matriz(self, corpus, vetor_testes, max_candidatos):
+        '''
+        Calcula as similaridades brutas de cada par de teste com as suas fichas candidatas em cada modelo de cada corpus.
+        A ficha esperada ocupa a primeira posição das candidatas de cada par.
+        Retorno: tupla com a matriz de similaridades (ndarray de float32 com as dimensões pares x candidatas x componentes),
+            a máscara das candidatas válidas (ndarray de bool) e o indicador de que a ficha esperada foi encontrada em algum
+            corpus (ndarray de bool)
+        '''
+        matrizes, encontrados = [], []
+        for query, target in tqdm(vetor_testes):
+            # Obtém as similaridades da ficha de pesquisa em cada corpus, sem a própria ficha
+            sims_corpus, candidatas = {}, {target: 0}
+            for nome, corpus_nome in corpus.items():
+                id_query = corpus_nome._dao.obter_id_ficha(query)
+                if id_query is None: continue
+                sims_modelos = corpus_nome.modelos.similaridades(id_query)
+                sims_corpus[nome] = sims_modelos
+                for sims in sims_modelos:
+                    sims = np.array(sims, dtype=np.float32)
+                    sims[id_query] = -np.inf
+                    quantidade = min(max_candidatos, len(sims))
+                    ids = np.argpartition(-sims, quantidade - 1)[:quantidade]
+                    ids = ids[np.isfinite(sims[ids])]
+                    for ficha in corpus_nome._dao.obter_fichas_ids(ids.tolist()):
+                        candidatas.setdefault(ficha, len(candidatas))
+            # Monta a matriz das candidatas do par, com similaridade zero nos corpus que não têm a ficha
+            matriz = np.zeros((len(candidatas), len(self.componentes)), dtype=np.float32)
+            encontrado = False
+            for nome, corpus_nome in corpus.items():
+                if nome not in sims_corpus: continue
+                linhas, ids = [], []
+                for ficha, linha in candidatas.items():
+                    id_ficha = corpus_nome._dao.obter_id_ficha(ficha)
+                    if id_ficha is None: continue
+                    linhas.append(linha)
+                    ids.append(id_ficha)
+                encontrado |= bool(linhas) and linhas[0] == 0
+                colunas = [coluna for coluna, (nome_componente, _) in enumerate(self.componentes) if nome_componente == nome]
+                for coluna, sims in zip(colunas, sims_corpus[nome]):
+                    matriz[linhas, coluna] = sims[ids]
+            matrizes.append(matriz)
+            encontrados.append(encontrado)
+        # Junta as matrizes dos pares, completando as que têm menos candidatas com linhas inválidas
+        max_linhas = max((matriz.shape[0] for matriz in matrizes), default=1)
+        sims = np.zeros((len(matrizes), max_linhas, len(self.componentes)), dtype=np.float32)
+        validos = np.zeros((len(matrizes), max_linhas), dtype=bool)
+        for par, matriz in enumerate(matrizes):
+            sims[par, :matriz.shape[0]] = matriz
+            validos[par, :matriz.shape[0]] = True
+        return sims, validos, np.array(encontrados, dtype=bool)
+
+    def _vetor_pesos(self, pesos):
+        '''
+        Converte os pesos no vetor que, multiplicado pelas similaridades brutas, fornece a similaridade geral de cada ficha,
+        a menos de uma constante. A similaridade de cada modelo é ponderada pelo peso do modelo no seu corpus e pelo peso da
+        dimensão.
+        Retorno: o vetor de pesos (ndarray de float32) ou None se algum corpus ou o conjunto das dimensões tiver peso total zero
+        '''
+        if sum(pesos[(nome, None)] for nome, _ in self.componentes) <= 0: return None
+        totais = {}
+        for nome, modelo in self.componentes: totais[nome] = totais.get(nome, 0) + pesos[(nome, modelo)]
+        if any(total <= 0 for total in totais.values()): return None
+        return np.array([pesos[(nome, modelo)] / totais[nome] * pesos[(nome, None)] for nome, modelo in self.componentes]
+                       ,dtype=np.float32)
@@ -0,0 +1,94 @@
+# Imports Python
+import os
+import re
+import glob
+import json
+import shutil
+import datetime as dt
+# Imports Twins
+from twins.utils import abrir_shelve
+
+class Publicacoes:
+    '''
+    Versões publicadas dos modelos e índices de um corpus. Cada versão é uma pasta com a cópia dos arquivos dos modelos,
+    dos índices e da tabela de vizinhos, das tabelas do DB usadas nas consultas e das configurações do corpus e dos modelos,
+    de modo que um corpus aberto com publicado=True responde às consultas a partir dela enquanto o corpus original continua
+    recebendo documentos e sendo reconstruído. A versão atual é indicada pelo arquivo "publicado.json", substituído de forma
+    atômica apenas depois de a pasta da nova versão estar completa.
+    Parâmetros:
+        pasta (str) --> Pasta onde ficam as versões publicadas do corpus
+    Atributos:
+        pasta (str) --> Pasta onde ficam as versões publicadas do corpus
+    '''
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self._arq = os.path.join(pasta, 'publicado.json')
+
+    def atual(self):
+        '''
+        Lê a descrição da última versão publicada.
+        Retorno: dicionário com o número da versão, o nome da sua pasta, a data da publicação e a quantidade de fichas
+            indexadas ou None se nenhuma versão foi publicada
+        '''
+        if not os.path.isfile(self._arq): return None
+        with open(self._arq, encoding='utf-8') as f:
+            return json.load(f)
+
+    def pasta_versao(self, publicacao):
+        '''
+        Retorna a pasta de uma versão publicada.
+        Parâmetros:
+            publicacao (dict) --> Descrição da versão, como retornada por "atual"
+        Retorno: o caminho da pasta (str)
+        '''
+        return os.path.join(self.pasta, publicacao['pasta'])
+
+    def publicar(self, corpus, manter=3):
+        '''
+        Publica uma nova versão com o estado atual do corpus e descarta as versões mais antigas que as últimas "manter". As
+        versões anteriores à atual são mantidas para as instâncias que ainda não passaram a consultar a nova versão.
+        Parâmetros:
+            corpus (Corpus) --> Corpus cujos modelos e índices são publicados
+            manter (int) --> Quantidade de versões mantidas, incluindo a nova (default: 3)
+        Retorno: a descrição da versão publicada (dict)
+        '''
+        anterior = self.atual()
+        versao = anterior['versao'] + 1 if anterior else 1
+        nome = f'v{versao:06d}'
+        destino = os.path.join(self.pasta, nome)
+        temporaria = f'{destino}.tmp'
+        # Descarta o que tenha restado de uma publicação interrompida com o mesmo número
+        for pasta in [temporaria, destino]:
+            if os.path.isdir(pasta): shutil.rmtree(pasta)
+        # Copia os arquivos dos modelos e dos índices, com os arquivos auxiliares gravados pelo gensim com o mesmo prefixo.
+        # A cópia preserva as datas de alteração, que fazem parte da assinatura da tabela de vizinhos
+        modelos = corpus.modelos
+        prefixos = [arq for tipo in ['modelos', 'indices', 'invertidos', 'densos', 'exatos']
+                    for arq in modelos._arqs[tipo].values()]
+        prefixos.append(modelos._arqs['vizinhos'])
+        for pasta in ['modelos', 'indices']:
+            os.makedirs(os.path.join(temporaria, pasta))
+        arqs = {arq for prefixo in prefixos for arq in glob.glob(f'{glob.escape(prefixo)}*') if os.path.isfile(arq)}
+        for arq in sorted(arqs):
+            pasta = 'modelos' if os.path.dirname(arq) == corpus._pastas['modelos'] else 'indices'
+            shutil.copy2(arq, os.path.join(temporaria, pasta, os.path.basename(arq)))
+        # Copia as tabelas do DB usadas nas consultas e as configurações do corpus e dos modelos
+        num_fichas = corpus._treino['num_fichas']
+        corpus._dao.exportar_consultas(os.path.join(temporaria, 'corpus.db'), num_fichas)
+        with abrir_shelve(corpus._arqs['shelve'], flag='r') as db:
+            configuracoes = {chave: db[chave] for chave in [corpus._shelf, modelos._shelf] if chave in db}
+        with abrir_shelve(os.path.join(temporaria, 'objetos')) as db:
+            db.update(configuracoes)
+        os.rename(temporaria, destino)
+        # Aponta a publicação para a nova versão
+        publicacao = dict(versao=versao, pasta=nome, data=dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                         ,num_fichas=num_fichas)
+        temporario = f'{self._arq}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(publicacao, f)
+        os.replace(temporario, self._arq)
+        # Descarta as versões mais antigas
+        versoes = sorted(pasta for pasta in os.listdir(self.pasta) if re.fullmatch(r'v\d{6}', pasta))
+        for pasta in versoes[:-max(manter, 1)]:
+            shutil.rmtree(os.path.join(self.pasta, pasta), ignore_errors=True)
+        return publicacao
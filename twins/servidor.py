@@ -0,0 +1,226 @@
+# Imports Python
+import asyncio
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+class ServidorTwins:
+    '''
+    Servidor asyncio de consultas por fichas semelhantes. Mantém em memória os modelos, os índices e as tabelas de fichas do
+    objeto Twins e agrupa as requisições que chegam em um intervalo curto (ou até atingir o tamanho máximo do lote) em
+    micro-lotes, cujas similaridades são calculadas de uma só vez, na forma de uma matriz, por Twins.semelhantes_lote.
+    O protocolo é de uma requisição JSON por linha, com as chaves:
+        id --> Identificador da requisição, devolvido na resposta
+        ficha (string) --> Nome da ficha a ser comparada, ou
+        documento (dict str:str) --> Valores dos atributos de um documento que não faz parte do corpus
+        dimensoes (list de string), top_k (int), ind_tokens (boolean) e teste (boolean) --> Opcionais, como em Twins
+    Cada resposta é um JSON em uma linha com as chaves "id", "ok" e "resultado" (lista de fichas e percentuais de
+    similaridade geral) ou "erro". As respostas de uma conexão podem chegar fora da ordem das requisições.
+    Parâmetros:
+        twins (Twins) --> Objeto Twins que responderá às consultas
+        host (string) --> Endereço onde o servidor aguardará as conexões (default: "127.0.0.1")
+        porta (int) --> Porta do servidor. Se for 0, usa uma porta livre escolhida pelo sistema (default: 8765)
+        janela (float) --> Tempo máximo, em segundos, de espera por outras requisições para compor um lote (default: 0.005)
+        max_lote (int) --> Quantidade máxima de requisições de um lote (default: 64)
+        top_k (int) --> Quantidade de fichas de cada resposta, se a requisição não informar o top_k (default: 10)
+    Atributos:
+        twins (Twins) --> Objeto Twins que responde às consultas
+        host (string) --> Endereço do servidor
+        porta (int) --> Porta do servidor
+        janela (float) --> Tempo máximo de espera para compor um lote
+        max_lote (int) --> Quantidade máxima de requisições de um lote
+        top_k (int) --> Quantidade de fichas de cada resposta, se a requisição não informar o top_k
+        estatisticas (dict str:int) --> Quantidade de requisições atendidas e de lotes processados
+    '''
+    def __init__(self, twins, host='127.0.0.1', porta=8765, janela=0.005, max_lote=64, top_k=10):
+        self.twins = twins
+        self.host = host
+        self.porta = porta
+        self.janela = janela
+        self.max_lote = max_lote
+        self.top_k = top_k
+        self.estatisticas = {'requisicoes': 0, 'lotes': 0}
+        self._servidor = None
+        self._fila = None
+        self._tarefa_lotes = None
+        # As consultas são executadas fora do loop de eventos, uma de cada vez, pois o próprio lote já é paralelizado
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='twins_servidor')
+
+    async def iniciar(self):
+        '''
+        Carrega os modelos e índices em memória e passa a aceitar conexões.
+        Retorno: None
+        '''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.twins.carregar)
+        self._fila = asyncio.Queue()
+        self._tarefa_lotes = asyncio.create_task(self._processar_lotes())
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.porta, limit=2**24)
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+        print(f'Servidor Twins aguardando conexões em {self.host}:{self.porta}')
+
+    async def encerrar(self):
+        '''
+        Deixa de aceitar conexões e encerra o processamento dos lotes.
+        Retorno: None
+        '''
+        if self._servidor:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+            self._servidor = None
+        if self._tarefa_lotes:
+            self._tarefa_lotes.cancel()
+            try: await self._tarefa_lotes
+            except asyncio.CancelledError: pass
+            self._tarefa_lotes = None
+
+    def servir(self):
+        '''
+        Inicia o servidor e o mantém em execução até que o processo seja interrompido.
+        Retorno: None
+        '''
+        async def servir_sempre():
+            await self.iniciar()
+            try: await self._servidor.serve_forever()
+            finally: await self.encerrar()
+        try: asyncio.run(servir_sempre())
+        except KeyboardInterrupt: print('Servidor Twins encerrado.')
+
+    async def _atender(self, reader, writer):
+        '''
+        Lê as requisições de uma conexão, uma por linha, e as encaminha para a fila dos lotes sem aguardar as respostas
+        anteriores, de modo que as requisições de uma mesma conexão também possam compor um lote.
+        '''
+        trava = asyncio.Lock()
+        tarefas = set()
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha: break
+                if not linha.strip(): continue
+                tarefa = asyncio.create_task(self._responder(linha, writer, trava))
+                tarefas.add(tarefa)
+                tarefa.add_done_callback(tarefas.discard)
+            if tarefas: await asyncio.gather(*tarefas)
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        finally:
+            writer.close()
+
+    async def _responder(self, linha, writer, trava):
+        '''
+        Coloca a requisição na fila dos lotes, aguarda o seu resultado e o envia ao cliente.
+        '''
+        requisicao = None
+        try:
+            requisicao = json.loads(linha)
+            if not isinstance(requisicao, dict): raise ValueError('a requisição deve ser um objeto JSON')
+            parametros = self._parametros(requisicao)
+        except ValueError as erro:
+            id_requisicao = requisicao.get('id') if isinstance(requisicao, dict) else None
+            resposta = {'id': id_requisicao, 'ok': False, 'erro': f'Requisição inválida: {erro}'}
+        else:
+            futuro = asyncio.get_running_loop().create_future()
+            await self._fila.put((requisicao, parametros, futuro))
+            resposta = await futuro
+        async with trava:
+            writer.write(json.dumps(resposta, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def _processar_lotes(self):
+        '''
+        Retira as requisições da fila em lotes limitados pela janela de tempo e pelo tamanho máximo e os processa.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self._fila.get()]
+            limite = loop.time() + self.janela
+            while len(lote) < self.max_lote:
+                espera = limite - loop.time()
+                if espera <= 0: break
+                try: lote.append(await asyncio.wait_for(self._fila.get(), espera))
+                except asyncio.TimeoutError: break
+            # As requisições do lote são agrupadas pelos parâmetros da pesquisa, que valem para o lote inteiro
+            grupos = {}
+            for requisicao, parametros, futuro in lote:
+                grupos.setdefault(parametros, []).append((requisicao, futuro))
+            for parametros, itens in grupos.items():
+                # Um erro em um grupo só afeta as requisições do grupo, e nenhuma requisição fica sem resposta
+                try:
+                    respostas = await loop.run_in_executor(self._executor, self._consultar, parametros, itens)
+                    if len(respostas) != len(itens): raise RuntimeError('quantidade de resultados diferente da de consultas')
+                except Exception as erro:
+                    respostas = [{'id': requisicao.get('id'), 'ok': False, 'erro': str(erro)} for requisicao, _ in itens]
+                for (_, futuro), resposta in zip(itens, respostas):
+                    if not futuro.done(): futuro.set_result(resposta)
+            self.estatisticas['requisicoes'] += len(lote)
+            self.estatisticas['lotes'] += 1
+
+    def _consultar(self, parametros, itens):
+        '''
+        Executa a pesquisa de um grupo de requisições com os mesmos parâmetros e monta as respostas.
+        '''
+        dimensoes, top_k, ind_tokens, teste = parametros
+        consultas = [requisicao['documento'] if 'documento' in requisicao else requisicao['ficha'] for requisicao, _ in itens]
+        lote = self.twins.semelhantes_lote(consultas, dimensoes=list(dimensoes) if dimensoes else None
+                                          ,ind_tokens=ind_tokens, teste=teste, top_k=top_k)
+        respostas = []
+        for (requisicao, _), resultados in zip(itens, lote):
+            final = resultados.get('Final')
+            if final is None:
+                respostas.append({'id': requisicao.get('id'), 'ok': False, 'erro': 'Não foi possível obter o resultado da pesquisa'})
+                continue
+            fichas = final[('Ficha', '')].tolist()
+            per_sims = final[('geral', 'per_sim')].tolist()
+            respostas.append({'id': requisicao.get('id'), 'ok': True
+                             ,'resultado': [{'ficha': ficha, 'per_sim': float(per_sim)} for ficha, per_sim in zip(fichas, per_sims)]})
+        return respostas
+
+    def _parametros(self, requisicao):
+        '''
+        Valida a consulta e os parâmetros da pesquisa da requisição e obtém os parâmetros na forma de uma tupla que identifica
+        o grupo da requisição no lote. Gera ValueError se a consulta ou algum parâmetro for inválido, de modo que uma
+        requisição inválida seja respondida antes de entrar na fila e não afete as demais requisições do seu lote.
+        '''
+        if ('ficha' in requisicao) == ('documento' in requisicao):
+            raise ValueError('a requisição deve informar a "ficha" ou o "documento", mas não ambos')
+        if 'ficha' in requisicao and not isinstance(requisicao['ficha'], str):
+            raise ValueError('"ficha" deve ser o nome de uma ficha')
+        documento = requisicao.get('documento')
+        if 'documento' in requisicao and (not isinstance(documento, dict) or
+                                          not all(isinstance(valor, str) for valor in documento.values())):
+            raise ValueError('"documento" deve ser um objeto com os valores dos atributos em texto')
+        dimensoes = requisicao.get('dimensoes')
+        if dimensoes is not None and (not isinstance(dimensoes, list) or
+                                      not all(isinstance(dimensao, str) for dimensao in dimensoes)):
+            raise ValueError('"dimensoes" deve ser uma lista de nomes de dimensões')
+        top_k = requisicao.get('top_k', self.top_k)
+        if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 0):
+            raise ValueError('"top_k" deve ser um número inteiro não negativo')
+        for chave in ['ind_tokens', 'teste']:
+            if chave in requisicao and not isinstance(requisicao[chave], bool):
+                raise ValueError(f'"{chave}" deve ser true ou false')
+        return (tuple(dimensoes) if dimensoes else None, top_k, requisicao.get('ind_tokens', True)
+               ,requisicao.get('teste', False))
+
+
+def consultar(requisicoes, host='127.0.0.1', porta=8765, timeout=60):
+    '''
+    Cliente simples e síncrono do ServidorTwins. Envia as requisições por uma única conexão e aguarda todas as respostas.
+    Parâmetros:
+        requisicoes (list de dict) --> Requisições no formato do protocolo do servidor. As que não tiverem "id" recebem a
+                sua posição na lista como id
+        host (string) --> Endereço do servidor (default: "127.0.0.1")
+        porta (int) --> Porta do servidor (default: 8765)
+        timeout (float) --> Tempo máximo, em segundos, de espera pelas respostas (default: 60)
+    Retorno: lista das respostas na ordem das requisições (list de dict)
+    '''
+    requisicoes = [dict(requisicao, id=requisicao.get('id', posicao)) for posicao, requisicao in enumerate(requisicoes)]
+    respostas = {}
+    with socket.create_connection((host, porta), timeout=timeout) as conexao:
+        dados = ''.join(json.dumps(requisicao, ensure_ascii=False) + '\n' for requisicao in requisicoes)
+        conexao.sendall(dados.encode('utf-8'))
+        with conexao.makefile('r', encoding='utf-8') as arquivo:
+            for _ in requisicoes:
+                resposta = json.loads(arquivo.readline())
+                respostas[resposta['id']] = resposta
+    return [respostas.get(requisicao['id']) for requisicao in requisicoes]
@@ -3,11 +3,38 @@ import csv
 import sqlite3
 import os
 import re
+import sys
+import shelve
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from array import array
+from collections import OrderedDict
+from urllib.request import pathname2url
+import numpy as np
+import pandas as pd
 # Imports Gensim
 from gensim.models.doc2vec import TaggedDocument
 from gensim import utils as g_utils
+# O bloqueio entre processos do arquivo de configurações só está disponível em sistemas Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# O pico de memória do processo só está disponível em sistemas Unix. No Linux, é lido em /proc
+try:
+    import resource
+except ImportError:
+    resource = None
 
 RE_ESPACO = re.compile(r'\s+')
+# Instâncias de ConexaoDB, cujas conexões ociosas são fechadas antes de um fork
+_CONEXOES = weakref.WeakSet()
+# Medidas de pico de memória em andamento e maior pico do processo anterior à última reinicialização do pico pelo Linux
+_TRAVA_MEMORIA = threading.Lock()
+_JANELAS_MEMORIA = []
+_PICO_PROCESSO = [0]
 
 def obter_link_name(nome):
     '''
@@ -18,26 +45,204 @@ def obter_link_name(nome):
     '''
     return g_utils.deaccent(RE_ESPACO.sub('_', nome.lower()))
 
+@contextmanager
+def abrir_shelve(arq, flag='c'):
+    '''
+    Abre o arquivo shelve das configurações de um projeto com um bloqueio entre processos, compartilhado na leitura e
+    exclusivo na escrita, para que os processos que constroem os modelos em paralelo não leiam o arquivo enquanto o
+    processo principal o grava.
+    Parâmetros:
+        arq (string) --> Endereço do arquivo shelve
+        flag (string) --> Modo de abertura do shelve: "r" para leitura ou "c" para leitura e escrita (default: "c")
+    Retorno: o objeto shelve aberto, em um bloco with
+    '''
+    with open(f'{arq}.lock', 'a') as trava:
+        if fcntl: fcntl.flock(trava, fcntl.LOCK_SH if flag == 'r' else fcntl.LOCK_EX)
+        try:
+            with shelve.open(arq, flag=flag) as db:
+                yield db
+        finally:
+            if fcntl: fcntl.flock(trava, fcntl.LOCK_UN)
+
+def encerrar_janela_memoria(janela):
+    '''
+    Encerra a medida do pico de memória iniciada por iniciar_janela_memoria.
+    Parâmetros:
+        janela (dict) --> Janela retornada por iniciar_janela_memoria
+    Retorno: o pico de memória residente, em bytes, durante a janela ou None se não estiver disponível no sistema (int)
+    '''
+    with _TRAVA_MEMORIA:
+        _incorporar_pico_memoria()
+        if janela in _JANELAS_MEMORIA: _JANELAS_MEMORIA.remove(janela)
+    return janela['pico']
+
+def iniciar_janela_memoria():
+    '''
+    Inicia a medida do pico de memória residente (RSS) do processo durante um trecho de código. No Linux, o pico mantido
+    pelo sistema é reiniciado com a memória atual depois de incorporado às medidas em andamento, de modo que as medidas
+    simultâneas ou aninhadas obtêm cada uma o pico do seu próprio intervalo. Nos demais sistemas, a medida é o pico desde o
+    início do processo.
+    Retorno: a janela da medida, a ser informada a encerrar_janela_memoria (dict)
+    '''
+    janela = {'pico': None}
+    with _TRAVA_MEMORIA:
+        _incorporar_pico_memoria()
+        _JANELAS_MEMORIA.append(janela)
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError: pass
+    return janela
+
+def obter_memoria_atual():
+    '''
+    Obtém a memória residente (RSS) atual do processo.
+    Retorno: a memória residente, em bytes, ou None se não estiver disponível no sistema (int)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def obter_pico_memoria():
+    '''
+    Obtém o pico de memória residente (RSS) do processo atual desde o seu início.
+    Retorno: o pico de memória, em bytes, ou None se não estiver disponível no sistema (int)
+    '''
+    with _TRAVA_MEMORIA:
+        pico = _incorporar_pico_memoria()
+    return pico and max(pico, _PICO_PROCESSO[0])
+
+def _incorporar_pico_memoria():
+    '''
+    Lê o pico de memória residente mantido pelo sistema e o incorpora às medidas em andamento e ao pico do processo. Deve ser
+    chamada com a trava das medidas de memória.
+    Retorno: o pico de memória, em bytes, desde a última reinicialização ou None se não estiver disponível (int)
+    '''
+    pico = None
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    pico = int(linha.split()[1]) * 1024
+                    break
+    except (OSError, ValueError): pass
+    if pico is None and resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # O Linux informa o valor em kilobytes e o macOS em bytes
+        if sys.platform != 'darwin': pico *= 1024
+    if pico is None: return None
+    _PICO_PROCESSO[0] = max(_PICO_PROCESSO[0], pico)
+    for janela in _JANELAS_MEMORIA:
+        janela['pico'] = max(janela['pico'] or 0, pico)
+    return pico
+
 class ConexaoDB:
     '''
     Abstrai a conexão a um banco de dados SQlite3 que é usado para armazenar as informações do corpus e das configurações
     dos objetos. Essa classe é para ser usada em uma estrutura com with, lançando um cursor para a conexão ao DB do arquivo
-    e fazendo o commit e close ao final do bloco.
+    e fazendo o commit ao final do bloco mais externo. A conexão é mantida aberta entre os blocos, uma por thread, o que
+    preserva o cache de páginas do SQLite e o cache de comandos preparados (os comandos repetidos não são compilados
+    novamente). Um processo criado por fork abre as suas próprias conexões. Ao ser aberta, a conexão recebe os pragmas
+    de PRAGMAS, com journal_mode=WAL, que permite a leitura do DB durante a escrita e, nas cargas de dados (ver "carga"),
+    dispensa a sincronização do disco a cada commit.
     Parâmetros:
         arq_db (String) --> Endereço onde se encontra o arquivo do DB
+        pragmas (dict str:str) --> Pragmas que substituem os de PRAGMAS nesta conexão (default: None)
+        somente_leitura (boolean) --> Indica se o DB é aberto apenas para leitura, caso em que o journal_mode não é
+                alterado. No modo WAL, a leitura não bloqueia nem é bloqueada pela escrita de outro processo (default: False)
+    Atributos:
+        perfil (PerfilSQL) --> Perfil onde são registrados os comandos executados pela conexão, ou None (default: None)
+    Atributos de classe:
+        rastreador (function) --> Função chamada com cada comando SQL executado nas conexões, definida pelo registro de
+                métricas (ver twins.metricas.configurar_metricas), ou None
+        PRAGMAS (dict str:str) --> Pragmas aplicados às conexões ao serem abertas. O synchronous é o usado fora das cargas
+        PRAGMAS_CARGA (dict str:str) --> Pragmas aplicados durante as cargas de dados (ver "carga")
+        CACHE_COMANDOS (int) --> Quantidade de comandos preparados mantidos em cache por conexão
     '''
-    def __init__(self, arq_db):
+    rastreador = None
+    PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -64*1024, 'mmap_size': 256*2**20
+              ,'temp_store': 'MEMORY'}
+    PRAGMAS_CARGA = {'synchronous': 'NORMAL'}
+    CACHE_COMANDOS = 256
+    _cargas = 0
+    _trava_cargas = threading.Lock()
+
+    def __init__(self, arq_db, pragmas=None, somente_leitura=False):
         self.arq_db = arq_db
-        self.conn = None
+        self.somente_leitura = somente_leitura
+        self.perfil = None
+        self._pragmas = dict(pragmas or {})
+        self._local = threading.local()
+        self._versao = 0
+        self._estados = []
+        self._trava = threading.Lock()
+        _CONEXOES.add(self)
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.arq_db)
-        return self.conn.cursor()
+        with self._trava:
+            estado = self._obter_estado()
+            estado['nivel'] += 1
+        conn = estado['conn']
+        if estado['nivel'] == 1:
+            conn.set_trace_callback(ConexaoDB.rastreador)
+            # Entra ou sai do modo de carga no início de uma transação
+            carga = ConexaoDB._cargas > 0
+            if carga != estado['carga']:
+                pragmas = self._obter_pragmas()
+                self._executar_pragmas(conn, self.PRAGMAS_CARGA if carga else {pragma: pragmas[pragma]
+                                       for pragma in self.PRAGMAS_CARGA if pragma in pragmas})
+                estado['carga'] = carga
+        if self.perfil is None: return conn.cursor()
+        return _CursorPerfilado(conn.cursor(), self.perfil)
 
     def __exit__(self, tipo_excecao, valor_excecao, traceback):
-        self.conn.commit()
-        self.conn.close()
-        self.conn = None
+        estado = self._local.estado
+        if estado['nivel'] == 1:
+            if self.perfil is None: estado['conn'].commit()
+            else:
+                inicio = time.perf_counter()
+                estado['conn'].commit()
+                self.perfil.registrar_commit(time.perf_counter() - inicio)
+        estado['nivel'] -= 1
+
+    @property
+    def conn(self):
+        '''
+        Conexão da thread atual, ou None se ela não estiver aberta.
+        '''
+        estado = getattr(self._local, 'estado', None)
+        return estado['conn'] if estado and estado['pid'] == os.getpid() else None
+
+    def ajustar_pragmas(self, **pragmas):
+        '''
+        Altera os pragmas desta conexão. As conexões já abertas são fechadas e reabertas com os novos pragmas no próximo uso.
+        Parâmetros:
+            O nome do pragma e o valor que se quer atribuir a ele. Um valor None volta a usar o de PRAGMAS
+        Retorno: None
+        '''
+        for pragma, valor in pragmas.items():
+            if valor is None: self._pragmas.pop(pragma, None)
+            else: self._pragmas[pragma] = valor
+        self._versao += 1
+
+    @classmethod
+    @contextmanager
+    def carga(cls):
+        '''
+        Aplica os pragmas de PRAGMAS_CARGA a todas as conexões do processo durante o bloco with, para as cargas de dados
+        com muitos commits. Com o synchronous=NORMAL no modo WAL, um commit não espera a gravação em disco, que ocorre nos
+        checkpoints. Uma queda do sistema pode desfazer os últimos commits, mas não corrompe o DB.
+        Retorno: None, em um bloco with
+        '''
+        with cls._trava_cargas:
+            ConexaoDB._cargas += 1
+        try:
+            yield
+        finally:
+            with cls._trava_cargas:
+                ConexaoDB._cargas -= 1
 
     def existe(self):
         '''
@@ -48,6 +253,496 @@ class ConexaoDB:
         '''
         return os.path.isfile(self.arq_db)
 
+    def fechar(self):
+        '''
+        Fecha as conexões de todas as threads que não estão em uso. Elas são reabertas no próximo uso. É chamado antes de
+        um fork, pois o SQLite não admite que o processo filho herde conexões abertas.
+        Retorno: None
+        '''
+        with self._trava:
+            for estado in self._estados:
+                if estado['conn'] is None or estado['nivel'] or estado['pid'] != os.getpid(): continue
+                estado['conn'].close()
+                estado['conn'] = None
+            self._estados = [estado for estado in self._estados if estado['conn'] is not None]
+
+    def _executar_pragmas(self, conn, pragmas):
+        '''
+        Executa os pragmas na conexão.
+        Parâmetros:
+            conn (sqlite3.Connection) --> Conexão
+            pragmas (dict str:str) --> Pragmas e os seus valores
+        Retorno: None
+        '''
+        for pragma, valor in pragmas.items():
+            conn.execute(f'PRAGMA {pragma}={valor}').fetchall()
+
+    def _obter_estado(self):
+        '''
+        Retorna o estado da conexão da thread atual, abrindo a conexão se ela ainda não foi aberta, se foi fechada, se foi
+        herdada de outro processo ou se os pragmas foram alterados desde a sua abertura. Deve ser chamado com a trava.
+        Retorno: dicionário com a conexão (sqlite3.Connection), o pid do processo que a abriu, a versão dos pragmas, o
+            nível de blocos with abertos e a indicação do modo de carga
+        '''
+        estado = getattr(self._local, 'estado', None)
+        if estado and estado['conn'] is not None and estado['pid'] == os.getpid() and estado['versao'] == self._versao:
+            return estado
+        if estado and estado['conn'] is not None and estado['pid'] == os.getpid():
+            estado['conn'].close()
+            self._estados.remove(estado)
+        # A conexão herdada de outro processo não é fechada, pois isso afetaria os bloqueios do processo original. O estado
+        # dela continua na lista apenas para que ela não seja fechada pelo coletor de lixo
+        if self.somente_leitura:
+            uri = f'file:{pathname2url(os.path.abspath(self.arq_db))}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, cached_statements=self.CACHE_COMANDOS, check_same_thread=False)
+        else: conn = sqlite3.connect(self.arq_db, cached_statements=self.CACHE_COMANDOS, check_same_thread=False)
+        self._executar_pragmas(conn, self._obter_pragmas())
+        estado = self._local.estado = dict(conn=conn, pid=os.getpid(), versao=self._versao, nivel=0, carga=False)
+        self._estados.append(estado)
+        if self.perfil is not None:
+            with self.perfil._trava:
+                self.perfil.conexoes += 1
+        return estado
+
+    def _obter_pragmas(self):
+        '''
+        Retorna os pragmas desta conexão, formados por PRAGMAS e pelos pragmas próprios. Na conexão somente para leitura,
+        o journal_mode é o do próprio DB.
+        Retorno: dicionário com os pragmas e os seus valores (dict str:str)
+        '''
+        pragmas = dict(self.PRAGMAS, **self._pragmas)
+        if self.somente_leitura: pragmas.pop('journal_mode', None)
+        return pragmas
+
+def _fechar_conexoes():
+    '''
+    Fecha as conexões ociosas de todas as instâncias de ConexaoDB. É registrada para ser executada antes de um fork.
+    Retorno: None
+    '''
+    for conexao in list(_CONEXOES): conexao.fechar()
+
+def _recriar_travas():
+    '''
+    Recria as travas das instâncias de ConexaoDB no processo filho, já que uma trava obtida por outra thread no momento do
+    fork nunca seria liberada. É registrada para ser executada no processo filho após um fork.
+    Retorno: None
+    '''
+    ConexaoDB._trava_cargas = threading.Lock()
+    for conexao in list(_CONEXOES): conexao._trava = threading.Lock()
+
+# O registro de funções executadas em um fork só está disponível a partir do Python 3.7
+if hasattr(os, 'register_at_fork'): os.register_at_fork(before=_fechar_conexoes, after_in_child=_recriar_travas)
+
+class PerfilSQL:
+    '''
+    Perfil dos comandos SQL executados pelas conexões de ConexaoDB às quais ele é associado. Os comandos são agrupados por
+    modelo, isto é, pelo texto do SQL com os espaços normalizados, os literais substituídos por "?" e as listas dos
+    operadores IN reduzidas a "IN (?, ...)".
+    Para cada modelo são acumulados a quantidade de execuções, o tempo total e o maior tempo (execução e leitura dos
+    resultados) e as linhas retornadas. Na primeira execução de um modelo que demore ao menos "lento" segundos, o plano de
+    execução (EXPLAIN QUERY PLAN) é capturado com os mesmos parâmetros. Também são contadas as conexões abertas e os commits.
+    Parâmetros:
+        lento (float) --> Tempo, em segundos, a partir do qual o plano de execução do comando é capturado (default: 0.1)
+    Atributos:
+        comandos (dict str:dict) --> Estatísticas de cada modelo de comando
+        conexoes (int) --> Quantidade de conexões abertas
+        commits (int) --> Quantidade de commits
+        tempo_commits (float) --> Tempo total gasto com os commits, em segundos
+    '''
+    RE_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    RE_LISTA = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+
+    def __init__(self, lento=0.1):
+        self.lento = lento
+        self.comandos = {}
+        self.conexoes = 0
+        self.commits = 0
+        self.tempo_commits = 0.0
+        self._trava = threading.Lock()
+
+    def acumular(self, comando, duracao=0.0, linhas=0):
+        '''
+        Acumula o tempo e as linhas da leitura dos resultados nas estatísticas de um modelo já registrado.
+        Parâmetros:
+            comando (dict) --> Estatísticas do modelo do comando, como retornadas por "registrar"
+            duracao (float) --> Tempo gasto, em segundos (default: 0.0)
+            linhas (int) --> Linhas retornadas (default: 0)
+        Retorno: None
+        '''
+        with self._trava:
+            comando['tempo_total'] += duracao
+            comando['linhas'] += linhas
+
+    def limpar(self):
+        '''
+        Descarta as estatísticas acumuladas.
+        Retorno: None
+        '''
+        with self._trava:
+            self.comandos = {}
+            self.conexoes = self.commits = 0
+            self.tempo_commits = 0.0
+
+    def modelo(self, sql):
+        '''
+        Normaliza o comando SQL para o seu modelo.
+        Parâmetros:
+            sql (str) --> Comando SQL
+        Retorno: o modelo do comando (str)
+        '''
+        sql = self.RE_LITERAL.sub('?', RE_ESPACO.sub(' ', sql).strip())
+        return self.RE_LISTA.sub('IN (?, ...)', sql)
+
+    def registrar(self, sql, duracao=0.0, linhas=0, execucao=True):
+        '''
+        Acumula o tempo e as linhas de um comando nas estatísticas do seu modelo.
+        Parâmetros:
+            sql (str) --> Comando SQL
+            duracao (float) --> Tempo gasto, em segundos (default: 0.0)
+            linhas (int) --> Linhas retornadas (default: 0)
+            execucao (boolean) --> Indica se é uma nova execução do comando ou a leitura dos resultados de uma execução já
+                registrada (default: True)
+        Retorno: as estatísticas do modelo do comando (dict)
+        '''
+        modelo = self.modelo(sql)
+        with self._trava:
+            comando = self.comandos.get(modelo)
+            if comando is None:
+                comando = self.comandos[modelo] = dict(execucoes=0, tempo_total=0.0, tempo_max=0.0, linhas=0, plano=None)
+            if execucao: comando['execucoes'] += 1
+        self.acumular(comando, duracao, linhas)
+        return comando
+
+    def registrar_commit(self, duracao):
+        '''
+        Acumula o tempo de um commit.
+        Parâmetros:
+            duracao (float) --> Tempo gasto, em segundos
+        Retorno: None
+        '''
+        with self._trava:
+            self.commits += 1
+            self.tempo_commits += duracao
+
+    def relatorio(self, top=10, ordem='tempo_total'):
+        '''
+        Mostra os comandos mais custosos, com os planos de execução capturados para os comandos lentos.
+        Parâmetros:
+            top (int) --> Quantidade de modelos de comando mostrados. Se None, mostra todos (default: 10)
+            ordem (str) --> Coluna usada para ordenar os comandos: 'tempo_total', 'tempo_max', 'execucoes' ou 'linhas'
+                (default: 'tempo_total')
+        Retorno: Pandas DataFrame com as estatísticas de todos os modelos de comando, ordenado pela coluna escolhida
+        '''
+        with self._trava:
+            dados = [dict(modelo=modelo, **comando) for modelo, comando in self.comandos.items()]
+        colunas = ['modelo', 'execucoes', 'tempo_total', 'tempo_medio', 'tempo_max', 'linhas', 'plano']
+        if not dados:
+            print('Nenhum comando SQL foi registrado no perfil.')
+            return pd.DataFrame(columns=colunas)
+        df = pd.DataFrame(dados)
+        df['tempo_medio'] = df['tempo_total'] / df['execucoes'].clip(lower=1)
+        df = df[colunas].sort_values(ordem, ascending=False).reset_index(drop=True)
+        print(f'{self.conexoes} conexões, {self.commits} commits ({self.tempo_commits:.3f} s), {int(df["execucoes"].sum())} '
+              f'execuções de {len(df)} comandos distintos em {df["tempo_total"].sum():.3f} s')
+        for _, comando in (df if top is None else df.head(top)).iterrows():
+            modelo = comando['modelo'] if len(comando['modelo']) <= 120 else comando['modelo'][:117] + '...'
+            print(f'{comando["tempo_total"]:9.3f} s  {comando["execucoes"]:8d} x  máx {comando["tempo_max"]:.4f} s  '
+                  f'{comando["linhas"]:9d} linhas  {modelo}')
+            for detalhe in comando['plano'] or []:
+                print(f'{"":14}{detalhe}')
+        return df
+
+class _CursorPerfilado:
+    '''
+    Cursor de SQLite3 que registra em um PerfilSQL o tempo de cada comando executado, somando a ele o tempo de leitura
+    dos resultados e as linhas retornadas. O comando é normalizado uma única vez, na execução, e o tempo e as linhas das
+    leituras são somados no cursor e acumulados no perfil quando os resultados terminam, quando o cursor é fechado ou na
+    execução seguinte. Os demais atributos são os do cursor original.
+    Parâmetros:
+        cursor (sqlite3.Cursor) --> Cursor original
+        perfil (PerfilSQL) --> Perfil onde os comandos são registrados
+    '''
+    def __init__(self, cursor, perfil):
+        self._cursor = cursor
+        self._perfil = perfil
+        self._execucao = None
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        while True:
+            linha = self.fetchone()
+            if linha is None: return
+            yield linha
+
+    def close(self):
+        self._descarregar()
+        self._cursor.close()
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        self._cursor.execute(sql, parametros)
+        self._registrar(time.perf_counter() - inicio, sql=sql, parametros=parametros)
+        return self
+
+    def executemany(self, sql, seq_parametros):
+        inicio = time.perf_counter()
+        self._cursor.executemany(sql, seq_parametros)
+        self._registrar(time.perf_counter() - inicio, sql=sql)
+        return self
+
+    def executescript(self, script):
+        inicio = time.perf_counter()
+        self._cursor.executescript(script)
+        self._registrar(time.perf_counter() - inicio, sql=script)
+        return self
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        linhas = self._cursor.fetchall()
+        self._registrar(time.perf_counter() - inicio, linhas=len(linhas), fim=True)
+        return linhas
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        inicio = time.perf_counter()
+        linhas = self._cursor.fetchmany(size)
+        self._registrar(time.perf_counter() - inicio, linhas=len(linhas), fim=len(linhas) < size)
+        return linhas
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        linha = self._cursor.fetchone()
+        self._registrar(time.perf_counter() - inicio, linhas=0 if linha is None else 1, fim=linha is None)
+        return linha
+
+    def _descarregar(self):
+        '''
+        Acumula no perfil o tempo e as linhas das leituras dos resultados da última execução ainda não acumulados.
+        Retorno: None
+        '''
+        if self._execucao is None or not (self._execucao[4] or self._execucao[5]): return
+        self._perfil.acumular(self._execucao[2], self._execucao[4], self._execucao[5])
+        self._execucao[4:] = [0.0, 0]
+
+    def _registrar(self, duracao, sql=None, parametros=None, linhas=0, fim=False):
+        '''
+        Registra no perfil uma execução (se "sql" for passado) ou soma a leitura dos resultados à última execução, capturando
+        o plano de execução do comando se a execução, somada às leituras, passar do limite de lentidão do perfil.
+        Parâmetros:
+            duracao (float) --> Tempo gasto, em segundos
+            sql (str) --> Comando executado, ou None para a leitura dos resultados (default: None)
+            parametros (tuple ou dict) --> Parâmetros do comando, ou None se o plano não puder ser capturado (default: None)
+            linhas (int) --> Linhas lidas (default: 0)
+            fim (boolean) --> Indica se a leitura chegou ao fim dos resultados (default: False)
+        Retorno: None
+        '''
+        if sql is not None:
+            self._descarregar()
+            self._execucao = [sql, parametros, self._perfil.registrar(sql, duracao), duracao, 0.0, 0]
+        elif self._execucao is None:
+            return
+        else:
+            self._execucao[3] += duracao
+            self._execucao[4] += duracao
+            self._execucao[5] += linhas
+            if fim: self._descarregar()
+        sql, parametros, comando, total = self._execucao[:4]
+        if total > comando['tempo_max']: comando['tempo_max'] = total
+        if total < self._perfil.lento or comando['plano'] is not None or parametros is None: return
+        try:
+            plano = self._cursor.connection.execute(f'EXPLAIN QUERY PLAN {sql}', parametros).fetchall()
+            comando['plano'] = [linha[-1] for linha in plano]
+        except sqlite3.Error:
+            comando['plano'] = []
+
+class TabelaFichas:
+    '''
+    Tabela em memória dos nomes das fichas de um corpus, indexada pelo id da ficha. Os nomes ficam concatenados em um único
+    buffer de bytes (UTF-8) com um vetor de deslocamentos, o que mantém a tabela compacta, e um dicionário faz o mapeamento
+    do nome para o id. Os ids das fichas são sequenciais a partir de zero, na ordem em que são incluídas. A inclusão e a
+    leitura de vários nomes são protegidas por uma trava, o que permite incluir fichas enquanto outras threads consultam.
+    Parâmetros:
+        fichas (iterável de string) --> Nomes das fichas na ordem dos ids (default: None)
+    '''
+    def __init__(self, fichas=None):
+        self._buffer = bytearray()
+        self._offsets = array('q', [0])
+        self._ids = {}
+        self._trava = threading.Lock()
+        for ficha in fichas or []: self.incluir(ficha)
+
+    def __contains__(self, ficha):
+        return ficha in self._ids
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def id(self, ficha):
+        '''
+        Retorna o id da ficha ou None se a ficha não estiver na tabela.
+        Parâmetros:
+            ficha (string) --> Nome da ficha
+        Retorno: o id da ficha (int) ou None
+        '''
+        return self._ids.get(ficha)
+
+    def incluir(self, ficha):
+        '''
+        Inclui uma ficha ao final da tabela.
+        Parâmetros:
+            ficha (string) --> Nome da ficha
+        Retorno: o id atribuído à ficha (int)
+        '''
+        with self._trava:
+            id_ficha = len(self)
+            self._buffer += ficha.encode('utf-8')
+            self._offsets.append(len(self._buffer))
+            self._ids[ficha] = id_ficha
+        return id_ficha
+
+    def nome(self, id_ficha):
+        '''
+        Retorna o nome da ficha ou None se o id estiver fora dos limites da tabela.
+        Parâmetros:
+            id_ficha (int) --> Id da ficha
+        Retorno: o nome da ficha (string) ou None
+        '''
+        if not 0 <= id_ficha < len(self): return None
+        return self._buffer[self._offsets[id_ficha]:self._offsets[id_ficha+1]].decode('utf-8')
+
+    def nomes(self, ids_fichas):
+        '''
+        Retorna os nomes de um conjunto de fichas. Os deslocamentos de todas as fichas são obtidos de uma só vez no vetor
+        de deslocamentos e apenas o trecho do buffer de cada ficha é copiado. Os ids fora dos limites da tabela resultam em
+        None.
+        Parâmetros:
+            ids_fichas (iterável de int) --> Ids das fichas
+        Retorno: lista com os nomes das fichas (list de string)
+        '''
+        ids = np.asarray(ids_fichas, dtype=np.int64).ravel()
+        # O vetor de deslocamentos é lido sem cópia, o que impede o seu redimensionamento enquanto durar a leitura. A trava
+        # faz a inclusão de fichas aguardar a liberação do vetor
+        with self._trava:
+            offsets = np.frombuffer(self._offsets, dtype=np.int64)
+            validos = (ids >= 0) & (ids < len(offsets) - 1)
+            seguros = np.where(validos, ids, 0)
+            inicios, fins = offsets[seguros].tolist(), offsets[seguros + 1].tolist()
+            del offsets
+            return [self._buffer[ini:fim].decode('utf-8') if valido else None
+                    for ini, fim, valido in zip(inicios, fins, validos.tolist())]
+
+    def todas(self):
+        '''
+        Retorna a lista de todas as fichas na ordem dos ids.
+        Retorno: lista de fichas (list de string)
+        '''
+        return self.nomes(range(len(self)))
+
+class CacheLRU:
+    '''
+    Cache em memória com descarte dos itens usados há mais tempo (LRU), limitado em quantidade de itens e em bytes. O tamanho
+    de cada item é estimado na inclusão. É seguro para uso por várias threads.
+    Parâmetros:
+        max_itens (int) --> Quantidade máxima de itens. Se for 0, o cache fica desativado (default: 1000)
+        max_bytes (int) --> Tamanho máximo estimado, em bytes, da soma dos itens (default: 256 MB)
+    Atributos:
+        max_itens (int) --> Quantidade máxima de itens
+        max_bytes (int) --> Tamanho máximo estimado da soma dos itens
+        bytes (int) --> Tamanho estimado da soma dos itens atuais
+        acertos (int) --> Quantidade de consultas encontradas no cache
+        falhas (int) --> Quantidade de consultas não encontradas no cache
+    '''
+    def __init__(self, max_itens=1000, max_bytes=256*2**20):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.acertos = 0
+        self.falhas = 0
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def __contains__(self, chave):
+        return chave in self._itens
+
+    def __len__(self):
+        return len(self._itens)
+
+    def ajustar(self, max_itens=None, max_bytes=None):
+        '''
+        Altera os limites do cache, descartando os itens que excederem os novos limites.
+        Parâmetros:
+            max_itens (int) --> Quantidade máxima de itens. Se None, mantém o limite atual (default: None)
+            max_bytes (int) --> Tamanho máximo estimado em bytes. Se None, mantém o limite atual (default: None)
+        Retorno: None
+        '''
+        with self._trava:
+            if max_itens is not None: self.max_itens = max_itens
+            if max_bytes is not None: self.max_bytes = max_bytes
+            self._descartar()
+
+    def guardar(self, chave, valor):
+        '''
+        Inclui um item no cache, descartando os itens usados há mais tempo se os limites forem excedidos. Um item maior que
+        o limite de bytes não é guardado.
+        Parâmetros:
+            chave (hashable) --> Chave do item
+            valor (objeto) --> Valor do item
+        Retorno: None
+        '''
+        if not self.max_itens: return
+        tamanho = self._tamanho(valor)
+        if tamanho > self.max_bytes: return
+        with self._trava:
+            if chave in self._itens: self.bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (valor, tamanho)
+            self.bytes += tamanho
+            self._descartar()
+
+    def limpar(self):
+        '''
+        Descarta todos os itens do cache.
+        Retorno: None
+        '''
+        with self._trava:
+            self._itens.clear()
+            self.bytes = 0
+
+    def obter(self, chave, default=None):
+        '''
+        Obtém um item do cache, marcando-o como o usado mais recentemente.
+        Parâmetros:
+            chave (hashable) --> Chave do item
+            default (objeto) --> Valor retornado se a chave não estiver no cache (default: None)
+        Retorno: o valor do item ou default
+        '''
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                self.falhas += 1
+                return default
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[0]
+
+    def _descartar(self):
+        '''
+        Descarta os itens usados há mais tempo até que os limites sejam respeitados.
+        '''
+        while self._itens and (len(self._itens) > self.max_itens or self.bytes > self.max_bytes):
+            self.bytes -= self._itens.popitem(last=False)[1][1]
+
+    def _tamanho(self, valor):
+        '''
+        Estima o tamanho em bytes de um valor, considerando os DataFrames, os arrays do numpy e as coleções que os contêm.
+        '''
+        if isinstance(valor, (pd.DataFrame, pd.Series)): return int(np.sum(valor.memory_usage(index=True, deep=True)))
+        if isinstance(valor, np.ndarray): return valor.nbytes
+        if isinstance(valor, dict): return sys.getsizeof(valor) + sum(self._tamanho(v) for v in valor.values())
+        if isinstance(valor, (list, tuple)): return sys.getsizeof(valor) + sum(self._tamanho(v) for v in valor)
+        return sys.getsizeof(valor)
+
 class StreamCSV:
     '''
     Essa classe recebe o endereço onde se encontra um dataset armazenado no formato CSV e o transforma em um Stream para a